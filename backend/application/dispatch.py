@@ -1,7 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
 from django.conf import settings
+from django.core.cache import caches
 from django.db import connection
+from django.utils.module_loading import import_string
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
 
 
 def is_tenants_mode():
@@ -18,20 +31,31 @@ def is_tenants_mode():
 def _get_all_dictionary():
     from dvadmin.system.models import Dictionary
 
-    queryset = Dictionary.objects.filter(status=True, is_value=False)
-    data = []
+    # 一次查询取出全部启用的字典项, 在内存中按父级分组
+    queryset = Dictionary.objects.filter(status=True).values(
+        "id", "parent_id", "is_value", "label", "value", "type", "color"
+    )
+    parents = []
+    children_map = {}
     for instance in queryset:
-        data.append(
+        if not instance["is_value"]:
+            parents.append(instance)
+        children_map.setdefault(instance["parent_id"], []).append(
             {
-                "id": instance.id,
-                "value": instance.value,
-                "children": list(
-                    Dictionary.objects.filter(parent=instance.id)
-                    .filter(status=1)
-                    .values("label", "value", "type", "color")
-                ),
+                "label": instance["label"],
+                "value": instance["value"],
+                "type": instance["type"],
+                "color": instance["color"],
             }
         )
+    data = [
+        {
+            "id": instance["id"],
+            "value": instance["value"],
+            "children": children_map.get(instance["id"], []),
+        }
+        for instance in parents
+    ]
     return {ele.get("value"): ele for ele in data}
 
 
@@ -62,20 +86,293 @@ def _get_all_system_config():
     return data
 
 
+# ================================================= #
+# ******************** 共享存储 ******************** #
+# ================================================= #
+class BaseConfigStore:
+    """
+    系统配置/字典共享存储
+    每份配置按 (类别, 租户) 存放一个单调递增的版本号和对应的数据,
+    各进程内存中(settings.SYSTEM_CONFIG/DICTIONARY_CONFIG)的副本通过比对版本号判断是否需要重新加载
+    """
+
+    def get_version(self, kind, schema_name=None):
+        """获取当前版本号, 不存在时初始化"""
+        raise NotImplementedError
+
+    def bump_version(self, kind, schema_name=None):
+        """递增版本号并返回新版本号"""
+        raise NotImplementedError
+
+    def get(self, kind, schema_name=None):
+        """获取数据, 返回 (版本号, 数据), 不存在时返回 None"""
+        raise NotImplementedError
+
+    def set(self, kind, schema_name, version, data):
+        """保存指定版本号的数据"""
+        raise NotImplementedError
+
+    @staticmethod
+    def initial_version():
+        # 以毫秒时间戳作为初始值, 避免存储被清空后版本号回退
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def make_key(kind, schema_name=None):
+        return f"{kind}.{schema_name}" if schema_name else kind
+
+
+class CacheConfigStore(BaseConfigStore):
+    """
+    基于 django cache 的存储, 多进程/多节点部署时 alias 需指向 redis 等共享缓存
+    """
+    key_prefix = "dvadmin:config:"
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _version_key(self, kind, schema_name):
+        return f"{self.key_prefix}version:{self.make_key(kind, schema_name)}"
+
+    def _data_key(self, kind, schema_name):
+        return f"{self.key_prefix}data:{self.make_key(kind, schema_name)}"
+
+    def get_version(self, kind, schema_name=None):
+        key = self._version_key(kind, schema_name)
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, self.initial_version(), timeout=None)
+            version = self.cache.get(key)
+        return version
+
+    def bump_version(self, kind, schema_name=None):
+        key = self._version_key(kind, schema_name)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, self.initial_version(), timeout=None)
+            return self.cache.get(key)
+
+    def get(self, kind, schema_name=None):
+        return self.cache.get(self._data_key(kind, schema_name))
+
+    def set(self, kind, schema_name, version, data):
+        self.cache.set(self._data_key(kind, schema_name), (version, data), timeout=None)
+
+
+class FileConfigStore(BaseConfigStore):
+    """
+    基于本地文件的存储, 单机多进程部署且没有 redis 时使用
+    """
+
+    def __init__(self, location=None):
+        self.location = Path(location or Path(settings.BASE_DIR) / "cache" / "config")
+        self.location.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, kind, schema_name, suffix):
+        return self.location / f"{self.make_key(kind, schema_name)}.{suffix}"
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path, value):
+        # 先写临时文件再替换, 其他进程不会读到写了一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get_version(self, kind, schema_name=None):
+        version = self._read(self._path(kind, schema_name, "version"))
+        if version is None:
+            version = self.bump_version(kind, schema_name)
+        return version
+
+    def bump_version(self, kind, schema_name=None):
+        path = self._path(kind, schema_name, "version")
+        with open(self._path(kind, schema_name, "lock"), "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # 取时间戳与原版本号+1中的较大者, 保证单调递增
+                version = max((self._read(path) or 0) + 1, self.initial_version())
+                self._write(path, version)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return version
+
+    def get(self, kind, schema_name=None):
+        value = self._read(self._path(kind, schema_name, "data"))
+        if not value:
+            return None
+        return value.get("version"), value.get("data")
+
+    def set(self, kind, schema_name, version, data):
+        self._write(self._path(kind, schema_name, "data"), {"version": version, "data": data})
+
+
+_config_store = None
+
+
+def get_config_store():
+    """
+    获取共享存储实例, 由 settings.CONFIG_STORE 配置
+    :return:
+    """
+    global _config_store
+    if _config_store is None:
+        config = getattr(settings, "CONFIG_STORE", None) or {}
+        backend = import_string(config.get("BACKEND", "application.dispatch.CacheConfigStore"))
+        _config_store = backend(**config.get("OPTIONS", {}))
+    return _config_store
+
+
+CONFIG_KINDS = {
+    "dictionary": ("DICTIONARY_CONFIG", _get_all_dictionary),
+    "system_config": ("SYSTEM_CONFIG", _get_all_system_config),
+}
+# 各进程内存副本的 {(类别, 租户): [版本号, 上次校验时间]}
+_local_versions = {}
+# 各进程内存副本的 {(类别, 租户): {key: {value: label}}}
+_label_indexes = {}
+
+
+def _build_label_index(kind, data):
+    """
+    构建 key -> {value: label} 索引, 同一 value 以第一个为准
+    """
+    index = {}
+    for key, value in (data or {}).items():
+        children = value.get("children") if kind == "dictionary" else value
+        if not isinstance(children, list):
+            continue
+        labels = index[key] = {}
+        for ele in children:
+            if isinstance(ele, dict) and isinstance(ele.get("value"), str):
+                labels.setdefault(ele["value"], ele.get("label"))
+    return index
+
+
+def _set_local_config(kind, schema_name, version, data):
+    setting_name = CONFIG_KINDS[kind][0]
+    if schema_name:
+        getattr(settings, setting_name)[schema_name] = data
+    else:
+        setattr(settings, setting_name, data)
+    _label_indexes[(kind, schema_name)] = _build_label_index(kind, data)
+    _local_versions[(kind, schema_name)] = [version, time.monotonic()]
+
+
+def _get_local_config(kind, schema_name):
+    config = getattr(settings, CONFIG_KINDS[kind][0])
+    if schema_name:
+        return config.get(schema_name)
+    return config
+
+
+def _query_config(kind, schema_name):
+    loader = CONFIG_KINDS[kind][1]
+    if schema_name and schema_name != connection.tenant.schema_name:
+        from django_tenants.utils import tenant_context, get_tenant_model
+
+        with tenant_context(get_tenant_model().objects.get(schema_name=schema_name)):
+            return loader()
+    return loader()
+
+
+def _load_config(kind, schema_name, version=None):
+    """
+    加载配置到内存: 共享存储中的数据与版本号一致时直接使用, 否则查询数据库并写回共享存储
+    """
+    store = get_config_store()
+    if version is None:
+        version = store.get_version(kind, schema_name)
+    cached = store.get(kind, schema_name)
+    if cached and cached[0] == version:
+        data = cached[1]
+    else:
+        data = _query_config(kind, schema_name)
+        store.set(kind, schema_name, version, data)
+    _set_local_config(kind, schema_name, version, data)
+    return data
+
+
+def _refresh_config(kind, schema_name):
+    """
+    数据变化后先递增版本号再重新查询数据库并写入共享存储, 其他进程校验版本号后自动重新加载
+    先递增版本号: 并发刷新时先查询的旧数据即使后写入, 也只会带着旧版本号, 读取方比对版本号不一致会重新查询
+    """
+    store = get_config_store()
+    version = store.bump_version(kind, schema_name)
+    data = _query_config(kind, schema_name)
+    store.set(kind, schema_name, version, data)
+    _set_local_config(kind, schema_name, version, data)
+
+
+def _get_schema_name(schema_name=None):
+    if is_tenants_mode():
+        return schema_name or connection.tenant.schema_name
+    return None
+
+
+def _get_config(kind, schema_name=None):
+    """
+    获取配置, 内存副本超过校验间隔后比对共享存储中的版本号, 版本号变化时重新加载
+    """
+    schema_name = _get_schema_name(schema_name)
+    local_version = _local_versions.get((kind, schema_name))
+    if local_version is None:
+        return _load_config(kind, schema_name)
+    now = time.monotonic()
+    if now - local_version[1] < getattr(settings, "CONFIG_STORE_CHECK_INTERVAL", 1):
+        return _get_local_config(kind, schema_name)
+    version = get_config_store().get_version(kind, schema_name)
+    if version != local_version[0]:
+        return _load_config(kind, schema_name, version)
+    local_version[1] = now
+    return _get_local_config(kind, schema_name)
+
+
+def _get_label(kind, key, name, schema_name=None):
+    _get_config(kind, schema_name)
+    labels = _label_indexes.get((kind, _get_schema_name(schema_name)), {}).get(key) or {}
+    return labels.get(str(name), "")
+
+
+def _for_each_schema(func, kind):
+    if is_tenants_mode():
+        from django_tenants.utils import tenant_context, get_tenant_model
+
+        for tenant in get_tenant_model().objects.filter():
+            with tenant_context(tenant):
+                func(kind, connection.tenant.schema_name)
+    else:
+        func(kind, None)
+
+
 def init_dictionary():
     """
-    初始化字典配置
+    初始化字典配置, 优先从共享存储加载
     :return:
     """
     try:
-        if is_tenants_mode():
-            from django_tenants.utils import tenant_context, get_tenant_model
-
-            for tenant in get_tenant_model().objects.filter():
-                with tenant_context(tenant):
-                    settings.DICTIONARY_CONFIG[connection.tenant.schema_name] = _get_all_dictionary()
-        else:
-            settings.DICTIONARY_CONFIG = _get_all_dictionary()
+        _for_each_schema(_load_config, "dictionary")
     except Exception as e:
         print("请先进行数据库迁移!")
     return
@@ -83,20 +380,12 @@ def init_dictionary():
 
 def init_system_config():
     """
-    初始化系统配置
+    初始化系统配置, 优先从共享存储加载
     :param name:
     :return:
     """
     try:
-
-        if is_tenants_mode():
-            from django_tenants.utils import tenant_context, get_tenant_model
-
-            for tenant in get_tenant_model().objects.filter():
-                with tenant_context(tenant):
-                    settings.SYSTEM_CONFIG[connection.tenant.schema_name] = _get_all_system_config()
-        else:
-            settings.SYSTEM_CONFIG = _get_all_system_config()
+        _for_each_schema(_load_config, "system_config")
     except Exception as e:
         print("请先进行数据库迁移!")
     return
@@ -107,14 +396,7 @@ def refresh_dictionary():
     刷新字典配置
     :return:
     """
-    if is_tenants_mode():
-        from django_tenants.utils import tenant_context, get_tenant_model
-
-        for tenant in get_tenant_model().objects.filter():
-            with tenant_context(tenant):
-                settings.DICTIONARY_CONFIG[connection.tenant.schema_name] = _get_all_dictionary()
-    else:
-        settings.DICTIONARY_CONFIG = _get_all_dictionary()
+    _for_each_schema(_refresh_config, "dictionary")
 
 
 def refresh_system_config():
@@ -122,14 +404,7 @@ def refresh_system_config():
     刷新系统配置
     :return:
     """
-    if is_tenants_mode():
-        from django_tenants.utils import tenant_context, get_tenant_model
-
-        for tenant in get_tenant_model().objects.filter():
-            with tenant_context(tenant):
-                settings.SYSTEM_CONFIG[connection.tenant.schema_name] = _get_all_system_config()
-    else:
-        settings.SYSTEM_CONFIG = _get_all_system_config()
+    _for_each_schema(_refresh_config, "system_config")
 
 
 # ================================================= #
@@ -141,12 +416,7 @@ def get_dictionary_config(schema_name=None):
     :param schema_name: 对应字典配置的租户schema_name值
     :return:
     """
-    if not settings.DICTIONARY_CONFIG:
-        refresh_dictionary()
-    if is_tenants_mode():
-        dictionary_config = settings.DICTIONARY_CONFIG[schema_name or connection.tenant.schema_name]
-    else:
-        dictionary_config = settings.DICTIONARY_CONFIG
+    dictionary_config = _get_config("dictionary", schema_name)
     return dictionary_config or {}
 
 
@@ -169,11 +439,7 @@ def get_dictionary_label(key, name, schema_name=None):
     :param schema_name: 对应字典配置的租户schema_name值
     :return:
     """
-    children = get_dictionary_values(key, schema_name) or []
-    for ele in children:
-        if ele.get("value") == str(name):
-            return ele.get("label")
-    return ""
+    return _get_label("dictionary", key, name, schema_name)
 
 
 # ================================================= #
@@ -187,13 +453,8 @@ def get_system_config(schema_name=None):
     :param schema_name: 对应字典配置的租户schema_name值
     :return:
     """
-    if not settings.SYSTEM_CONFIG:
-        refresh_system_config()
-    if is_tenants_mode():
-        dictionary_config = settings.SYSTEM_CONFIG[schema_name or connection.tenant.schema_name]
-    else:
-        dictionary_config = settings.SYSTEM_CONFIG
-    return dictionary_config or {}
+    system_config = _get_config("system_config", schema_name)
+    return system_config or {}
 
 
 def get_system_config_values(key, schema_name=None):
@@ -215,8 +476,4 @@ def get_system_config_label(key, name, schema_name=None):
     :param schema_name: 对应系统配置的租户schema_name值
     :return:
     """
-    children = get_system_config_values(key, schema_name) or []
-    for ele in children:
-        if ele.get("value") == str(name):
-            return ele.get("label")
-    return ""
+    return _get_label("system_config", key, name, schema_name)
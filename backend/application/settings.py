@@ -192,6 +192,23 @@ CHANNEL_LAYERS = {
 # }
 
 
+# ================================================= #
+# ********************* 缓存配置 ******************* #
+# ================================================= #
+# 权限、配置等缓存通过共享缓存中的版本号同步失效, 多进程/多节点部署时请使用 redis 等共享缓存
+CACHES = locals().get("CACHES", {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+})
+# CACHES = {
+#     "default": {
+#         "BACKEND": "django.core.cache.backends.redis.RedisCache",
+#         "LOCATION": f"{REDIS_URL}/{REDIS_DB}",
+#     }
+# }
+
+
 # ================================================= #
 # ********************* 日志配置 ******************* #
 # ================================================= #
@@ -371,6 +388,32 @@ DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 API_LOG_ENABLE = True
 # API_LOG_METHODS = 'ALL' # ['POST', 'DELETE']
 API_LOG_METHODS = ["POST", "UPDATE", "DELETE", "PUT"]  # ['POST', 'DELETE']
+# 操作日志异步批量写入: 队列长度、每批条数、最长写入间隔(秒)、队列满时最长等待时间(秒)
+API_LOG_ASYNC = locals().get("API_LOG_ASYNC", True)
+API_LOG_QUEUE_SIZE = locals().get("API_LOG_QUEUE_SIZE", 10000)
+API_LOG_BATCH_SIZE = locals().get("API_LOG_BATCH_SIZE", 200)
+API_LOG_FLUSH_INTERVAL = locals().get("API_LOG_FLUSH_INTERVAL", 1.0)
+API_LOG_BLOCK_TIMEOUT = locals().get("API_LOG_BLOCK_TIMEOUT", 0.05)
+# 系统通知(目标类型为3)广播存储: 只保存一条消息, 按用户已读水位记录已读状态, 不为每个用户保存目标用户记录
+MESSAGE_BROADCAST_STORAGE = locals().get("MESSAGE_BROADCAST_STORAGE", True)
+# 后台导入/导出任务执行方式, 为空时安装了 dvadmin-celery 插件则使用 celery, 否则使用进程内线程池
+ASYNC_JOB_EXECUTOR = locals().get("ASYNC_JOB_EXECUTOR", None)
+ASYNC_JOB_EXECUTOR_OPTIONS = locals().get("ASYNC_JOB_EXECUTOR_OPTIONS", {})
+# 登录日志ip归属地查询方式, 按顺序查询, 离线库格式见 dvadmin.utils.ip_location.OfflineIpLocationProvider
+IP_LOCATION_PROVIDERS = locals().get("IP_LOCATION_PROVIDERS", [
+    {
+        "BACKEND": "dvadmin.utils.ip_location.OfflineIpLocationProvider",
+        "OPTIONS": {"path": os.path.join(BASE_DIR, "conf", "ip_location.csv")},
+    },
+    {
+        "BACKEND": "dvadmin.utils.ip_location.RemoteIpLocationProvider",
+        "OPTIONS": {"url": "https://ip.django-vue-admin.com/ip/analysis", "timeout": 5},
+    },
+])
+# ip归属地缓存条数
+IP_LOCATION_CACHE_SIZE = locals().get("IP_LOCATION_CACHE_SIZE", 10000)
+# 登录日志先写入, ip归属地在后台查询后补充
+IP_LOCATION_ASYNC = locals().get("IP_LOCATION_ASYNC", True)
 API_MODEL_MAP = {
     "/token/": "登录模块",
     "/api/login/": "登录模块",
@@ -393,6 +436,20 @@ TABLE_PREFIX = locals().get('TABLE_PREFIX', "")
 SYSTEM_CONFIG = {}
 # 字典配置
 DICTIONARY_CONFIG = {}
+# 系统配置/字典共享存储, 各进程通过版本号同步, 多进程/多节点部署时请使用 redis 等共享缓存
+# 单机无 redis 时可使用本地文件: {"BACKEND": "application.dispatch.FileConfigStore", "OPTIONS": {"location": ...}}
+CONFIG_STORE = locals().get("CONFIG_STORE", {
+    "BACKEND": "application.dispatch.CacheConfigStore",
+    "OPTIONS": {"alias": "default"},
+})
+# 进程内配置副本校验版本号的间隔(秒)
+CONFIG_STORE_CHECK_INTERVAL = locals().get("CONFIG_STORE_CHECK_INTERVAL", 1)
+# 分页总数: 表行数估算值不小于该值时才使用估算, 否则精确统计
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = locals().get("PAGINATION_COUNT_ESTIMATE_THRESHOLD", 100000)
+# 分页总数: 带筛选条件的总数缓存时间(秒)
+PAGINATION_COUNT_CACHE_TIMEOUT = locals().get("PAGINATION_COUNT_CACHE_TIMEOUT", 60)
+# 创建人、修改人名称的进程内缓存时间(秒)
+IDENTITY_NAME_CACHE_TIMEOUT = locals().get("IDENTITY_NAME_CACHE_TIMEOUT", 30)
 
 # ================================================= #
 # ******************** 插件配置 ******************** #
@@ -33,6 +33,7 @@ from dvadmin.system.views.login import (
     LoginTokenView
 )
 from dvadmin.system.views.system_config import InitSettingsViewSet
+from dvadmin.utils.filters import warm_filterset_cache, get_urlpatterns_viewsets
 from dvadmin.utils.swagger import CustomOpenAPISchemaGenerator
 
 # =========== 初始化系统配置 =================
@@ -120,3 +121,6 @@ urlpatterns = (
         + static(settings.STATIC_URL, document_root=settings.STATIC_URL)
         + [re_path(ele.get('re_path'), include(ele.get('include'))) for ele in settings.PLUGINS_URL_PATTERNS]
 )
+
+# 预先生成各视图集(包含插件)的过滤器类
+warm_filterset_cache(get_urlpatterns_viewsets(urlpatterns))
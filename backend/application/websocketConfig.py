@@ -7,12 +7,14 @@ from channels.generic.websocket import AsyncJsonWebsocketConsumer, AsyncWebsocke
 import json
 
 from channels.layers import get_channel_layer
+from django.db import transaction
 from jwt import InvalidSignatureError
 from rest_framework.request import Request
 
 from application import settings
-from dvadmin.system.models import MessageCenter, Users, MessageCenterTargetUser
-from dvadmin.system.views.message_center import MessageCenterTargetUserSerializer
+from dvadmin.system.models import MessageCenter
+from dvadmin.utils.message_fanout import get_target_user_ids, message_fanout, is_broadcast_storage, \
+    get_unread_count, BROADCAST_GROUP
 from dvadmin.utils.serializers import CustomModelSerializer
 
 send_dict = {}
@@ -43,8 +45,7 @@ def _get_message_center_instance(message_id):
 @database_sync_to_async
 def _get_message_unread(user_id):
     """获取用户的未读消息数量"""
-    from dvadmin.system.models import MessageCenterTargetUser
-    count = MessageCenterTargetUser.objects.filter(users=user_id, is_read=False).count()
+    count = get_unread_count(user_id)
     return count or 0
 
 
@@ -68,6 +69,8 @@ class DvadminWebSocket(AsyncJsonWebsocketConsumer):
                     self.chat_group_name,
                     self.channel_name
                 )
+                # 加入广播分组, 接收广播存储的系统通知
+                await self.channel_layer.group_add(BROADCAST_GROUP, self.channel_name)
                 await self.accept()
                 # 主动推送消息
                 unread_count = await _get_message_unread(self.user_id)
@@ -84,6 +87,7 @@ class DvadminWebSocket(AsyncJsonWebsocketConsumer):
     async def disconnect(self, close_code):
         # Leave room group
         await self.channel_layer.group_discard(self.chat_group_name, self.channel_name)
+        await self.channel_layer.group_discard(BROADCAST_GROUP, self.channel_name)
         print("连接关闭")
         try:
             await self.close(close_code)
@@ -112,6 +116,11 @@ class MegCenter(DvadminWebSocket):
         message = event['json']
         await self.send(text_data=json.dumps(message))
 
+    async def push_broadcast(self, event):
+        """广播消息发送, 未读数量按当前连接的用户计算"""
+        unread_count = await _get_message_unread(self.user_id)
+        await self.send(text_data=json.dumps({**event['json'], 'unread': unread_count}))
+
 
 class MessageCreateSerializer(CustomModelSerializer):
     """
@@ -153,31 +162,13 @@ def create_message_push(title: str, content: str, target_type: int = 0, target_u
     }
     message_center_instance = MessageCreateSerializer(data=data, request=request)
     message_center_instance.is_valid(raise_exception=True)
+    if is_broadcast_storage(target_type):
+        # 系统通知广播存储, 不逐个保存目标用户
+        with transaction.atomic():
+            message_center_instance.save(broadcast=True)
+            message_fanout.broadcast(message_center_instance.instance, message)
+        return
     message_center_instance.save()
-    users = target_user or []
-    if target_type in [1]:  # 按角色
-        users = Users.objects.filter(role__id__in=target_role).values_list('id', flat=True)
-    if target_type in [2]:  # 按部门
-        users = Users.objects.filter(dept__id__in=target_dept).values_list('id', flat=True)
-    if target_type in [3]:  # 系统通知
-        users = Users.objects.values_list('id', flat=True)
-    targetuser_data = []
-    for user in users:
-        targetuser_data.append({
-            "messagecenter": message_center_instance.instance.id,
-            "users": user
-        })
-    targetuser_instance = MessageCenterTargetUserSerializer(data=targetuser_data, many=True, request=request)
-    targetuser_instance.is_valid(raise_exception=True)
-    targetuser_instance.save()
-    for user in users:
-        username = "user_" + str(user)
-        unread_count = async_to_sync(_get_message_unread)(user)
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            username,
-            {
-                "type": "push.message",
-                "json": {**message, 'unread': unread_count}
-            }
-        )
+    users = get_target_user_ids(target_type, target_user=target_user, target_role=target_role,
+                                target_dept=target_dept)
+    message_fanout.fan_out(message_center_instance.instance, users, message, request=request)
@@ -37,7 +37,7 @@ REDIS_URL = f'redis://:{REDIS_PASSWORD or ""}@{REDIS_HOST}:6379'
 # ****************** 功能 启停  ******************* #
 # ================================================= #
 DEBUG = True
-# 启动登录详细概略获取(通过调用api获取ip详细地址。如果是内网，关闭即可)
+# 启动登录详细概略获取(优先查询本地离线库 conf/ip_location.csv, 查不到时调用api获取ip详细地址。如果是内网，关闭即可)
 ENABLE_LOGIN_ANALYSIS_LOG = True
 # 登录接口 /api/token/ 是否需要验证码认证，用于测试，正式环境建议取消
 LOGIN_NO_CAPTCHA_AUTH = True
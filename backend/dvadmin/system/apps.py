@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class SystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dvadmin.system'
+
+    def ready(self):
+        from dvadmin.system import signals  # noqa: F401 注册信号
+        from dvadmin.utils.jobs import get_job_executor
+        from dvadmin.utils.models import get_model_registry
+
+        # 生成模型注册表
+        get_model_registry()
+        # 检查后台任务执行器配置, celery 执行时需使用共享缓存
+        get_job_executor()
@@ -3,6 +3,8 @@ import os
 
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from application import dispatch
 from dvadmin.utils.models import CoreModel, table_prefix, get_custom_app_models
@@ -118,25 +120,95 @@ class Dept(CoreModel):
         blank=True,
         help_text="上级部门",
     )
+    path = models.CharField(max_length=255, default="", blank=True, editable=False, db_index=True, verbose_name="部门路径",
+                            help_text="部门路径,由各级部门id组成,如: /1/5/12/")
 
     @classmethod
     def recursion_all_dept(cls, dept_id: int, dept_all_list=None, dept_list=None):
         """
-        递归获取部门的所有下级部门
+        获取部门的所有下级部门(包含自身)
         :param dept_id: 需要获取的id
-        :param dept_all_list: 所有列表
-        :param dept_list: 递归list
+        :param dept_all_list: 已弃用,保留兼容
+        :param dept_list: 已弃用,保留兼容
         :return:
         """
-        if not dept_all_list:
-            dept_all_list = Dept.objects.values("id", "parent")
-        if dept_list is None:
-            dept_list = [dept_id]
-        for ele in dept_all_list:
-            if ele.get("parent") == dept_id:
-                dept_list.append(ele.get("id"))
-                cls.recursion_all_dept(ele.get("id"), dept_all_list, dept_list)
-        return list(set(dept_list))
+        return cls.get_sub_dept_ids(dept_id)
+
+    @classmethod
+    def get_dept_path(cls, dept_id):
+        """
+        获取部门路径,路径未生成时重建全部部门路径
+        :param dept_id: 部门id
+        :return: 部门路径,部门不存在时返回None
+        """
+        path = cls.objects.filter(id=dept_id).values_list("path", flat=True).first()
+        if path == "":
+            cls.rebuild_path()
+            path = cls.objects.filter(id=dept_id).values_list("path", flat=True).first()
+        return path
+
+    @classmethod
+    def get_sub_dept_ids(cls, dept_id):
+        """
+        通过部门路径获取部门及所有下级部门的id
+        :param dept_id: 部门id
+        :return: list
+        """
+        path = cls.get_dept_path(dept_id)
+        if not path:
+            return []
+        return list(cls.objects.filter(path__startswith=path).values_list("id", flat=True))
+
+    @classmethod
+    def rebuild_path(cls):
+        """
+        根据上级部门重建全部部门路径
+        路径只在 save() 中维护, queryset.update(parent=...)、bulk_create、bulk_update 等批量操作不会更新路径,
+        批量修改上级部门后需调用本方法(如部门导入的 after_bulk_import)
+        :return:
+        """
+        parent_map = dict(cls.objects.values_list("id", "parent_id"))
+        paths = {}
+        for dept_id in parent_map:
+            chain = []
+            node = dept_id
+            while node in parent_map and node not in paths and node not in chain:
+                chain.append(node)
+                node = parent_map.get(node)
+            prefix = paths.get(node, "/")
+            for node in reversed(chain):
+                prefix = f"{prefix}{node}/"
+                paths[node] = prefix
+        cls.objects.bulk_update(
+            [cls(id=dept_id, path=path) for dept_id, path in paths.items()], ["path"], batch_size=1000
+        )
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if update_fields is not None and "parent" not in update_fields:
+            return super().save(force_insert, force_update, using, update_fields)
+        parent_path = "/"
+        if self.parent_id:
+            parent_path = Dept.objects.filter(id=self.parent_id).values_list("path", flat=True).first() or ""
+            if self.path and parent_path.startswith(self.path):
+                # 接口由 DeptSerializer.validate_parent 校验, 这里仅兜底防止写入环形数据
+                raise ValidationError("不能将部门移动到自身或其下级部门")
+        old_path = self.path
+        is_legacy = self.pk is not None and not old_path
+        super().save(force_insert, force_update, using, update_fields)
+        if not parent_path or is_legacy:
+            # 历史数据尚未生成路径,重建全部路径
+            Dept.rebuild_path()
+            self.path = Dept.objects.filter(id=self.id).values_list("path", flat=True).first()
+            return
+        new_path = f"{parent_path}{self.id}/"
+        if new_path != old_path:
+            Dept.objects.filter(id=self.id).update(path=new_path)
+            self.path = new_path
+            if old_path:
+                # 部门移动,同步更新所有下级部门的路径
+                Dept.objects.filter(path__startswith=old_path).exclude(id=self.id).update(
+                    path=Concat(Value(new_path), Substr("path", len(old_path) + 1))
+                )
 
     class Meta:
         db_table = table_prefix + "system_dept"
@@ -576,6 +648,8 @@ class MessageCenter(CoreModel):
                                          verbose_name="目标部门", help_text="目标部门")
     target_role = models.ManyToManyField(to=Role, blank=True, db_constraint=False,
                                          verbose_name="目标角色", help_text="目标角色")
+    broadcast = models.BooleanField(default=False, editable=False, db_index=True, verbose_name="是否广播存储",
+                                    help_text="广播存储的系统通知不逐个保存目标用户, 已读状态记录在 MessageCenterUserState")
 
     class Meta:
         db_table = table_prefix + "message_center"
@@ -595,3 +669,23 @@ class MessageCenterTargetUser(CoreModel):
         db_table = table_prefix + "message_center_target_user"
         verbose_name = "消息中心目标用户表"
         verbose_name_plural = verbose_name
+
+
+class MessageCenterUserState(CoreModel):
+    """
+    用户消息状态
+    广播消息 id <= last_read_broadcast_id 的均视为已读,
+    大于该值且已读的广播消息以 MessageCenterTargetUser(is_read=True) 记录
+    unread_count 由消息新增、已读、删除时增减维护
+    """
+    users = models.OneToOneField(Users, related_name="message_state", on_delete=models.CASCADE, db_constraint=False,
+                                 verbose_name="关联用户表", help_text="关联用户表")
+    last_read_broadcast_id = models.BigIntegerField(default=0, verbose_name="已读广播消息水位",
+                                                    help_text="已读广播消息水位")
+    unread_count = models.IntegerField(null=True, blank=True, verbose_name="未读消息数量",
+                                       help_text="未读消息数量, 为空时从消息记录重新统计")
+
+    class Meta:
+        db_table = table_prefix + "message_center_user_state"
+        verbose_name = "用户消息状态表"
+        verbose_name_plural = verbose_name
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 信号处理, 用于数据变化时使相关缓存失效、维护冗余数据
+"""
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from dvadmin.system.models import RoleMenuButtonPermission, MenuButton, ApiWhiteList, Role, Users, Dept, \
+    MessageCenter, MessageCenterTargetUser, MessageCenterUserState, Menu, RoleMenuPermission, MenuField, \
+    FieldPermission
+from dvadmin.utils.cache import bump_cache_version
+from dvadmin.utils.field_permission import MENU_FIELD_CACHE_VERSION, FIELD_PERMISSION_CACHE_VERSION
+from dvadmin.utils.filters import DEPT_CACHE_VERSION
+from dvadmin.utils.identity import clear_identity_cache
+from dvadmin.utils.menu_cache import MENU_CACHE_VERSION
+from dvadmin.utils.message_fanout import change_unread_count
+from dvadmin.utils.permission import PERMISSION_CACHE_VERSION
+
+
+@receiver(post_save, sender=RoleMenuButtonPermission)
+@receiver(post_delete, sender=RoleMenuButtonPermission)
+@receiver(post_save, sender=MenuButton)
+@receiver(post_delete, sender=MenuButton)
+@receiver(post_save, sender=ApiWhiteList)
+@receiver(post_delete, sender=ApiWhiteList)
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def refresh_permission_cache(sender, **kwargs):
+    """
+    接口权限相关数据变化, 刷新权限缓存
+    """
+    bump_cache_version(PERMISSION_CACHE_VERSION)
+
+
+@receiver(m2m_changed, sender=Users.role.through)
+@receiver(m2m_changed, sender=RoleMenuButtonPermission.dept.through)
+def refresh_user_role_cache(sender, action, **kwargs):
+    """
+    用户角色或自定义数据权限部门变化, 刷新权限缓存
+    """
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_cache_version(PERMISSION_CACHE_VERSION)
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+@receiver(post_save, sender=RoleMenuPermission)
+@receiver(post_delete, sender=RoleMenuPermission)
+def refresh_menu_cache(sender, **kwargs):
+    """
+    菜单或菜单授权变化, 刷新前端路由缓存
+    """
+    bump_cache_version(MENU_CACHE_VERSION)
+
+
+@receiver(post_save, sender=MenuField)
+@receiver(post_delete, sender=MenuField)
+def refresh_menu_field_cache(sender, **kwargs):
+    """
+    列权限字段变化, 刷新列权限字段缓存
+    """
+    bump_cache_version(MENU_FIELD_CACHE_VERSION)
+
+
+@receiver(post_save, sender=FieldPermission)
+@receiver(post_delete, sender=FieldPermission)
+def refresh_field_permission_cache(sender, **kwargs):
+    """
+    角色列权限变化, 刷新列权限缓存
+    """
+    bump_cache_version(FIELD_PERMISSION_CACHE_VERSION)
+
+
+@receiver(post_save, sender=Dept)
+@receiver(post_delete, sender=Dept)
+def refresh_dept_cache(sender, **kwargs):
+    """
+    部门变化, 刷新部门相关缓存(数据权限范围等)
+    """
+    bump_cache_version(DEPT_CACHE_VERSION)
+
+
+@receiver(post_save, sender=Users)
+@receiver(post_delete, sender=Users)
+def refresh_identity_cache(sender, instance, **kwargs):
+    """
+    用户变化, 清除本进程缓存的用户名称
+    """
+    clear_identity_cache(instance.id)
+
+
+@receiver(pre_delete, sender=MessageCenter)
+def decrease_message_unread_count(sender, instance, **kwargs):
+    """
+    删除消息前, 减少仍未读该消息的用户的未读数量
+    """
+    if instance.broadcast:
+        MessageCenterUserState.objects.exclude(unread_count=None).filter(
+            last_read_broadcast_id__lt=instance.id, users__date_joined__lte=instance.create_datetime
+        ).exclude(
+            users_id__in=MessageCenterTargetUser.objects.filter(messagecenter_id=instance.id, is_read=True).values(
+                'users_id')
+        ).update(unread_count=F('unread_count') - 1)
+    else:
+        change_unread_count(-1, MessageCenterTargetUser.objects.filter(
+            messagecenter_id=instance.id, is_read=False).values('users_id'))
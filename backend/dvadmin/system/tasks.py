@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+celery 异步任务, 需安装 dvadmin-celery 插件
+"""
+from application.celery import app
+
+
+@app.task
+def run_async_job(job_id):
+    """
+    执行后台导入/导出任务
+    :param job_id: 任务id
+    :return:
+    """
+    from dvadmin.utils.jobs import run_job
+
+    run_job(job_id)
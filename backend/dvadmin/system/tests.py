@@ -1,15 +1,63 @@
 from functools import wraps
 
 from django.db.models import Func, F, OuterRef, Exists
-from django.test import TestCase
+from django.test import TestCase, override_settings
 import django
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "application.settings")
 django.setup()
-from dvadmin.system.models import Menu, RoleMenuPermission, RoleMenuButtonPermission, MenuButton
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.signals import post_save, post_delete
+from django.urls import get_resolver
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
 
+from unittest import mock
 
+from openpyxl import load_workbook
+from rest_framework import serializers
+from rest_framework.request import Request
+
+from application import dispatch
+from dvadmin.system.models import Menu, RoleMenuPermission, RoleMenuButtonPermission, MenuButton, Users, Role, \
+    MessageCenter, MessageCenterTargetUser, MenuField, FieldPermission, Dept, OperationLog, Area, ApiWhiteList, \
+    Dictionary, SystemConfig, FileList, Post
+from dvadmin.system.views.async_job import AsyncJobView, AsyncJobDownloadView
+from dvadmin.system.views.dept import DeptViewSet, DeptImportSerializer, DeptCreateUpdateSerializer
+from dvadmin.system.views.menu import MenuViewSet
+from dvadmin.system.views.menu_button import MenuButtonViewSet
+from dvadmin.system.views.message_center import MessageCenterViewSet
+from dvadmin.system.views.operation_log import OperationLogViewSet
+from dvadmin.system.views.user import UserViewSet, UserSerializer
+from dvadmin.utils.cache import get_cache_version
+from dvadmin.utils.count_strategy import counted_models, get_count_version_name, cached_count
+from dvadmin.utils.field_permission import get_role_field_permissions, FIELD_PERMISSION_CACHE_VERSION
+from dvadmin.utils.filters import CustomDjangoFilterBackend, get_urlpatterns_viewsets
+from dvadmin.utils.identity import clear_identity_cache, IdentityResolver
+from dvadmin.utils.jobs import Job, JOB_SUCCESS, run_job
+from dvadmin.utils.message_fanout import get_unread_count, count_unread, mark_message_read, is_message_read, \
+    get_user_message_state, get_user_messages, message_fanout, mark_messages_read, MessageFanout
+from dvadmin.utils.models import get_model_registry, get_custom_app_models, get_all_models_objects, \
+    _scan_custom_app_models
+from dvadmin.utils.operation_log import OperationLogWriter
+from dvadmin.utils.pagination import CustomPagination
+from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.menu_cache import MENU_CACHE_VERSION
+from dvadmin.utils.permission import ApiPermissionIndex, PERMISSION_CACHE_VERSION
+from dvadmin.system.views.role_menu_button_permission import get_role_permission_matrix, \
+    save_role_permission_matrix
+
+
+import shutil
+import tempfile
 import time
+from datetime import timedelta
 
 def timing_decorator(func):
     @wraps(func)
@@ -52,5 +100,1026 @@ def getMenu():
         data.append(dicts)
     # print(data)
 
+
+class MessageCenterQueryCountTest(TestCase):
+    """
+    消息列表的查询次数不随分页大小变化
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Role.objects.create(name="管理员", key="admin")
+        cls.user = Users.objects.create_superuser(username="msg_tester", name="msg_tester", password="admin123456")
+        receivers = [Users.objects.create(username=f"msg_receiver_{i}", name=f"receiver_{i}") for i in range(3)]
+        role = Role.objects.create(name="msg_role", key="msg_role", creator=cls.user)
+        for receiver in receivers:
+            receiver.role.add(role)
+        for i in range(20):
+            message = MessageCenter.objects.create(title=f"title_{i}", content="content", target_type=1,
+                                                   creator=cls.user, modifier=str(cls.user.id))
+            message.target_role.add(role)
+            MessageCenterTargetUser.objects.bulk_create(
+                [MessageCenterTargetUser(users=user, messagecenter=message, is_read=i % 2 == 0)
+                 for user in [cls.user, *receivers]]
+            )
+
+    def count_queries(self, action, limit):
+        # 每次从空缓存开始统计
+        cache.clear()
+        clear_identity_cache()
+        view = MessageCenterViewSet.as_view({"get": action})
+        request = APIRequestFactory().get("/", {"page": 1, "limit": limit})
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = view(request)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["data"]), limit)
+        return len(context.captured_queries)
+
+    def test_self_receive_query_count(self):
+        self.assertEqual(self.count_queries("get_self_receive", 2), self.count_queries("get_self_receive", 20))
+
+    def test_list_query_count(self):
+        self.assertEqual(self.count_queries("list", 2), self.count_queries("list", 20))
+
+
+class MessageWatermarkTest(TestCase):
+    """
+    广播消息已读水位: 水位只推进到第一条未读消息之前, 水位以下的已读记录被清理
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Users.objects.create(username="watermark_user", name="watermark_user")
+        cls.other = Users.objects.create(username="watermark_other", name="watermark_other")
+        cls.messages = [MessageCenter.objects.create(title=f"broadcast_{i}", content="content", target_type=3,
+                                                     broadcast=True) for i in range(3)]
+
+    def get_watermark(self, user):
+        return get_user_message_state(user.id)[1]
+
+    def get_read_ids(self, user):
+        return set(MessageCenterTargetUser.objects.filter(users=user).values_list("messagecenter_id", flat=True))
+
+    def test_out_of_order_read(self):
+        first, second, third = self.messages
+        self.assertEqual(get_unread_count(self.user.id), 3)
+        self.assertTrue(mark_message_read(self.user.id, second))
+        self.assertFalse(mark_message_read(self.user.id, second))
+        # 第一条未读, 水位停在第一条之前, 已读的第二条保存为已读记录
+        self.assertLess(self.get_watermark(self.user), first.id)
+        self.assertEqual(self.get_read_ids(self.user), {second.id})
+        self.assertTrue(is_message_read(self.user.id, second))
+        self.assertFalse(is_message_read(self.user.id, first))
+        self.assertEqual(get_unread_count(self.user.id), 2)
+        self.assertEqual(count_unread(self.user.id), 2)
+
+    def test_read_first_advances_watermark(self):
+        first, second, third = self.messages
+        get_unread_count(self.user.id)
+        mark_message_read(self.user.id, second)
+        self.assertTrue(mark_message_read(self.user.id, first))
+        # 水位越过连续已读的第一、二条, 水位以下的已读记录被删除
+        self.assertEqual(self.get_watermark(self.user), second.id)
+        self.assertEqual(self.get_read_ids(self.user), set())
+        self.assertFalse(mark_message_read(self.user.id, first))
+        self.assertEqual(get_unread_count(self.user.id), 1)
+        mark_message_read(self.user.id, third)
+        self.assertEqual(self.get_watermark(self.user), third.id)
+        self.assertEqual(get_unread_count(self.user.id), 0)
+        self.assertEqual(count_unread(self.user.id), 0)
+
+    def test_joined_after_broadcast(self):
+        Users.objects.filter(id=self.other.id).update(date_joined=timezone.now() + timedelta(hours=1))
+        self.other.refresh_from_db()
+        self.assertEqual(get_unread_count(self.other.id), 0)
+        self.assertFalse(get_user_messages(self.other).exists())
+        # 加入后发布的广播消息可见
+        message = MessageCenter.objects.create(title="late", content="content", target_type=3, broadcast=True)
+        MessageCenter.objects.filter(id=message.id).update(create_datetime=timezone.now() + timedelta(hours=2))
+        message_fanout.broadcast(message, {})
+        self.assertEqual(list(get_user_messages(self.other)), [message])
+        self.assertEqual(get_unread_count(self.other.id), 1)
+        self.assertEqual(count_unread(self.other.id), 1)
+
+    def test_delete_broadcast(self):
+        third = self.messages[2]
+        self.assertEqual(get_unread_count(self.user.id), 3)
+        self.assertEqual(get_unread_count(self.other.id), 3)
+        mark_message_read(self.user.id, third)
+        third.delete()
+        # 只减少未读该消息的用户
+        self.assertEqual(get_unread_count(self.user.id), 2)
+        self.assertEqual(get_unread_count(self.other.id), 2)
+        self.assertEqual(count_unread(self.user.id), 2)
+        self.assertEqual(count_unread(self.other.id), 2)
+
+
+class MessageUnreadCountTest(TestCase):
+    """
+    未读数量计数器与从消息记录统计的结果一致
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Users.objects.create(username="unread_user", name="unread_user")
+
+    def setUp(self):
+        patcher = mock.patch.object(MessageFanout, "send")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_messages(self, count):
+        direct, broadcast = [], []
+        for i in range(count):
+            message = MessageCenter.objects.create(title=f"direct_{i}", content="content", target_type=0)
+            message_fanout.fan_out(message, [self.user.id], {})
+            direct.append(message)
+            message = MessageCenter.objects.create(title=f"broadcast_{i}", content="content", target_type=3,
+                                                   broadcast=True)
+            message_fanout.broadcast(message, {})
+            broadcast.append(message)
+        return direct, broadcast
+
+    def assertUnreadCount(self, expected):
+        self.assertEqual(get_unread_count(self.user.id), expected)
+        self.assertEqual(count_unread(self.user.id), expected)
+
+    def test_unread_count(self):
+        self.assertUnreadCount(0)
+        direct, broadcast = self.create_messages(4)
+        self.assertUnreadCount(8)
+        # 单条已读, 重复已读不再减少
+        mark_message_read(self.user.id, direct[0])
+        mark_message_read(self.user.id, broadcast[1])
+        mark_message_read(self.user.id, broadcast[1])
+        self.assertUnreadCount(6)
+        # 批量已读, 包含已读的消息
+        self.assertEqual(mark_messages_read(self.user.id, [direct[0].id, direct[1].id, broadcast[0].id,
+                                                           broadcast[1].id]), 4)
+        self.assertUnreadCount(4)
+        # 删除已读、未读消息
+        direct[1].delete()
+        direct[2].delete()
+        broadcast[0].delete()
+        broadcast[2].delete()
+        self.assertUnreadCount(2)
+        # 全部已读
+        self.assertEqual(mark_messages_read(self.user.id), 0)
+        self.assertUnreadCount(0)
+        self.create_messages(1)
+        self.assertUnreadCount(2)
+        self.assertEqual(mark_messages_read(self.user.id), 0)
+        self.assertUnreadCount(0)
+
+    def test_mark_all_without_refresh(self):
+        self.create_messages(2)
+        get_unread_count(self.user.id)
+        with mock.patch("dvadmin.utils.message_fanout.refresh_unread_count") as refresh:
+            self.assertEqual(mark_messages_read(self.user.id), 0)
+        refresh.assert_not_called()
+
+
+class RolePermissionMatrixQueryCountTest(TestCase):
+    """
+    角色授权页面的查询次数不随菜单、按钮、列数量变化
+    """
+
+    def create_catalog(self, role, menu_count):
+        catalog = Menu.objects.create(name=f"catalog_{menu_count}", is_catalog=True)
+        for i in range(menu_count):
+            menu = Menu.objects.create(name=f"menu_{menu_count}_{i}", parent=catalog)
+            RoleMenuPermission.objects.create(role=role, menu=menu)
+            for j in range(3):
+                button = MenuButton.objects.create(menu=menu, name=f"btn_{j}", value=f"btn_{menu_count}_{i}_{j}",
+                                                   api="/api/test/")
+                RoleMenuButtonPermission.objects.create(role=role, menu_button=button, data_range=j)
+                field = MenuField.objects.create(menu=menu, model="Test", field_name=f"field_{j}", title=f"field_{j}")
+                FieldPermission.objects.create(role=role, field=field, is_query=True, is_create=False, is_update=j > 0)
+        return Menu.objects.filter(id=catalog.id).values('name', 'id')
+
+    def test_query_count(self):
+        role = Role.objects.create(name="matrix_role", key="matrix_role")
+        small = self.create_catalog(role, 1)
+        large = self.create_catalog(role, 10)
+        with self.assertNumQueries(7):
+            get_role_permission_matrix(role.id, small)
+        with self.assertNumQueries(7):
+            data = get_role_permission_matrix(role.id, large)
+        self.assertEqual(len(data[0]["menus"]), 10)
+        menu = data[0]["menus"][0]
+        self.assertTrue(menu["isCheck"])
+        self.assertEqual(len(menu["btns"]), 3)
+        self.assertTrue(all(btn["isCheck"] for btn in menu["btns"]))
+        self.assertEqual([col["is_update"] for col in menu["columns"]], [False, True, True])
+
+
+
+class RolePermissionMatrixSaveTest(TestCase):
+    """
+    保存角色授权矩阵: 只写入有变化的记录, 提交后刷新缓存版本号
+    """
+    versions = (PERMISSION_CACHE_VERSION, MENU_CACHE_VERSION, FIELD_PERMISSION_CACHE_VERSION)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.role = Role.objects.create(name="matrix_save_role", key="matrix_save_role")
+        cls.catalog = Menu.objects.create(name="matrix_catalog", is_catalog=True)
+        cls.menu = Menu.objects.create(name="matrix_menu", parent=cls.catalog)
+        cls.buttons = [MenuButton.objects.create(menu=cls.menu, name=f"btn_{i}", value=f"matrix_btn_{i}",
+                                                 api=f"/api/matrix/{i}/", method=0) for i in range(2)]
+        cls.field = MenuField.objects.create(menu=cls.menu, model="Test", field_name="name", title="name")
+        cls.depts = [Dept.objects.create(name=f"matrix_dept_{i}", key=f"matrix_dept_{i}") for i in range(2)]
+
+    def setUp(self):
+        cache.clear()
+
+    def get_body(self, menu_check=True, btns=None, is_query=True):
+        if btns is None:
+            btns = {self.buttons[0].id: (0, []), self.buttons[1].id: (4, [self.depts[0].id])}
+        return [{"menus": [{
+            "id": self.menu.id,
+            "isCheck": menu_check,
+            "btns": [{"id": button.id, "isCheck": button.id in btns,
+                      "data_range": btns.get(button.id, (0, []))[0], "dept": btns.get(button.id, (0, []))[1]}
+                     for button in self.buttons],
+            "columns": [{"id": self.field.id, "is_query": is_query, "is_create": False, "is_update": False}],
+        }]}]
+
+    def save(self, body):
+        before = [get_cache_version(name) for name in self.versions]
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            changed = save_role_permission_matrix(self.role.id, body)
+            # 提交前不刷新缓存
+            self.assertEqual([get_cache_version(name) for name in self.versions], before)
+        after = [get_cache_version(name) for name in self.versions]
+        if changed:
+            self.assertEqual(len(callbacks), 1)
+            self.assertTrue(all(new != old for new, old in zip(after, before)))
+        else:
+            self.assertEqual(callbacks, [])
+            self.assertEqual(after, before)
+        return changed
+
+    def get_state(self):
+        return {
+            "menus": set(RoleMenuPermission.objects.filter(role=self.role).values_list("menu_id", flat=True)),
+            "btns": {obj.menu_button_id: (obj.id, obj.data_range, set(obj.dept.values_list("id", flat=True)))
+                     for obj in RoleMenuButtonPermission.objects.filter(role=self.role)},
+            "columns": list(FieldPermission.objects.filter(role=self.role).values_list("field_id", "is_query")),
+        }
+
+    def test_create_and_resave(self):
+        self.assertTrue(self.save(self.get_body()))
+        state = self.get_state()
+        # 勾选菜单时同时授权上级目录
+        self.assertEqual(state["menus"], {self.menu.id, self.catalog.id})
+        self.assertEqual({key: value[1:] for key, value in state["btns"].items()},
+                         {self.buttons[0].id: (0, set()), self.buttons[1].id: (4, {self.depts[0].id})})
+        self.assertEqual(state["columns"], [(self.field.id, True)])
+        # 相同数据再次保存不写入
+        with CaptureQueriesContext(connection) as context:
+            self.assertFalse(self.save(self.get_body()))
+        self.assertFalse([query for query in context.captured_queries
+                          if not query["sql"].lstrip().upper().startswith(("SELECT", "SAVEPOINT", "RELEASE"))])
+        self.assertEqual(self.get_state(), state)
+
+    def test_update_in_place(self):
+        self.save(self.get_body())
+        state = self.get_state()
+        body = self.get_body(btns={self.buttons[0].id: (2, []), self.buttons[1].id: (4, [self.depts[1].id])},
+                             is_query=False)
+        self.assertTrue(self.save(body))
+        new_state = self.get_state()
+        # 按钮授权记录原地修改, 主键不变
+        self.assertEqual(new_state["btns"], {
+            self.buttons[0].id: (state["btns"][self.buttons[0].id][0], 2, set()),
+            self.buttons[1].id: (state["btns"][self.buttons[1].id][0], 4, {self.depts[1].id}),
+        })
+        self.assertEqual(new_state["columns"], [(self.field.id, False)])
+
+    def test_uncheck(self):
+        self.save(self.get_body())
+        permission_id = self.get_state()["btns"][self.buttons[1].id][0]
+        self.assertTrue(self.save(self.get_body(menu_check=False, btns={self.buttons[0].id: (0, [])})))
+        state = self.get_state()
+        self.assertEqual(state["menus"], set())
+        self.assertEqual(set(state["btns"]), {self.buttons[0].id})
+        self.assertFalse(RoleMenuButtonPermission.dept.through.objects.filter(
+            rolemenubuttonpermission_id=permission_id).exists())
+        # 列权限只新增或修改, 不删除
+        self.assertEqual(state["columns"], [(self.field.id, True)])
+
+
+class BulkImportTest(TestCase):
+    """
+    导入: 批量写入的新增/更新, 以及批量失败时回退为逐行保存
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Role.objects.create(name="管理员", key="admin")
+        cls.user = Users.objects.create_superuser(username="import_tester", name="import_tester",
+                                                  password="admin123456")
+
+    def import_rows(self, rows):
+        request = Request(APIRequestFactory().post("/"))
+        request.user = self.user
+        view = DeptViewSet(request=request, format_kwarg=None, action="import_data")
+        self.assertTrue(view.can_bulk_import(Dept, []))
+        with mock.patch.object(view, "after_bulk_import", wraps=view.after_bulk_import) as after_bulk_import:
+            result = view.bulk_import(request, Dept.objects.all(), iter(rows), [])
+        return result, after_bulk_import
+
+    def test_create_and_update(self):
+        dept = Dept.objects.create(name="old_name", key="import_old")
+        result, after_bulk_import = self.import_rows([
+            # excel 中的数字主键可能读取为浮点数或字符串
+            (2, {"id": float(dept.id), "name": "new_name", "key": "import_old"}, None),
+            (3, {"id": f"{dept.id}.0", "name": "new_name_2", "key": "import_old"}, None),
+            (4, {"name": "child", "key": "import_child", "parent": dept.id}, None),
+            (5, {"id": "abc", "name": "bad", "key": "import_bad"}, None),
+        ])
+        after_bulk_import.assert_called_once()
+        self.assertEqual((result["created"], result["updated"]), (1, 2))
+        self.assertEqual([error["row"] for error in result["errors"]], [5])
+        dept.refresh_from_db()
+        self.assertEqual(dept.name, "new_name_2")
+        child = Dept.objects.get(key="import_child")
+        self.assertEqual(child.path, f"{dept.path}{child.id}/")
+        self.assertFalse(Dept.objects.filter(key="import_bad").exists())
+
+    def test_fallback_to_row_save(self):
+        result, after_bulk_import = self.import_rows([
+            (2, {"name": "dup_1", "key": "import_dup"}, None),
+            (3, {"name": "dup_2", "key": "import_dup"}, None),
+        ])
+        # 文件内数据重复导致批量写入失败, 回滚后逐行保存定位出错的行
+        after_bulk_import.assert_not_called()
+        self.assertEqual(result["created"], 1)
+        self.assertEqual([error["row"] for error in result["errors"]], [3])
+        self.assertEqual(Dept.objects.get(key="import_dup").name, "dup_1")
+        self.assertNotEqual(Dept.objects.get(key="import_dup").path, "")
+
+    def test_row_save_when_not_bulk_safe(self):
+        # 用户导入包含多对多的角色字段, 逐行保存
+        self.assertFalse(UserViewSet().can_bulk_import(Users, ["role", "post"]))
+
+
+
+class KeysetOrderingTest(TestCase):
+    """
+    游标分页: 排序字段可为空时改用 -create_datetime, pk
+    """
+
+    def test_nullable_ordering_fallback(self):
+        queryset = OperationLog.objects.all()
+        self.assertEqual(CustomPagination.get_keyset_ordering(queryset.order_by("request_ip")),
+                         [("create_datetime", True), ("id", True)])
+        self.assertEqual(CustomPagination.get_keyset_ordering(queryset.order_by("-create_datetime", "request_ip")),
+                         [("create_datetime", True), ("id", True)])
+        self.assertEqual(CustomPagination.get_keyset_ordering(queryset.order_by("id")), [("id", False)])
+
+    def test_null_value_at_page_boundary(self):
+        OperationLog.objects.bulk_create([OperationLog(request_ip=None if i % 2 else f"10.0.0.{i}")
+                                          for i in range(5)])
+        view = OperationLogViewSet.as_view({"get": "list"})
+        ids = []
+        cursor = ""
+        for _ in range(5):
+            request = APIRequestFactory().get("/", {"limit": 2, "cursor": cursor, "ordering": "request_ip"})
+            force_authenticate(request, user=Users(id=0, is_superuser=True))
+            response = view(request)
+            self.assertEqual(response.status_code, 200)
+            ids += [item["id"] for item in response.data["data"]]
+            cursor = response.data["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(sorted(ids), sorted(OperationLog.objects.values_list("id", flat=True)))
+
+
+
+class CountStrategySignalTest(TestCase):
+    """
+    分页总数缓存: 只为使用缓存总数的模型连接信号, 批量写入日志后使缓存失效
+    """
+
+    def test_signals_only_for_counted_models(self):
+        self.assertIn(OperationLog._meta.label_lower, counted_models)
+        self.assertTrue(post_save.has_listeners(OperationLog))
+        self.assertFalse(post_save.has_listeners(Area))
+        self.assertFalse(post_delete.has_listeners(Area))
+
+    def test_bulk_write_refreshes_version(self):
+        version = get_cache_version(get_count_version_name(OperationLog))
+        OperationLogWriter()._write([OperationLogWriter.make_record(request_ip="127.0.0.1")])
+        self.assertNotEqual(get_cache_version(get_count_version_name(OperationLog)), version)
+
+    def test_cached_count_exact(self):
+        cache.clear()
+        queryset = OperationLog.objects.filter(request_ip="127.0.0.1")
+        self.assertEqual(cached_count(queryset), (0, True))
+        # 命中缓存同样为精确总数
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_count(queryset), (0, True))
+        OperationLog.objects.create(request_ip="127.0.0.1")
+        self.assertEqual(cached_count(queryset), (1, True))
+
+
+
+class FilterSetCacheTest(TestCase):
+    """
+    AutoFilterSet 按(视图集, 模型, filter_fields)缓存, 参数映射与逐个查找的结果一致
+    """
+
+    @staticmethod
+    def find_filter_lookups(orm_lookups, search_term_key):
+        # 原逐个查找的实现
+        for lookup in orm_lookups:
+            new_lookup = LOOKUP_SEP.join(lookup.split(LOOKUP_SEP)[:-1]) if len(lookup.split(LOOKUP_SEP)) > 1 else lookup
+            if new_lookup == search_term_key:
+                return lookup
+        return None
+
+    def test_cache_key(self):
+        class DeptNameViewSet(DeptViewSet):
+            filter_fields = ["name"]
+
+        class DeptNameViewSet2(DeptViewSet):
+            filter_fields = ["name"]
+
+        backend = CustomDjangoFilterBackend()
+        filterset_class = backend.get_filterset_class(DeptNameViewSet, Dept.objects.all())
+        self.assertIs(backend.get_filterset_class(DeptNameViewSet(), Dept.objects.all()), filterset_class)
+        self.assertEqual(list(filterset_class.base_filters), ["name"])
+        # 视图集、模型、filter_fields 不同时分别生成
+        self.assertIsNot(backend.get_filterset_class(DeptNameViewSet2, Dept.objects.all()), filterset_class)
+        self.assertIsNot(backend.get_filterset_class(DeptViewSet, Dept.objects.all()), filterset_class)
+        self.assertIsNot(backend.get_filterset_class(DeptNameViewSet, Role.objects.all()), filterset_class)
+
+    def test_lookup_map_parity(self):
+        viewsets = [viewset for viewset in get_urlpatterns_viewsets(get_resolver().url_patterns)
+                    if CustomDjangoFilterBackend in getattr(viewset, "filter_backends", [])
+                    and getattr(viewset, "queryset", None) is not None]
+        self.assertTrue(viewsets)
+        for viewset in viewsets:
+            backend = CustomDjangoFilterBackend()
+            filterset_class = backend.get_filterset_class(viewset, viewset.queryset)
+            if filterset_class is None:
+                continue
+            filterset = filterset_class(data={}, queryset=viewset.queryset)
+            filter_fields = filterset.filters if backend.filter_fields == "__all__" else backend.filter_fields
+            orm_lookups = [
+                backend.construct_search(lookup, lookup_expr) for lookup, lookup_expr in dict(zip(
+                    list(filter_fields), [item.lookup_expr for item in filterset.filters.values()]
+                )).items()
+            ]
+            lookup_map = backend.get_filter_lookups(filterset)
+            keys = {*filterset.filters, *[lookup.split(LOOKUP_SEP)[0] for lookup in orm_lookups], "unknown_param"}
+            for key in keys:
+                self.assertEqual(lookup_map.get(key), self.find_filter_lookups(orm_lookups, key),
+                                 f"{viewset.__name__}: {key}")
+
+
+
+class ModelRegistryTest(TestCase):
+    """
+    模型注册表
+    """
+
+    def test_lookup(self):
+        registry = get_model_registry()
+        self.assertIs(get_model_registry(), registry)
+        self.assertIs(registry.get_by_name("Dept")["object"], Dept)
+        self.assertEqual(registry.get_by_model(Dept)["model"], "Dept")
+        self.assertIsNone(registry.get_by_model(Group))
+        self.assertIsNone(registry.get_by_name("NoSuchModel"))
+        self.assertEqual(registry.all_models["Dept"]["db_table"], Dept._meta.db_table)
+        self.assertEqual([item["model"] for item in get_custom_app_models()],
+                         [item["model"] for item in _scan_custom_app_models()])
+
+    def test_immutable(self):
+        registry = get_model_registry()
+        with self.assertRaises(TypeError):
+            registry.by_name["Dept"] = None
+        with self.assertRaises(TypeError):
+            registry.models[0]["model"] = "changed"
+
+    def test_get_all_models_objects(self):
+        self.assertIs(get_all_models_objects("Dept")["object"], Dept)
+        # 未知模型返回空字典
+        self.assertEqual(get_all_models_objects("NoSuchModel"), {})
+        self.assertIn("Dept", get_all_models_objects())
+
+
+
+class FieldPermissionTest(TestCase):
+    """
+    列权限: 未授权的列禁止, 方法字段未声明读取的字段时不延迟加载
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.role = Role.objects.create(name="field_role", key="field_role")
+        cls.user = Users.objects.create(username="field_tester", name="field_tester")
+        cls.user.role.add(cls.role)
+        menu = Menu.objects.create(name="field_menu")
+        fields = {name: MenuField.objects.create(menu=menu, model="Users", field_name=name, title=name)
+                  for name in ("name", "email", "mobile", "id")}
+        FieldPermission.objects.create(role=cls.role, field=fields["name"], is_query=True, is_create=True,
+                                       is_update=False)
+        FieldPermission.objects.create(role=cls.role, field=fields["email"], is_query=True, is_create=False,
+                                       is_update=False)
+
+    def setUp(self):
+        # 列权限缓存按版本号失效, 用例内新增的字段回滚后版本号不回退
+        cache.clear()
+
+    def get_view(self, viewset):
+        request = Request(APIRequestFactory().get("/"))
+        request.user = self.user
+        return viewset(request=request, format_kwarg=None, action="list")
+
+    def test_forbidden_without_permission_row(self):
+        forbidden = get_role_field_permissions([self.role.id], "Users")["forbidden"]
+        # mobile 没有授权记录, 禁止; id 不受列权限控制
+        self.assertEqual(forbidden["query"], ["mobile"])
+        self.assertEqual(forbidden["create"], ["email", "mobile"])
+        self.assertEqual(forbidden["update"], ["email", "mobile", "name"])
+
+    def test_defer_forbidden_fields(self):
+        deferred, defer = self.get_view(UserViewSet).defer_forbidden_fields(Users.objects.all()).query.deferred_loading
+        self.assertTrue(defer)
+        self.assertEqual(set(deferred), {"mobile"})
+
+        class ExtraUserSerializer(UserSerializer):
+            mobile_tail = serializers.SerializerMethodField()
+
+            def get_mobile_tail(self, instance):
+                return (instance.mobile or "")[-4:]
+
+        class ExtraUserViewSet(UserViewSet):
+            serializer_class = ExtraUserSerializer
+
+        queryset = self.get_view(ExtraUserViewSet).defer_forbidden_fields(Users.objects.all())
+        self.assertEqual(queryset.query.deferred_loading, (frozenset(), True))
+
+    def test_forbidden_required_field_on_create(self):
+        class UsernameSerializer(CustomModelSerializer):
+            class Meta:
+                model = Users
+                fields = ["username", "name", "mobile"]
+
+        def validate(data, user=self.user, instance=None):
+            request = Request(APIRequestFactory().post("/"))
+            request.user = user
+            serializer = UsernameSerializer(instance, data=data, request=request)
+            serializer.is_valid()
+            return serializer
+
+        # mobile 非必填, 禁止新增时忽略
+        serializer = validate({"username": "field_new", "name": "field_new", "mobile": "13800000000"})
+        self.assertEqual(serializer.errors, {})
+        self.assertNotIn("mobile", serializer.validated_data)
+        # username 必填且禁止新增, 返回字段错误(错误以字段名称显示)
+        MenuField.objects.create(menu=Menu.objects.get(name="field_menu"), model="Users", field_name="username",
+                                 title="username")
+        serializer = validate({"username": "field_new", "name": "field_new"})
+        self.assertEqual(list(serializer.errors), [Users._meta.get_field("username").verbose_name])
+        # 修改和超级管理员不受影响
+        self.assertEqual(validate({"name": "field_new"}, instance=self.user).errors, {})
+        admin = Users(username="field_admin", is_superuser=True)
+        self.assertEqual(validate({"username": "field_new", "name": "field_new"}, user=admin).errors, {})
+
+
+
+class IdentityResolverTest(TestCase):
+    """
+    创建人、修改人名称: 整页一次查询, 用户修改后清除进程缓存
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [Users.objects.create(username=f"identity_{i}", name=f"identity_{i}") for i in range(3)]
+        for i in range(20):
+            creator, modifier = cls.users[i % 3], cls.users[(i + 1) % 3]
+            Dept.objects.create(name=f"identity_dept_{i}", key=f"identity_dept_{i}", creator=creator,
+                                modifier=str(modifier.id))
+
+    def setUp(self):
+        clear_identity_cache()
+
+    def serialize(self):
+        return DeptImportSerializer(Dept.objects.filter(key__startswith="identity_dept_"), many=True).data
+
+    def test_one_lookup_per_page(self):
+        # 部门列表一次, 创建人和修改人名称一次
+        with self.assertNumQueries(2):
+            data = self.serialize()
+        self.assertEqual(len(data), 20)
+        for item in data:
+            dept = Dept.objects.get(id=item["id"])
+            self.assertEqual(item["creator_name"], dept.creator.name)
+            self.assertEqual(item["modifier_name"], Users.objects.get(id=dept.modifier).name)
+        # 进程缓存命中时不再查询用户
+        with self.assertNumQueries(1):
+            self.serialize()
+
+    def test_refresh_identity_cache(self):
+        user = self.users[0]
+        resolver = IdentityResolver()
+        self.assertEqual(resolver.get_name(user.id), "identity_0")
+        user.name = "renamed"
+        user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(IdentityResolver().get_name(user.id), "renamed")
+        # 同一请求内的解析结果不变
+        self.assertEqual(resolver.get_name(user.id), "identity_0")
+
+
+
+class ApiPermissionIndexTest(TestCase):
+    """
+    接口权限索引: 正则匹配与失效
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.role = Role.objects.create(name="api_role", key="api_role")
+        cls.user = Users.objects.create(username="api_tester", name="api_tester")
+        cls.user.role.add(cls.role)
+        cls.menu = Menu.objects.create(name="api_menu")
+        cls.button = MenuButton.objects.create(menu=cls.menu, name="编辑", value="api_user_update",
+                                               api="/api/system/user/{id}/", method=2)
+        RoleMenuButtonPermission.objects.create(role=cls.role, menu_button=cls.button)
+        ApiWhiteList.objects.create(url="/api/white/{id}/", method=0)
+
+    def setUp(self):
+        # 清空版本号, 避免复用的用户id命中其他用例的缓存
+        cache.clear()
+
+    def test_match(self):
+        index = ApiPermissionIndex()
+        self.assertTrue(index.has_permission(self.user, "/api/system/user/12/", "PUT"))
+        self.assertTrue(index.has_permission(self.user, "/api/system/user/7f3c-a1/", "PUT"))
+        # 请求方法、路径不一致
+        self.assertFalse(index.has_permission(self.user, "/api/system/user/12/", "GET"))
+        self.assertFalse(index.has_permission(self.user, "/api/system/user/12/reset/", "PUT"))
+        self.assertFalse(index.has_permission(self.user, "/api/system/user/", "PUT"))
+        # 白名单
+        self.assertTrue(index.has_permission(self.user, "/api/white/3/", "GET"))
+        self.assertFalse(index.has_permission(self.user, "/api/white/3/", "POST"))
+        # 同一角色集合只编译一次
+        self.assertEqual(index.stats()["misses"], 1)
+
+    def test_invalidate(self):
+        index = ApiPermissionIndex()
+        self.assertFalse(index.has_permission(self.user, "/api/system/role/", "GET"))
+        button = MenuButton.objects.create(menu=self.menu, name="查询", value="api_role_list", api="/api/system/role/",
+                                           method=0)
+        permission = RoleMenuButtonPermission.objects.create(role=self.role, menu_button=button)
+        self.assertTrue(index.has_permission(self.user, "/api/system/role/", "GET"))
+        # 修改按钮接口
+        button.api = "/api/system/dept/"
+        button.save()
+        self.assertFalse(index.has_permission(self.user, "/api/system/role/", "GET"))
+        self.assertTrue(index.has_permission(self.user, "/api/system/dept/", "GET"))
+        # 取消授权
+        permission.delete()
+        self.assertFalse(index.has_permission(self.user, "/api/system/dept/", "GET"))
+        # 用户移除角色
+        self.user.role.remove(self.role)
+        self.assertFalse(index.has_permission(self.user, "/api/system/user/12/", "PUT"))
+
+    def test_schema_isolation(self):
+        index = ApiPermissionIndex()
+        self.assertEqual(index.get_role_ids(self.user), {self.role.id})
+        with mock.patch("dvadmin.utils.permission.get_schema_name", return_value="tenant_b"):
+            # 其他租户不复用本租户缓存的角色
+            with self.assertNumQueries(1):
+                index.get_role_ids(self.user)
+        with self.assertNumQueries(0):
+            index.get_role_ids(self.user)
+        self.assertEqual(set(index.stats()["versions"]), {"", "tenant_b"})
+
+
+class DeptPathTest(TestCase):
+    """
+    部门路径: 移动部门时更新下级路径, 按路径查询下级部门和用户
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create(username="dept_admin", name="dept_admin", is_superuser=True)
+        cls.root = Dept.objects.create(name="root", key="path_root")
+        cls.child = Dept.objects.create(name="child", key="path_child", parent=cls.root)
+        cls.leaf = Dept.objects.create(name="leaf", key="path_leaf", parent=cls.child)
+        cls.other = Dept.objects.create(name="other", key="path_other")
+        cls.root_user = Users.objects.create(username="path_root_user", name="path_root_user", dept=cls.root)
+        cls.leaf_user = Users.objects.create(username="path_leaf_user", name="path_leaf_user", dept=cls.leaf, gender=1)
+
+    def get(self, viewset, action, params):
+        request = APIRequestFactory().get("/", params)
+        force_authenticate(request, user=self.admin)
+        return viewset.as_view({"get": action})(request)
+
+    def test_path(self):
+        self.assertEqual(self.leaf.path, f"/{self.root.id}/{self.child.id}/{self.leaf.id}/")
+        self.assertEqual(set(Dept.get_sub_dept_ids(self.root.id)), {self.root.id, self.child.id, self.leaf.id})
+
+    def test_move_subtree(self):
+        self.child.parent = self.other
+        self.child.save()
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.path, f"/{self.other.id}/{self.child.id}/{self.leaf.id}/")
+        self.assertEqual(Dept.get_sub_dept_ids(self.root.id), [self.root.id])
+        self.assertEqual(set(Dept.get_sub_dept_ids(self.other.id)), {self.other.id, self.child.id, self.leaf.id})
+
+    def test_cycle(self):
+        self.root.parent = self.leaf
+        with self.assertRaises(ValidationError):
+            self.root.save()
+        serializer = DeptCreateUpdateSerializer(self.child, data={"parent": self.leaf.id}, partial=True)
+        self.assertFalse(serializer.is_valid())
+
+    def test_dept_info(self):
+        data = self.get(DeptViewSet, "dept_info", {"dept_id": self.root.id, "show_all": 1}).data["data"]
+        self.assertEqual(data["dept_user"], 2)
+        self.assertEqual(data["gender"]["male"], 1)
+        self.assertEqual(data["sub_dept_map"], [{"name": "child", "count": 1}])
+        data = self.get(DeptViewSet, "dept_info", {"dept_id": self.other.id, "show_all": 1}).data["data"]
+        self.assertEqual(data["dept_user"], 0)
+
+    def test_user_list(self):
+        def usernames(dept):
+            response = self.get(UserViewSet, "list", {"dept": dept.id, "show_all": 1, "limit": 100})
+            return {item["username"] for item in response.data["data"]}
+
+        self.assertEqual(usernames(self.root), {"path_root_user", "path_leaf_user"})
+        self.assertEqual(usernames(self.child), {"path_leaf_user"})
+        self.assertEqual(usernames(self.other), set())
+
+
+
+class ConfigStoreTest(TestCase):
+    """
+    系统配置/字典共享存储: 两种存储读取结果一致, 刷新时先递增版本号
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        parent = Dictionary.objects.create(label="性别", value="gender")
+        Dictionary.objects.create(label="男", value="1", parent=parent, is_value=True)
+        Dictionary.objects.create(label="女", value="2", parent=parent, is_value=True)
+        parent = SystemConfig.objects.create(title="基础", key="base")
+        SystemConfig.objects.create(title="名称", key="name", value="dvadmin", parent=parent)
+        SystemConfig.objects.create(title="数量", key="count", value={1: "a"}, parent=parent)
+
+    def setUp(self):
+        cache.clear()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+
+    @staticmethod
+    def refresh():
+        dispatch._local_versions.clear()
+        dispatch.refresh_dictionary()
+        dispatch.refresh_system_config()
+        # 清空本进程副本, 从共享存储重新加载
+        dispatch._local_versions.clear()
+
+    def test_file_store_json(self):
+        store = dispatch.FileConfigStore(self.location)
+        store.set("dictionary", None, 1, {1: "a"})
+        self.assertEqual(store.get("dictionary"), (1, {"1": "a"}))
+        version = store.get_version("dictionary")
+        self.assertGreater(store.bump_version("dictionary"), version)
+
+    def test_cache_store(self):
+        store = dispatch.CacheConfigStore()
+        self.assertIsNone(store.get("dictionary"))
+        store.set("dictionary", "tenant", 1, {"a": 1})
+        self.assertEqual(store.get("dictionary", "tenant"), (1, {"a": 1}))
+        self.assertIsNone(store.get("dictionary"))
+        version = store.get_version("dictionary")
+        self.assertEqual(store.bump_version("dictionary"), version + 1)
+
+    def test_stores_parity(self):
+        results = []
+        for store in (dispatch.CacheConfigStore(), dispatch.FileConfigStore(self.location)):
+            with mock.patch.object(dispatch, "_config_store", store):
+                self.refresh()
+                with self.assertNumQueries(0):
+                    results.append((
+                        dispatch.get_dictionary_config(),
+                        dispatch.get_system_config_values("base.name"),
+                        dispatch.get_system_config_values("base.count"),
+                        dispatch.get_dictionary_label("gender", 2),
+                    ))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][0]["gender"]["children"][0]["label"], "男")
+        self.assertEqual(results[0][1:], ("dvadmin", {"1": "a"}, "女"))
+
+    def test_refresh_bumps_before_query(self):
+        store = dispatch.FileConfigStore(self.location)
+        patcher = mock.patch.object(dispatch, "_config_store", store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.refresh()
+        version = store.get_version("dictionary")
+        query_config = dispatch._query_config
+        versions = []
+
+        def check_version(kind, schema_name):
+            versions.append(store.get_version(kind, schema_name))
+            return query_config(kind, schema_name)
+
+        with mock.patch.object(dispatch, "_query_config", side_effect=check_version):
+            dispatch.refresh_dictionary()
+        # 查询数据库时版本号已经递增
+        self.assertEqual(len(versions), 1)
+        self.assertGreater(versions[0], version)
+        self.assertEqual(store.get("dictionary")[0], versions[0])
+        self.assertEqual(dispatch._local_versions[("dictionary", None)][0], versions[0])
+
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AsyncJobTest(TestCase):
+    """
+    后台任务: 以提交任务的用户执行, 任务状态和导出文件只有提交人可以访问
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept = Dept.objects.create(name="job_dept", key="job_dept")
+        other_dept = Dept.objects.create(name="job_other", key="job_other")
+        role = Role.objects.create(name="job_role", key="job_role")
+        button = MenuButton.objects.create(menu=Menu.objects.create(name="job_menu"), name="导出",
+                                           value="job_user_export", api="/api/system/user/export_data/", method=0)
+        # 本部门数据权限
+        RoleMenuButtonPermission.objects.create(role=role, menu_button=button, data_range=2)
+        cls.user = Users.objects.create(username="job_owner", name="job_owner", dept=cls.dept,
+                                        dept_belong_id=cls.dept.id)
+        cls.user.role.add(role)
+        cls.other = Users.objects.create(username="job_other", name="job_other", dept=other_dept,
+                                         dept_belong_id=other_dept.id)
+        cls.other.role.add(role)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, ignore_errors=True)
+        patcher = mock.patch.object(Job, "push")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self):
+        request = APIRequestFactory().get("/api/system/user/export_data/", {"async": 1})
+        force_authenticate(request, user=self.user)
+        with mock.patch("dvadmin.utils.jobs.get_job_executor") as executor:
+            response = UserViewSet.as_view({"get": "export_data"})(request)
+        job_id = response.data["data"]["job_id"]
+        executor.return_value.submit.assert_called_once_with(job_id)
+        # 测试事务内执行, 不关闭数据库连接
+        with mock.patch("dvadmin.utils.jobs.close_old_connections"):
+            run_job(job_id)
+        return job_id
+
+    def get(self, view, user, job_id):
+        request = APIRequestFactory().get("/")
+        force_authenticate(request, user=user)
+        return view.as_view()(request, job_id=job_id)
+
+    def test_data_scope(self):
+        job = Job.get(self.submit())
+        self.assertEqual(job.status, JOB_SUCCESS)
+        file = FileList.objects.get(id=job.file_id)
+        self.assertEqual(file.creator_id, self.user.id)
+        rows = list(load_workbook(file.url.path).active.values)
+        self.assertEqual([row[1] for row in rows[1:]], ["job_owner"])
+
+    def test_owner_only(self):
+        job_id = self.submit()
+        self.assertEqual(self.get(AsyncJobView, self.user, job_id).data["data"]["status"], JOB_SUCCESS)
+        response = self.get(AsyncJobDownloadView, self.user, job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b"".join(response.streaming_content))
+        response.close()
+        for view in (AsyncJobView, AsyncJobDownloadView):
+            self.assertEqual(self.get(view, self.other, job_id).status_code, 404)
+            self.assertEqual(self.get(view, self.user, "missing").status_code, 404)
+
+
+
+class MenuCacheTest(TestCase):
+    """
+    前端路由、按钮权限的条件响应: ETag 相同时返回 304 不查询数据库, 菜单或授权变化时 ETag 变化
+    """
+    views = ((MenuViewSet, "web_router"), (MenuButtonViewSet, "menu_button_all_permission"))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.role = Role.objects.create(name="menu_cache_role", key="menu_cache_role")
+        cls.user = Users.objects.create(username="menu_cache_user", name="menu_cache_user")
+        cls.user.role.add(cls.role)
+        cls.menu = Menu.objects.create(name="menu_cache", web_path="/menu_cache", component_name="menuCache")
+        cls.other_menu = Menu.objects.create(name="menu_cache_other", web_path="/menu_cache_other")
+        button = MenuButton.objects.create(menu=cls.menu, name="查询", value="menu_cache:Search",
+                                           api="/api/menu_cache/", method=0)
+        RoleMenuPermission.objects.create(role=cls.role, menu=cls.menu)
+        RoleMenuButtonPermission.objects.create(role=cls.role, menu_button=button)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, viewset, action, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        request = APIRequestFactory().get("/", **headers)
+        force_authenticate(request, user=self.user)
+        # 与路由注册一致, 使用 action 上的 permission_classes
+        response = viewset.as_view({"get": action}, **getattr(viewset, action).kwargs)(request)
+        response.render()
+        return response
+
+    def get_etags(self):
+        return [self.get(viewset, action)["ETag"] for viewset, action in self.views]
+
+    def test_not_modified(self):
+        for viewset, action in self.views:
+            response = self.get(viewset, action)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+            for if_none_match in (etag, f"W/{etag}", f'"other", W/{etag}'):
+                with self.assertNumQueries(0):
+                    response = self.get(viewset, action, if_none_match)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], etag)
+            self.assertEqual(self.get(viewset, action, '"other"').status_code, 200)
+
+    def test_etag_changes(self):
+        etags = self.get_etags()
+        self.assertEqual([item["path"] for item in self.get(*self.views[0]).data["data"]], ["/menu_cache"])
+        # 菜单授权变化
+        permission = RoleMenuPermission.objects.create(role=self.role, menu=self.other_menu)
+        new_etags = self.get_etags()
+        self.assertTrue(all(new != old for new, old in zip(new_etags, etags)))
+        self.assertEqual({item["path"] for item in self.get(*self.views[0]).data["data"]},
+                         {"/menu_cache", "/menu_cache_other"})
+        permission.delete()
+        self.assertTrue(all(new != old for new, old in zip(self.get_etags(), new_etags)))
+        # 菜单变化
+        etags = self.get_etags()
+        self.menu.web_path = "/menu_cache_new"
+        self.menu.save()
+        self.assertTrue(all(new != old for new, old in zip(self.get_etags(), etags)))
+        self.assertEqual([item["path"] for item in self.get(*self.views[0]).data["data"]], ["/menu_cache_new"])
+
+
+
+class UserListQueryCountTest(TestCase):
+    """
+    用户列表自动预加载关联数据, 查询次数不随分页大小变化
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create(username="eager_admin", name="eager_admin", is_superuser=True)
+        parent = Dept.objects.create(name="eager_parent", key="eager_parent")
+        depts = [Dept.objects.create(name=f"eager_{i}", key=f"eager_{i}", parent=parent) for i in range(3)]
+        roles = [Role.objects.create(name=f"eager_{i}", key=f"eager_{i}") for i in range(2)]
+        posts = [Post.objects.create(name=f"eager_{i}", code=f"eager_{i}") for i in range(2)]
+        for i in range(20):
+            user = Users.objects.create(username=f"eager_{i}", name=f"eager_{i}", dept=depts[i % 3],
+                                        creator=cls.admin, modifier=str(cls.admin.id))
+            user.role.add(*roles[:i % 2 + 1])
+            user.post.add(posts[i % 2])
+
+    def count_queries(self, limit, **params):
+        # 每次从空缓存开始统计
+        cache.clear()
+        clear_identity_cache()
+        request = APIRequestFactory().get("/", {"page": 1, "limit": limit, **params})
+        force_authenticate(request, user=self.admin)
+        with CaptureQueriesContext(connection) as context:
+            response = UserViewSet.as_view({"get": "list"})(request)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["data"]), limit)
+        self.data = response.data["data"]
+        return len(context.captured_queries)
+
+    def test_list_query_count(self):
+        self.assertEqual(self.count_queries(2), self.count_queries(20))
+
+    def test_restql_query_count(self):
+        query = "{id, username, dept_name, dept_name_all, role_info{name}, post, creator_name}"
+        self.assertEqual(self.count_queries(2, query=query), self.count_queries(20, query=query))
+        self.assertEqual(set(self.data[0]), {"id", "username", "dept_name", "dept_name_all", "role_info", "post",
+                                             "creator_name"})
+        # 只查询本表字段时不预加载关联数据
+        self.assertLess(self.count_queries(20, query="{id, username}"), self.count_queries(20, query=query))
+
+
 if __name__ == '__main__':
     getMenu()
\ No newline at end of file
@@ -2,6 +2,7 @@ from django.urls import path
 from rest_framework import routers
 
 from dvadmin.system.views.api_white_list import ApiWhiteListViewSet
+from dvadmin.system.views.async_job import AsyncJobView, AsyncJobDownloadView
 from dvadmin.system.views.area import AreaViewSet
 from dvadmin.system.views.clause import PrivacyView, TermsServiceView
 from dvadmin.system.views.dept import DeptViewSet
@@ -47,6 +48,8 @@ urlpatterns = [
     path('login_log/', LoginLogViewSet.as_view({'get': 'list'})),
     path('login_log/<int:pk>/', LoginLogViewSet.as_view({'get': 'retrieve'})),
     path('dept_lazy_tree/', DeptViewSet.as_view({'get': 'dept_lazy_tree'})),
+    path('async_job/<str:job_id>/', AsyncJobView.as_view()),
+    path('async_job/<str:job_id>/download/', AsyncJobDownloadView.as_view()),
     path('clause/privacy.html', PrivacyView.as_view()),
     path('clause/terms_service.html', TermsServiceView.as_view()),
 ]
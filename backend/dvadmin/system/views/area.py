@@ -4,6 +4,7 @@ from rest_framework import serializers
 
 from dvadmin.system.models import Area
 from dvadmin.utils.json_response import SuccessResponse
+from dvadmin.utils.models import subquery_count
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -15,12 +16,11 @@ class AreaSerializer(CustomModelSerializer):
     pcode_count = serializers.SerializerMethodField(read_only=True)
     hasChild = serializers.SerializerMethodField()
     def get_pcode_count(self, instance: Area):
-        return Area.objects.filter(pcode=instance).count()
+        if not hasattr(instance, "child_count"):
+            instance.child_count = Area.objects.filter(pcode=instance).count()
+        return instance.child_count
     def get_hasChild(self, instance):
-        hasChild = Area.objects.filter(pcode=instance.code)
-        if hasChild:
-            return True
-        return False
+        return self.get_pcode_count(instance) > 0
     class Meta:
         model = Area
         fields = "__all__"
@@ -64,5 +64,6 @@ class AreaViewSet(CustomModelViewSet):
             queryset = self.queryset.filter(enable=True, pcode=pcode)
         else:
             queryset = self.queryset.filter(enable=True)
-        return queryset
+        # 查询中统计下级地区数, 避免逐条查询
+        return queryset.annotate(child_count=subquery_count(Area.objects.all(), "pcode", "code"))
 
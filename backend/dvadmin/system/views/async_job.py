@@ -0,0 +1,40 @@
+from django.http import FileResponse
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+
+from dvadmin.system.models import FileList
+from dvadmin.utils.jobs import Job
+from dvadmin.utils.json_response import DetailResponse, ErrorResponse
+
+
+class AsyncJobView(APIView):
+    """
+    后台任务状态查询, 只有提交任务的用户可以查看
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_job(self, request, job_id):
+        job = Job.get(job_id)
+        if job is None or job.user_id != request.user.id:
+            return None
+        return job
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = self.get_job(request, job_id)
+        if job is None:
+            return ErrorResponse(msg="任务不存在或已过期", code=404, status=status.HTTP_404_NOT_FOUND)
+        return DetailResponse(data=job.get_state(), msg="获取成功")
+
+
+class AsyncJobDownloadView(AsyncJobView):
+    """
+    下载后台任务导出的文件, 只有提交任务的用户可以下载
+    """
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = self.get_job(request, job_id)
+        file = FileList.objects.filter(id=job.file_id).first() if job and job.file_id else None
+        if file is None or not file.url:
+            return ErrorResponse(msg="文件不存在或已过期", code=404, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(file.url.open("rb"), as_attachment=True, filename=file.name)
@@ -5,12 +5,16 @@
 @contact: QQ:2505811377
 @Remark: 部门管理
 """
+from django.db.models import Count
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
 from dvadmin.system.models import Dept, RoleMenuButtonPermission, Users
+from dvadmin.utils.cache import bump_cache_version
+from dvadmin.utils.filters import DEPT_CACHE_VERSION
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse, ErrorResponse
+from dvadmin.utils.models import subquery_count
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -26,14 +30,23 @@ class DeptSerializer(CustomModelSerializer):
 
     dept_user_count = serializers.SerializerMethodField()
 
+    @staticmethod
+    def annotate_counts(queryset):
+        """
+        查询中统计用户数和下级部门数, 避免逐条查询
+        """
+        return queryset.annotate(
+            user_count=subquery_count(Users.objects.all(), "dept"),
+            child_count=subquery_count(Dept.objects.all(), "parent"),
+        )
+
     def get_dept_user_count(self, obj: Dept):
+        if hasattr(obj, "user_count"):
+            return obj.user_count
         return Users.objects.filter(dept=obj).count()
 
     def get_hasChild(self, instance):
-        hasChild = Dept.objects.filter(parent=instance.id)
-        if hasChild:
-            return True
-        return False
+        return self.get_has_children(instance) > 0
 
     def get_status_label(self, obj: Dept):
         if obj.status:
@@ -41,7 +54,23 @@ class DeptSerializer(CustomModelSerializer):
         return "禁用"
 
     def get_has_children(self, obj: Dept):
-        return Dept.objects.filter(parent_id=obj.id).count()
+        if not hasattr(obj, "child_count"):
+            obj.child_count = Dept.objects.filter(parent_id=obj.id).count()
+        return obj.child_count
+
+    def validate_parent(self, parent):
+        """
+        上级部门不能是自身或其下级部门
+        """
+        if parent is None or self.instance is None or not isinstance(self.instance, Dept):
+            return parent
+        if parent.id == self.instance.id:
+            raise serializers.ValidationError("不能将部门移动到自身或其下级部门")
+        path = Dept.get_dept_path(self.instance.id)
+        parent_path = Dept.get_dept_path(parent.id)
+        if path and parent_path and parent_path.startswith(path):
+            raise serializers.ValidationError("不能将部门移动到自身或其下级部门")
+        return parent
 
     class Meta:
         model = Dept
@@ -53,6 +82,7 @@ class DeptImportSerializer(CustomModelSerializer):
     """
     部门-导入-序列化器
     """
+    validate_parent = DeptSerializer.validate_parent
 
     class Meta:
         model = Dept
@@ -64,6 +94,7 @@ class DeptCreateUpdateSerializer(CustomModelSerializer):
     """
     部门管理 创建/更新时的列化器
     """
+    validate_parent = DeptSerializer.validate_parent
 
     def create(self, validated_data):
         value = validated_data.get('parent', None)
@@ -103,6 +134,12 @@ class DeptViewSet(CustomModelViewSet):
         "name": "部门名称",
         "key": "部门标识",
     }
+    # 部门路径与部门缓存在 after_bulk_import 中统一更新
+    import_bulk = True
+
+    def after_bulk_import(self, model, creates, updates):
+        Dept.rebuild_path()
+        bump_cache_version(DEPT_CACHE_VERSION)
 
     def list(self, request, *args, **kwargs):
         # 如果懒加载，则只返回父级
@@ -119,7 +156,7 @@ class DeptViewSet(CustomModelViewSet):
             queryset = self.queryset.filter(status=True, parent=parent)
         else:
             queryset = self.queryset.filter(status=True)
-        queryset = self.filter_queryset(queryset)
+        queryset = DeptSerializer.annotate_counts(self.filter_queryset(queryset).select_related('parent'))
         serializer = DeptSerializer(queryset, many=True, request=request)
         data = serializer.data
         return SuccessResponse(data=data)
@@ -189,31 +226,23 @@ class DeptViewSet(CustomModelViewSet):
     @action(methods=['GET'], detail=False, permission_classes=[])
     def dept_info(self, request):
         """部门信息"""
-        def inner(did, li):
-            sub = Dept.objects.filter(parent_id=did)
-            if not sub.exists():
-                return li
-            for i in sub:
-                li.append(i.pk)
-                inner(i, li)
-            return li
         dept_id = request.query_params.get('dept_id')
         show_all = request.query_params.get('show_all')
         if dept_id is None:
             return ErrorResponse(msg="部门不存在")
         if not show_all:
             show_all = 0
-        if int(show_all):  # 递归当前部门下的所有部门，查询用户
-            all_did = [dept_id]
-            inner(dept_id, all_did)
-            users = Users.objects.filter(dept_id__in=all_did)
+        dept_obj = Dept.objects.filter(id=dept_id).first() if dept_id != '' else None
+        if dept_obj and not dept_obj.path:
+            dept_obj.path = Dept.get_dept_path(dept_obj.id)
+        if int(show_all):  # 通过部门路径查询当前部门及所有下级部门的用户
+            users = Users.objects.filter(dept__path__startswith=dept_obj.path) if dept_obj else Users.objects.none()
         else:
             if dept_id != '':
                 users = Users.objects.filter(dept_id=dept_id)
             else:
                 users = Users.objects.none()
-        dept_obj = Dept.objects.get(id=dept_id) if dept_id != '' else None
-        sub_dept = Dept.objects.filter(parent_id=dept_obj.pk) if dept_id != '' else []
+        sub_dept = Dept.objects.filter(parent_id=dept_obj.pk) if dept_obj else []
         data = {
             'dept_name': dept_obj and dept_obj.name,
             'dept_user': users.count(),
@@ -226,12 +255,15 @@ class DeptViewSet(CustomModelViewSet):
             },
             'sub_dept_map': []
         }
-        for dept in sub_dept:
-            all_did = [dept.pk]
-            inner(dept.pk, all_did)
-            sub_data = {
-                'name': dept.name,
-                'count': Users.objects.filter(dept_id__in=all_did).count()
-            }
-            data['sub_dept_map'].append(sub_data)
+        if sub_dept:
+            # 一次分组查询各部门的用户数,再按下级部门路径汇总
+            dept_user_count = Users.objects.filter(dept__path__startswith=dept_obj.path).values(
+                'dept__path').annotate(count=Count('id')).values_list('dept__path', 'count')
+            dept_user_count = list(dept_user_count)
+            for dept in sub_dept:
+                sub_data = {
+                    'name': dept.name,
+                    'count': sum(count for path, count in dept_user_count if path.startswith(dept.path))
+                }
+                data['sub_dept_map'].append(sub_data)
         return SuccessResponse(data)
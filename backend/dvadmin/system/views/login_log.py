@@ -34,3 +34,6 @@ class LoginLogViewSet(CustomModelViewSet):
     queryset = LoginLog.objects.all()
     serializer_class = LoginLogSerializer
     extra_filter_class = []
+    # 数据量大, 支持游标分页, 总数估算或缓存
+    keyset_pagination = True
+    count_strategy = "auto"
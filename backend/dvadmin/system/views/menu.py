@@ -6,12 +6,15 @@
 @Created on: 2021/6/1 001 22:38
 @Remark: 菜单模块
 """
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework.decorators import action
 
-from dvadmin.system.models import Menu, RoleMenuPermission
+from dvadmin.system.models import Menu, RoleMenuPermission, MenuButton
 from dvadmin.system.views.menu_button import MenuButtonSerializer
 from dvadmin.utils.json_response import SuccessResponse, ErrorResponse
+from dvadmin.utils.menu_cache import role_cached_response
+from dvadmin.utils.models import subquery_count
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -23,8 +26,20 @@ class MenuSerializer(CustomModelSerializer):
     menuPermission = serializers.SerializerMethodField(read_only=True)
     hasChild = serializers.SerializerMethodField()
 
+    @staticmethod
+    def annotate_counts(queryset):
+        """
+        查询中统计下级菜单数并预加载按钮, 避免逐条查询
+        """
+        return queryset.annotate(child_count=subquery_count(Menu.objects.all(), "parent")).prefetch_related(
+            Prefetch('menuPermission', queryset=MenuButton.objects.order_by('-name')))
+
     def get_menuPermission(self, instance):
-        queryset = instance.menuPermission.order_by('-name').values('id', 'name', 'value')
+        if 'menuPermission' in getattr(instance, '_prefetched_objects_cache', {}):
+            queryset = [{'id': item.id, 'name': item.name, 'value': item.value}
+                        for item in instance.menuPermission.all()]
+        else:
+            queryset = instance.menuPermission.order_by('-name').values('id', 'name', 'value')
         # MenuButtonSerializer(instance.menuPermission.all(), many=True)
         if queryset:
             return queryset
@@ -32,10 +47,9 @@ class MenuSerializer(CustomModelSerializer):
             return None
 
     def get_hasChild(self, instance):
-        hasChild = Menu.objects.filter(parent=instance.id)
-        if hasChild:
-            return True
-        return False
+        if hasattr(instance, 'child_count'):
+            return instance.child_count > 0
+        return Menu.objects.filter(parent=instance.id).exists()
 
     class Meta:
         model = Menu
@@ -110,24 +124,27 @@ class MenuViewSet(CustomModelViewSet):
                 queryset = self.queryset.filter()
         else:
             queryset = self.queryset.filter(parent__isnull=True)
-        queryset = self.filter_queryset(queryset)
+        queryset = MenuSerializer.annotate_counts(self.filter_queryset(queryset))
         serializer = MenuSerializer(queryset, many=True, request=request)
         data = serializer.data
         return SuccessResponse(data=data)
 
     @action(methods=['GET'], detail=False, permission_classes=[])
     def web_router(self, request):
-        """用于前端获取当前角色的路由"""
+        """用于前端获取当前角色的路由, 按角色集合缓存"""
         user = request.user
-        if user.is_superuser:
-            queryset = self.queryset.filter(status=1)
-        else:
-            role_list = user.role.values_list('id', flat=True)
-            menu_list = RoleMenuPermission.objects.filter(role__in=role_list).values_list('menu_id', flat=True)
-            queryset = Menu.objects.filter(id__in=menu_list)
-        serializer = WebRouterSerializer(queryset, many=True, request=request)
-        data = serializer.data
-        return SuccessResponse(data=data, total=len(data), msg="获取成功")
+
+        def build():
+            if user.is_superuser:
+                queryset = self.queryset.filter(status=1)
+            else:
+                role_list = user.role.values_list('id', flat=True)
+                menu_list = RoleMenuPermission.objects.filter(role__in=role_list).values_list('menu_id', flat=True)
+                queryset = Menu.objects.filter(id__in=menu_list)
+            serializer = WebRouterSerializer(queryset, many=True, request=request)
+            return [dict(item) for item in serializer.data]
+
+        return role_cached_response(request, "web_router", build, SuccessResponse, total=len, msg="获取成功")
 
     @action(methods=['GET'], detail=False, permission_classes=[])
     def get_all_menu(self, request):
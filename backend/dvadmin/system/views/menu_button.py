@@ -12,6 +12,7 @@ from rest_framework.permissions import IsAuthenticated
 
 from dvadmin.system.models import MenuButton, RoleMenuButtonPermission
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse
+from dvadmin.utils.menu_cache import role_cached_response
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -70,17 +71,20 @@ class MenuButtonViewSet(CustomModelViewSet):
     @action(methods=['get'],detail=False,permission_classes=[IsAuthenticated])
     def menu_button_all_permission(self,request):
         """
-        获取所有的按钮权限
+        获取所有的按钮权限, 按角色集合缓存
         :param request:
         :return:
         """
-        is_superuser = request.user.is_superuser
-        if is_superuser:
-            queryset = MenuButton.objects.values_list('value',flat=True)
-        else:
-            role_id = request.user.role.values_list('id', flat=True)
-            queryset = RoleMenuButtonPermission.objects.filter(role__in=role_id).values_list('menu_button__value',flat=True).distinct()
-        return DetailResponse(data=queryset)
+        def build():
+            is_superuser = request.user.is_superuser
+            if is_superuser:
+                queryset = MenuButton.objects.values_list('value',flat=True)
+            else:
+                role_id = request.user.role.values_list('id', flat=True)
+                queryset = RoleMenuButtonPermission.objects.filter(role__in=role_id).values_list('menu_button__value',flat=True).distinct()
+            return list(queryset)
+
+        return role_cached_response(request, "menu_button_all_permission", build, DetailResponse)
 
     @action(methods=['post'], detail=False, permission_classes=[IsAuthenticated])
     def batch_create(self, request, *args, **kwargs):
@@ -1,11 +1,10 @@
 # -*- coding: utf-8 -*-
-from django.apps import apps
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
 from dvadmin.system.models import  Role, MenuField
-from dvadmin.utils.models import get_custom_app_models
+from dvadmin.utils.models import get_custom_app_models, get_all_models_objects, get_model_registry
 from dvadmin.utils.viewset import CustomModelViewSet
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.json_response import DetailResponse, ErrorResponse, SuccessResponse
@@ -39,10 +38,8 @@ class MenuFieldViewSet(CustomModelViewSet):
 
     def create(self, request, *args, **kwargs):
         payload = request.data
-        for model in apps.get_models():
-            if payload.get('model') == model.__name__:
-                break
-        else:
+        model = get_all_models_objects(payload.get('model')).get('object')
+        if model is None:
             return ErrorResponse(msg='模型表不存在')
 
         if MenuField.objects.filter(menu=payload.get('menu'),model=model.__name__, field_name=payload.get('field_name')).exists():
@@ -69,13 +66,11 @@ class MenuFieldViewSet(CustomModelViewSet):
         model_name = request.data.get('model')
         if not menu_id or not model_name:
             return ErrorResponse( msg='参数错误')
-        for model in get_custom_app_models():
-            if model['model'] != model_name:
-                continue
+        model = get_model_registry().get_by_name(model_name)
+        if model is not None:
+            existing = set(MenuField.objects.filter(menu_id=menu_id, model=model_name).values_list('field_name', flat=True))
             for field in model['fields']:
-                if MenuField.objects.filter(
-                        menu_id=menu_id, model=model_name, field_name=field['name']
-                ).exists():
+                if field['name'] in existing:
                     continue
                 data = {
                     'menu': menu_id,
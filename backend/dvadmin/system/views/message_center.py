@@ -2,14 +2,18 @@
 import json
 
 from asgiref.sync import async_to_sync
+from django.db import transaction
 from channels.layers import get_channel_layer
 from django_restql.fields import DynamicSerializerMethodField
 from rest_framework import serializers
 from rest_framework.decorators import action, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
-from dvadmin.system.models import MessageCenter, Users, MessageCenterTargetUser
+from dvadmin.system.models import MessageCenter, MessageCenterTargetUser
 from dvadmin.utils.json_response import SuccessResponse, DetailResponse
+from dvadmin.utils.message_fanout import get_target_user_ids, message_fanout, is_broadcast_storage, \
+    get_user_messages, get_unread_count, is_message_read, mark_message_read, mark_messages_read, annotate_is_read, \
+    get_target_prefetches
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -21,7 +25,8 @@ class MessageCenterSerializer(CustomModelSerializer):
     role_info = DynamicSerializerMethodField()
     user_info = DynamicSerializerMethodField()
     dept_info = DynamicSerializerMethodField()
-    is_read = serializers.BooleanField(read_only=True, source='target_user__is_read')
+    # 列表、详情接口的查询中标注当前用户是否已读
+    is_read = serializers.BooleanField(read_only=True)
 
     def get_role_info(self, instance, parsed_query):
         roles = instance.target_role.all()
@@ -83,12 +88,9 @@ class MessageCenterTargetUserListSerializer(CustomModelSerializer):
     is_read = serializers.SerializerMethodField()
 
     def get_is_read(self, instance):
-        user_id = self.request.user.id
-        message_center_id = instance.id
-        queryset = MessageCenterTargetUser.objects.filter(messagecenter__id=message_center_id, users_id=user_id).first()
-        if queryset:
-            return queryset.is_read
-        return False
+        if hasattr(instance, 'is_read'):
+            return instance.is_read
+        return is_message_read(self.request.user.id, instance)
 
     class Meta:
         model = MessageCenter
@@ -117,32 +119,23 @@ class MessageCenterCreateSerializer(CustomModelSerializer):
     """
 
     def save(self, **kwargs):
-        data = super().save(**kwargs)
         initial_data = self.initial_data
-        target_type = initial_data.get('target_type')
-        # 在保存之前,根据目标类型,把目标用户查询出来并保存
-        users = initial_data.get('target_user', [])
-        if target_type in [1]:  # 按角色
-            target_role = initial_data.get('target_role', [])
-            users = Users.objects.filter(role__id__in=target_role).values_list('id', flat=True)
-        if target_type in [2]:  # 按部门
-            target_dept = initial_data.get('target_dept', [])
-            users = Users.objects.filter(dept__id__in=target_dept).values_list('id', flat=True)
-        if target_type in [3]:  # 系统通知
-            users = Users.objects.values_list('id', flat=True)
-        targetuser_data = []
-        for user in users:
-            targetuser_data.append({
-                "messagecenter": data.id,
-                "users": user
-            })
-        targetuser_instance = MessageCenterTargetUserSerializer(data=targetuser_data, many=True, request=self.request)
-        targetuser_instance.is_valid(raise_exception=True)
-        targetuser_instance.save()
-        for user in users:
-            unread_count = MessageCenterTargetUser.objects.filter(users__id=user, is_read=False).count()
-            websocket_push(user, message={"sender": 'system', "contentType": 'SYSTEM',
-                                          "content": '您有一条新消息~', "unread": unread_count})
+        message = {"sender": 'system', "contentType": 'SYSTEM', "content": '您有一条新消息~'}
+        if is_broadcast_storage(initial_data.get('target_type')):
+            # 系统通知广播存储, 不逐个保存目标用户
+            with transaction.atomic():
+                data = super().save(broadcast=True, **kwargs)
+                message_fanout.broadcast(data, message)
+            return data
+        data = super().save(**kwargs)
+        # 在保存之后,根据目标类型,把目标用户查询出来并分发消息
+        users = get_target_user_ids(
+            initial_data.get('target_type'),
+            target_user=initial_data.get('target_user', []),
+            target_role=initial_data.get('target_role', []),
+            target_dept=initial_data.get('target_dept', []),
+        )
+        message_fanout.fan_out(data, users, message=message, request=self.request)
         return data
 
     class Meta:
@@ -167,23 +160,24 @@ class MessageCenterViewSet(CustomModelViewSet):
 
     def get_queryset(self):
         if self.action == 'list':
-            return MessageCenter.objects.filter(creator=self.request.user.id).all()
-        return MessageCenter.objects.all()
+            queryset = MessageCenter.objects.filter(creator=self.request.user.id).all()
+        else:
+            queryset = MessageCenter.objects.all()
+        if self.action in ['list', 'retrieve']:
+            queryset = annotate_is_read(queryset, self.request.user.id).prefetch_related(*get_target_prefetches())
+        return queryset
 
     def retrieve(self, request, *args, **kwargs):
         """
         重写查看
         """
-        pk = kwargs.get('pk')
         user_id = self.request.user.id
-        queryset = MessageCenterTargetUser.objects.filter(users__id=user_id, messagecenter__id=pk).first()
-        if queryset:
-            queryset.is_read = True
-            queryset.save()
         instance = self.get_object()
+        if mark_message_read(user_id, instance):
+            instance.is_read = True
         serializer = self.get_serializer(instance)
         # 主动推送消息
-        unread_count = MessageCenterTargetUser.objects.filter(users__id=user_id, is_read=False).count()
+        unread_count = get_unread_count(user_id)
         websocket_push(user_id, message={"sender": 'system', "contentType": 'TEXT',
                                          "content": '您查看了一条消息~', "unread": unread_count})
         return DetailResponse(data=serializer.data, msg="获取成功")
@@ -195,7 +189,8 @@ class MessageCenterViewSet(CustomModelViewSet):
         """
         self_user_id = self.request.user.id
         # queryset = MessageCenterTargetUser.objects.filter(users__id=self_user_id).order_by('-create_datetime')
-        queryset = MessageCenter.objects.filter(target_user__id=self_user_id)
+        queryset = annotate_is_read(get_user_messages(request.user), self_user_id).prefetch_related(
+            'target_user', 'target_dept', 'target_role')
         # queryset = self.filter_queryset(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -204,15 +199,27 @@ class MessageCenterViewSet(CustomModelViewSet):
         serializer = MessageCenterTargetUserListSerializer(queryset, many=True, request=request)
         return SuccessResponse(data=serializer.data, msg="获取成功")
 
+    @action(methods=['POST'], detail=False, permission_classes=[IsAuthenticated])
+    def mark_read(self, request):
+        """
+        批量标记已读, ids 为消息id列表, 不传时全部标记已读
+        """
+        ids = request.data.get('ids', None)
+        user_id = request.user.id
+        unread_count = mark_messages_read(user_id, ids)
+        # 主动推送消息
+        websocket_push(user_id, message={"sender": 'system', "contentType": 'TEXT',
+                                         "content": '消息已标记为已读~', "unread": unread_count})
+        return DetailResponse(data={"unread": unread_count}, msg="标记成功")
+
     @action(methods=['GET'], detail=False, permission_classes=[IsAuthenticated])
     def get_newest_msg(self, request):
         """
         获取最新的一条消息
         """
-        self_user_id = self.request.user.id
-        queryset = MessageCenterTargetUser.objects.filter(users__id=self_user_id).order_by('create_datetime').last()
+        queryset = get_user_messages(request.user).order_by('create_datetime').last()
         data = None
         if queryset:
-            serializer = MessageCenterTargetUserListSerializer(queryset.messagecenter, many=False, request=request)
+            serializer = MessageCenterTargetUserListSerializer(queryset, many=False, request=request)
             data = serializer.data
         return DetailResponse(data=data, msg="获取成功")
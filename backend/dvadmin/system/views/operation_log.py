@@ -44,4 +44,7 @@ class OperationLogViewSet(CustomModelViewSet):
     """
     queryset = OperationLog.objects.order_by('-create_datetime')
     serializer_class = OperationLogSerializer
+    # 数据量大, 支持游标分页, 总数估算或缓存
+    keyset_pagination = True
+    count_strategy = "auto"
     # permission_classes = []
@@ -6,6 +6,7 @@
 @Created on: 2021/6/3 003 0:30
 @Remark: 菜单按钮管理
 """
+from django.db import transaction
 from django.db.models import F, Subquery, OuterRef, Exists
 from rest_framework import serializers
 from rest_framework.decorators import action
@@ -14,7 +15,11 @@ from rest_framework.permissions import IsAuthenticated
 from dvadmin.system.models import RoleMenuButtonPermission, Menu, MenuButton, Dept, RoleMenuPermission, FieldPermission, \
     MenuField
 from dvadmin.system.views.menu import MenuSerializer
+from dvadmin.utils.cache import bump_cache_version
 from dvadmin.utils.json_response import DetailResponse, ErrorResponse
+from dvadmin.utils.field_permission import FIELD_PERMISSION_CACHE_VERSION
+from dvadmin.utils.menu_cache import MENU_CACHE_VERSION
+from dvadmin.utils.permission import PERMISSION_CACHE_VERSION
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -43,118 +48,199 @@ class RoleMenuButtonPermissionCreateUpdateSerializer(CustomModelSerializer):
         read_only_fields = ["id"]
 
 
-class RoleButtonPermissionSerializer(CustomModelSerializer):
+def get_role_permission_matrix(role_id, catalogs):
     """
-    角色按钮权限
+    角色授权页面的菜单/按钮/列权限, 固定次数批量查询后在内存中组装
+    :param role_id: 被授权的角色id
+    :param catalogs: 目录 values('id', 'name') 查询集
+    :return: [{id, name, menus: [{id, name, isCheck, btns, columns}]}]
     """
-    isCheck = serializers.SerializerMethodField()
-    data_range = serializers.SerializerMethodField()
-
-    def get_isCheck(self, instance):
-        params = self.request.query_params
-        return RoleMenuButtonPermission.objects.filter(
-            menu_button__id=instance['id'],
-            role__id=params.get('role'),
-        ).exists()
-
-    def get_data_range(self, instance):
-        params = self.request.query_params
-        obj = RoleMenuButtonPermission.objects.filter(
-            menu_button__id=instance['id'],
-            role__id=params.get('role'),
-        ).first()
-        if obj is None:
-            return None
-        return obj.data_range
-
-    class Meta:
-        model = MenuButton
-        fields = ['id', 'name', 'value', 'isCheck', 'data_range']
-
-
-class RoleFieldPermissionSerializer(CustomModelSerializer):
-    class Meta:
-        model = FieldPermission
-        fields = "__all__"
-
-
-class RoleMenuFieldSerializer(CustomModelSerializer):
-    is_query = serializers.SerializerMethodField()
-    is_create = serializers.SerializerMethodField()
-    is_update = serializers.SerializerMethodField()
-
-    def get_is_query(self, instance):
-        params = self.request.query_params
-        queryset = instance.menu_field.filter(role=params.get('role')).first()
-        if queryset:
-            return queryset.is_query
-        return False
-
-    def get_is_create(self, instance):
-        params = self.request.query_params
-        queryset = instance.menu_field.filter(role=params.get('role')).first()
-        if queryset:
-            return queryset.is_create
-        return False
-
-    def get_is_update(self, instance):
-        params = self.request.query_params
-        queryset = instance.menu_field.filter(role=params.get('role')).first()
-        if queryset:
-            return queryset.is_update
-        return False
-
-    class Meta:
-        model = MenuField
-        fields = ['id', 'field_name', 'title', 'is_query', 'is_create', 'is_update']
-
-
-class RoleMenuSerializer(CustomModelSerializer):
-    menus = serializers.SerializerMethodField()
-
-    def get_menus(self, instance):
-        menu_list = Menu.objects.filter(parent=instance['id']).values('id', 'name')
-        serializer = RoleMenuPermissionSerializer(menu_list, many=True, request=self.request)
-        return serializer.data
-
-    class Meta:
-        model = Menu
-        fields = ['id', 'name', 'menus']
-
-
-class RoleMenuPermissionSerializer(CustomModelSerializer):
+    catalogs = list(catalogs)
+    menus = {}
+    for menu in Menu.objects.filter(parent__in=[item['id'] for item in catalogs]).values('id', 'name', 'parent'):
+        menus.setdefault(menu['parent'], []).append(menu)
+    menu_ids = [menu['id'] for items in menus.values() for menu in items]
+    checked_menus = set(RoleMenuPermission.objects.filter(role_id=role_id, menu_id__in=menu_ids).values_list(
+        'menu_id', flat=True))
+    btns = {}
+    for btn in MenuButton.objects.filter(menu_id__in=menu_ids).values('id', 'name', 'value', 'menu'):
+        btns.setdefault(btn['menu'], []).append(btn)
+    # 同一按钮存在多条授权时与原来一致取第一条
+    btn_permissions = {}
+    for btn_id, data_range in RoleMenuButtonPermission.objects.filter(
+            role_id=role_id, menu_button__menu_id__in=menu_ids).values_list('menu_button_id', 'data_range'):
+        btn_permissions.setdefault(btn_id, data_range)
+    columns = {}
+    for col in MenuField.objects.filter(menu_id__in=menu_ids).values('id', 'field_name', 'title', 'menu'):
+        columns.setdefault(col['menu'], []).append(col)
+    field_permissions = {}
+    for item in FieldPermission.objects.filter(role_id=role_id, field__menu_id__in=menu_ids).values(
+            'field_id', 'is_query', 'is_create', 'is_update'):
+        field_permissions.setdefault(item['field_id'], item)
+    data = []
+    for catalog in catalogs:
+        menu_data = []
+        for menu in menus.get(catalog['id'], []):
+            menu_data.append({
+                'id': menu['id'],
+                'name': menu['name'],
+                'isCheck': menu['id'] in checked_menus,
+                'btns': [{
+                    'id': btn['id'],
+                    'name': btn['name'],
+                    'value': btn['value'],
+                    'isCheck': btn['id'] in btn_permissions,
+                    'data_range': btn_permissions.get(btn['id']),
+                } for btn in btns.get(menu['id'], [])],
+                'columns': [{
+                    'id': col['id'],
+                    'field_name': col['field_name'],
+                    'title': col['title'],
+                    'is_query': field_permissions.get(col['id'], {}).get('is_query', False),
+                    'is_create': field_permissions.get(col['id'], {}).get('is_create', False),
+                    'is_update': field_permissions.get(col['id'], {}).get('is_update', False),
+                } for col in columns.get(menu['id'], [])],
+            })
+        data.append({'id': catalog['id'], 'name': catalog['name'], 'menus': menu_data})
+    return data
+
+
+def _get_menu_ancestors(menu_id, parents):
     """
-    菜单和按钮权限
+    从内存中的菜单索引获取菜单本身及所有上级菜单id
+    :param parents: {菜单id: 上级菜单id}
     """
-    # name = serializers.SerializerMethodField()
-    isCheck = serializers.SerializerMethodField()
-    btns = serializers.SerializerMethodField()
-    columns = serializers.SerializerMethodField()
+    menu_ids = []
+    while menu_id is not None and menu_id in parents and menu_id not in menu_ids:
+        menu_ids.append(menu_id)
+        menu_id = parents[menu_id]
+    return menu_ids
 
-    # def get_name(self, instance):
-    #     parent_list = Menu.get_all_parent(instance['id'])
-    #     names = [d["name"] for d in parent_list]
-    #     return "/".join(names)
-    def get_isCheck(self, instance):
-        params = self.request.query_params
-        return RoleMenuPermission.objects.filter(
-            menu__id=instance['id'],
-            role__id=params.get('role'),
-        ).exists()
 
-    def get_btns(self, instance):
-        btn_list = MenuButton.objects.filter(menu__id=instance['id']).values('id', 'name', 'value')
-        serializer = RoleButtonPermissionSerializer(btn_list, many=True, request=self.request)
-        return serializer.data
+def _delete_without_signals(queryset):
+    """
+    直接删除记录, 不逐条触发删除信号
+    授权记录没有被其他表引用, 缓存版本号由 save_role_permission_matrix 提交后统一刷新,
+    逐条信号会在事务提交前刷新版本号, 其他进程可能按新版本号缓存未提交前的授权
+    """
+    return queryset._raw_delete(queryset.db)
 
-    def get_columns(self, instance):
-        col_list = MenuField.objects.filter(menu=instance['id'])
-        serializer = RoleMenuFieldSerializer(col_list, many=True, request=self.request)
-        return serializer.data
 
-    class Meta:
-        model = Menu
-        fields = ['id', 'name', 'isCheck', 'btns', 'columns']
+@transaction.atomic
+def save_role_permission_matrix(role_id, body):
+    """
+    保存角色授权: 与现有授权比对, 只新增、修改、删除有变化的记录
+    提交的数据为完整的授权矩阵, 未勾选的菜单、按钮授权会被删除, 列权限只新增或修改
+    :param role_id: 角色id
+    :param body: 授权矩阵, 与 get_role_permission_matrix 的格式一致
+    :return: 是否有变化
+    """
+    parents = dict(Menu.objects.values_list('id', 'parent_id'))
+    menu_ids = set()
+    btns = {}
+    columns = {}
+    for item in body:
+        for menu in item["menus"]:
+            if menu.get('isCheck'):
+                menu_ids.update(_get_menu_ancestors(menu.get('id'), parents))
+            for btn in menu.get('btns') or []:
+                if btn.get('isCheck'):
+                    btns[btn.get('id')] = {
+                        'data_range': btn.get('data_range', 0) or 0,
+                        'dept': set(btn.get('dept') or []),
+                    }
+            for col in menu.get('columns') or []:
+                columns[col.get('id')] = {key: col.get(key) for key in ('is_query', 'is_create', 'is_update')}
+    changed = False
+
+    # 菜单授权
+    delete_ids = []
+    existing_menu_ids = set()
+    for pk, menu_id in RoleMenuPermission.objects.filter(role_id=role_id).values_list('id', 'menu_id'):
+        if menu_id in menu_ids and menu_id not in existing_menu_ids:
+            existing_menu_ids.add(menu_id)
+        else:
+            delete_ids.append(pk)
+    if delete_ids:
+        _delete_without_signals(RoleMenuPermission.objects.filter(id__in=delete_ids))
+    create_menu_ids = menu_ids - existing_menu_ids
+    if create_menu_ids:
+        RoleMenuPermission.objects.bulk_create(
+            [RoleMenuPermission(role_id=role_id, menu_id=menu_id) for menu_id in create_menu_ids]
+        )
+    changed = changed or bool(delete_ids or create_menu_ids)
+
+    # 按钮授权及自定义数据权限部门
+    through = RoleMenuButtonPermission.dept.through
+    delete_ids = []
+    update_objs = []
+    existing = {}
+    for obj in RoleMenuButtonPermission.objects.filter(role_id=role_id).only('id', 'menu_button_id', 'data_range'):
+        if obj.menu_button_id not in btns or obj.menu_button_id in existing:
+            delete_ids.append(obj.id)
+            continue
+        existing[obj.menu_button_id] = obj.id
+        data_range = btns[obj.menu_button_id]['data_range']
+        if obj.data_range != data_range:
+            obj.data_range = data_range
+            update_objs.append(obj)
+    if delete_ids:
+        through.objects.filter(rolemenubuttonpermission_id__in=delete_ids).delete()
+        _delete_without_signals(RoleMenuButtonPermission.objects.filter(id__in=delete_ids))
+    if update_objs:
+        RoleMenuButtonPermission.objects.bulk_update(update_objs, ['data_range'])
+    create_btn_ids = [btn_id for btn_id in btns if btn_id not in existing]
+    if create_btn_ids:
+        RoleMenuButtonPermission.objects.bulk_create([
+            RoleMenuButtonPermission(role_id=role_id, menu_button_id=btn_id, data_range=btns[btn_id]['data_range'])
+            for btn_id in create_btn_ids
+        ])
+        # 部分数据库 bulk_create 不返回主键, 重新查询
+        existing.update(RoleMenuButtonPermission.objects.filter(
+            role_id=role_id, menu_button_id__in=create_btn_ids).values_list('menu_button_id', 'id'))
+    permission_ids = {pk: btn_id for btn_id, pk in existing.items()}
+    existing_depts = set()
+    delete_dept_ids = []
+    for pk, permission_id, dept_id in through.objects.filter(
+            rolemenubuttonpermission_id__in=permission_ids).values_list('id', 'rolemenubuttonpermission_id', 'dept_id'):
+        if dept_id in btns[permission_ids[permission_id]]['dept']:
+            existing_depts.add((permission_id, dept_id))
+        else:
+            delete_dept_ids.append(pk)
+    if delete_dept_ids:
+        through.objects.filter(id__in=delete_dept_ids).delete()
+    create_depts = [
+        through(rolemenubuttonpermission_id=pk, dept_id=dept_id)
+        for pk, btn_id in permission_ids.items() for dept_id in btns[btn_id]['dept']
+        if (pk, dept_id) not in existing_depts
+    ]
+    if create_depts:
+        through.objects.bulk_create(create_depts)
+    changed = changed or bool(delete_ids or update_objs or create_btn_ids or delete_dept_ids or create_depts)
+
+    # 列权限
+    update_objs = []
+    for obj in FieldPermission.objects.filter(role_id=role_id, field_id__in=columns):
+        values = columns.pop(obj.field_id, None)
+        if values is None:
+            continue
+        if any(getattr(obj, key) != value for key, value in values.items()):
+            for key, value in values.items():
+                setattr(obj, key, value)
+            update_objs.append(obj)
+    if update_objs:
+        FieldPermission.objects.bulk_update(update_objs, ['is_query', 'is_create', 'is_update'])
+    if columns:
+        FieldPermission.objects.bulk_create(
+            [FieldPermission(role_id=role_id, field_id=field_id, **values) for field_id, values in columns.items()]
+        )
+    changed = changed or bool(update_objs or columns)
+
+    if changed:
+        # 批量操作不触发信号, 提交后统一刷新权限、路由、列权限缓存
+        transaction.on_commit(lambda: bump_cache_version(PERMISSION_CACHE_VERSION, MENU_CACHE_VERSION,
+                                                           FIELD_PERMISSION_CACHE_VERSION))
+    return changed
 
 
 class RoleMenuButtonPermissionViewSet(CustomModelViewSet):
@@ -188,10 +274,9 @@ class RoleMenuButtonPermissionViewSet(CustomModelViewSet):
             queryset = Menu.objects.filter(status=1, is_catalog=True).values('name', 'id').all()
         else:
             role_id = request.user.role.values_list('id', flat=True)
-            menu_list = RoleMenuPermission.objects.filter(role__in=role_id).values_list('id', flat=True)
+            menu_list = RoleMenuPermission.objects.filter(role__in=role_id).values_list('menu_id', flat=True)
             queryset = Menu.objects.filter(status=1, is_catalog=True, id__in=menu_list).values('name', 'id').all()
-        serializer = RoleMenuSerializer(queryset, many=True, request=request)
-        data = serializer.data
+        data = get_role_permission_matrix(role, queryset)
         return DetailResponse(data=data)
         # data = []
         # if is_superuser:
@@ -235,30 +320,7 @@ class RoleMenuButtonPermissionViewSet(CustomModelViewSet):
         :return:
         """
         body = request.data
-        RoleMenuPermission.objects.filter(role=pk).delete()
-        RoleMenuButtonPermission.objects.filter(role=pk).delete()
-        for item in body:
-            for menu in item["menus"]:
-                if menu.get('isCheck'):
-                    menu_parent = Menu.get_all_parent(menu.get('id'))
-                    role_menu_permission_list = []
-                    for d in menu_parent:
-                        role_menu_permission_list.append(RoleMenuPermission(role_id=pk, menu_id=d["id"]))
-                    RoleMenuPermission.objects.bulk_create(role_menu_permission_list)
-                    # RoleMenuPermission.objects.create(role_id=pk, menu_id=menu.get('id'))
-                for btn in menu.get('btns'):
-                    if btn.get('isCheck'):
-                        data_range = btn.get('data_range', 0) or 0
-                        instance = RoleMenuButtonPermission.objects.create(role_id=pk, menu_button_id=btn.get('id'),
-                                                                           data_range=data_range)
-                        instance.dept.set(btn.get('dept', []))
-                for col in menu.get('columns'):
-                    FieldPermission.objects.update_or_create(role_id=pk, field_id=col.get('id'),
-                                                             defaults={
-                                                                 'is_query': col.get('is_query'),
-                                                                 'is_create': col.get('is_create'),
-                                                                 'is_update': col.get('is_update')
-                                                             })
+        save_role_permission_matrix(pk, body)
         return DetailResponse(msg="授权成功")
 
     @action(methods=['GET'], detail=False, permission_classes=[IsAuthenticated])
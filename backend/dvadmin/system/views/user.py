@@ -10,6 +10,7 @@ from django.db.models import Q
 from application import dispatch
 from dvadmin.system.models import Users, Role, Dept
 from dvadmin.system.views.role import RoleSerializer
+from dvadmin.utils.filters import get_dept_name_paths
 from dvadmin.utils.json_response import ErrorResponse, DetailResponse, SuccessResponse
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.validator import CustomUniqueValidator
@@ -35,6 +36,9 @@ class UserSerializer(CustomModelSerializer):
     dept_name = serializers.CharField(source='dept.name', read_only=True)
     role_info = DynamicSerializerMethodField()
     dept_name_all = serializers.SerializerMethodField()
+    # 列表自动预加载: 角色, 部门完整名称使用缓存的部门路径
+    related_fields = {"role_info": ["role"], "dept_name_all": []}
+    method_field_sources = {"role_info": [], "dept_name_all": ["dept"]}
 
     class Meta:
         model = Users
@@ -46,9 +50,11 @@ class UserSerializer(CustomModelSerializer):
         }
 
     def get_dept_name_all(self, instance):
-        dept_name_all = recursion(instance.dept, "parent", "name")
-        dept_name_all.reverse()
-        return "/".join(dept_name_all)
+        if instance.dept_id is None:
+            return ""
+        if "dept_name_paths" not in self.context:
+            self.context["dept_name_paths"] = get_dept_name_paths()
+        return self.context["dept_name_paths"].get(instance.dept_id, "")
 
     def get_role_info(self, instance, parsed_query):
         roles = instance.role.all()
@@ -248,6 +254,9 @@ class UserViewSet(CustomModelViewSet):
         "dept_owner": "部门负责人",
     }
     export_serializer_class = ExportUserProfileSerializer
+    export_streaming = True
+    export_select_related = ["dept"]
+    async_job_enabled = True
     # 导入
     import_serializer_class = UserProfileImportSerializer
     import_field_dict = {
@@ -382,16 +391,8 @@ class UserViewSet(CustomModelViewSet):
         if not show_all:
             show_all = 0
         if int(show_all):
-            all_did = [dept_id]
-            def inner(did):
-                sub = Dept.objects.filter(parent_id=did)
-                if not sub.exists():
-                    return
-                for i in sub:
-                    all_did.append(i.pk)
-                    inner(i)
             if dept_id != '':
-                inner(dept_id)
+                dept_path = Dept.get_dept_path(dept_id)
                 searchs = [
                     Q(**{f+'__icontains':i})
                     for f in self.search_fields
@@ -402,7 +403,10 @@ class UserViewSet(CustomModelViewSet):
                     for i in searchs[1:]:
                         q |= i
                     q_obj.append(Q(q))
-                queryset = Users.objects.filter(*q_obj, dept_id__in=all_did)
+                if dept_path:
+                    queryset = Users.objects.filter(*q_obj, dept__path__startswith=dept_path)
+                else:
+                    queryset = Users.objects.none()
             else:
                 queryset = self.filter_queryset(self.get_queryset())
         else:
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 缓存版本号工具
+通过共享缓存(settings.CACHES)中的版本号实现多进程/多节点的缓存失效:
+数据变化时递增版本号, 各进程发现版本号变化后丢弃本地缓存
+"""
+import time
+
+from django.core.cache import cache
+from django.db import connection
+
+CACHE_VERSION_PREFIX = "dvadmin:version:"
+
+
+def get_schema_name():
+    """
+    当前租户的 schema 名称, 非多租户模式时为空字符串
+    """
+    return getattr(getattr(connection, "tenant", None), "schema_name", None) or ""
+
+
+def _version_key(name):
+    schema_name = get_schema_name()
+    if schema_name:
+        return f"{CACHE_VERSION_PREFIX}{schema_name}:{name}"
+    return f"{CACHE_VERSION_PREFIX}{name}"
+
+
+def _initial_version():
+    # 以毫秒时间戳作为初始值, 避免缓存被清空后版本号回退导致旧数据重新生效
+    return int(time.time() * 1000)
+
+
+def get_cache_version(*names):
+    """
+    获取缓存命名空间的版本号
+    :param names: 命名空间名称, 可传多个
+    :return: 版本号字符串, 多个命名空间时用"."拼接
+    """
+    keys = [_version_key(name) for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if values.get(key) is None:
+            cache.add(key, _initial_version(), timeout=None)
+            values[key] = cache.get(key)
+    return ".".join(str(values[key]) for key in keys)
+
+
+def bump_cache_version(*names):
+    """
+    递增缓存命名空间的版本号, 使对应缓存全部失效
+    :param names: 命名空间名称, 可传多个
+    :return:
+    """
+    for name in names:
+        key = _version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), timeout=None)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 分页总数统计方式, 视图集通过 count_strategy 选择
+(1)exact: 精确统计(默认)
+(2)estimate: 无筛选条件时使用数据库统计信息估算(PostgreSQL pg_class.reltuples / MySQL information_schema),
+   估算值小于 PAGINATION_COUNT_ESTIMATE_THRESHOLD 或数据库不支持时精确统计
+(3)cached: 精确统计结果按(模型, 查询条件, 数据版本号)缓存 PAGINATION_COUNT_CACHE_TIMEOUT 秒
+(4)auto: 无筛选条件时同 estimate, 有筛选条件时同 cached
+数据版本号在模型 post_save/post_delete 时递增(只为使用 cached/auto 的模型连接信号);
+bulk_create 等批量写入不触发信号, 需调用 refresh_count_version, 否则由缓存过期时间兜底
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models.signals import post_save, post_delete
+
+from dvadmin.utils.cache import get_cache_version, bump_cache_version
+
+COUNT_CACHE_PREFIX = "dvadmin:count:"
+COUNT_STRATEGIES = ("exact", "estimate", "cached", "auto")
+
+# 使用 cached/auto 统计方式的模型, 数据变化时递增版本号
+counted_models = set()
+
+
+def get_count_version_name(model):
+    return f"count:{model._meta.label_lower}"
+
+
+def register_counted_model(model):
+    label = model._meta.label_lower
+    if label in counted_models:
+        return
+    counted_models.add(label)
+    post_save.connect(refresh_count_cache, sender=model, dispatch_uid=f"{COUNT_CACHE_PREFIX}{label}")
+    post_delete.connect(refresh_count_cache, sender=model, dispatch_uid=f"{COUNT_CACHE_PREFIX}{label}")
+
+
+def refresh_count_version(model):
+    """
+    模型数据变化, 使缓存的总数失效
+    """
+    if model._meta.label_lower in counted_models:
+        bump_cache_version(get_count_version_name(model))
+
+
+def refresh_count_cache(sender, **kwargs):
+    """
+    post_save/post_delete 信号处理
+    """
+    refresh_count_version(sender)
+
+
+def is_filtered(queryset):
+    return bool(queryset.query.where) or queryset.query.distinct or bool(queryset.query.group_by)
+
+
+def estimate_count(queryset):
+    """
+    数据库统计信息中的表行数估算值, 不支持时返回 None
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)"
+    elif connection.vendor == "mysql":
+        sql = "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    if not row or row[0] is None or row[0] < 0:
+        # PostgreSQL 未 analyze 的表为 -1
+        return None
+    return int(row[0])
+
+
+def cached_count(queryset):
+    """
+    缓存的精确总数, 缓存按数据版本号失效, 命中与否都视为精确总数
+    :return: (总数, 是否精确)
+    """
+    queryset = queryset.order_by()
+    sql, params = queryset.query.sql_with_params()
+    schema_name = getattr(getattr(connections[queryset.db], "tenant", None), "schema_name", None) or ""
+    version = get_cache_version(get_count_version_name(queryset.model))
+    digest = hashlib.md5(f"{schema_name}|{sql}|{params!r}".encode()).hexdigest()
+    key = f"{COUNT_CACHE_PREFIX}{queryset.model._meta.label_lower}:{version}:{digest}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout=getattr(settings, "PAGINATION_COUNT_CACHE_TIMEOUT", 60))
+    return count, True
+
+
+def get_count(queryset, strategy="exact"):
+    """
+    统计查询集总数
+    :param queryset:
+    :param strategy: 统计方式, 见 COUNT_STRATEGIES
+    :return: (总数, 是否精确)
+    """
+    if strategy in ("estimate", "auto") and not is_filtered(queryset):
+        estimate = estimate_count(queryset)
+        if estimate is not None and estimate >= getattr(settings, "PAGINATION_COUNT_ESTIMATE_THRESHOLD", 100000):
+            return estimate, False
+        return queryset.count(), True
+    if strategy in ("cached", "auto"):
+        return cached_count(queryset)
+    return queryset.count(), True
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 根据序列化器字段自动生成 select_related/prefetch_related, 避免序列化时逐行查询关联数据
+(1)source 带"."的字段(如 dept.name)、SlugRelatedField 等关联字段、多对多主键列表、嵌套序列化器按 source 推导
+(2)SerializerMethodField 等无法推导的字段, 在序列化器上用 related_fields 指定, 例如:
+   related_fields = {"role_info": ["role"], "dept_name_all": []}
+   指定后该字段不再自动推导
+(3)请求带 django-restql 的 query 参数时只处理查询的字段
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.relations import ManyRelatedField, RelatedField, PrimaryKeyRelatedField
+from rest_framework.serializers import BaseSerializer
+
+
+def get_restql_fields(request):
+    """
+    django-restql query 参数中查询的顶层字段
+    :return: 字段名集合, 未指定或包含"*"时返回 None(全部字段)
+    """
+    param_name = getattr(settings, "RESTQL", {}).get("QUERY_PARAM_NAME", "query")
+    raw_query = request.query_params.get(param_name) if request is not None else None
+    if not raw_query:
+        return None
+    try:
+        from django_restql.parser import QueryParser
+
+        parsed = QueryParser().parse(raw_query)
+        included = {
+            item if isinstance(item, str) else getattr(item, "field_name", None) for item in parsed.included_fields
+        }
+        if "*" in included:
+            return None
+        return included - set(parsed.excluded_fields or [])
+    except Exception:
+        # 解析失败时由 restql 在序列化时报错, 这里按全部字段处理
+        return None
+
+
+def get_relation_type(model, path):
+    """
+    关联路径的加载方式
+    :return: "select"(全部为正向外键/一对一)、"prefetch" 或 None(不是关联路径)
+    """
+    relation = "select"
+    for name in path.split("__"):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not field.is_relation or field.related_model is None:
+            return None
+        if field.many_to_many or field.one_to_many:
+            relation = "prefetch"
+        model = field.related_model
+    return relation
+
+
+def get_field_paths(field):
+    """
+    序列化字段需要的关联路径
+    """
+    if field.write_only or field.source == "*":
+        return []
+    source = field.source.replace(".", "__")
+    if isinstance(field, ManyRelatedField) or isinstance(field, BaseSerializer):
+        return [source]
+    if isinstance(field, RelatedField):
+        # 主键字段直接使用外键值, 不需要加载关联对象
+        if isinstance(field, PrimaryKeyRelatedField):
+            return []
+        return [source]
+    if "__" in source:
+        return [source.rsplit("__", 1)[0]]
+    return []
+
+
+def get_eager_loading(serializer, model, request=None):
+    """
+    :param serializer: 序列化器实例(many=True 时为 ListSerializer)
+    :param model: 查询集的模型
+    :param request:
+    :return: (select_related 列表, prefetch_related 列表)
+    """
+    serializer = getattr(serializer, "child", serializer)
+    related_fields = getattr(serializer, "related_fields", None) or {}
+    restql_fields = get_restql_fields(request)
+    paths = []
+    for name, field in serializer.fields.items():
+        if restql_fields is not None and name not in restql_fields:
+            continue
+        if name in related_fields:
+            paths.extend(related_fields[name])
+        else:
+            paths.extend(get_field_paths(field))
+    select_related, prefetch_related = [], []
+    for path in dict.fromkeys(paths):
+        relation = get_relation_type(model, path)
+        if relation == "select":
+            select_related.append(path)
+        elif relation == "prefetch":
+            prefetch_related.append(path)
+    return select_related, prefetch_related
+
+
+def apply_eager_loading(queryset, serializer, request=None):
+    """
+    为查询集加上推导出的 select_related/prefetch_related
+    已有的 Prefetch 在前, 同名的字符串预加载会被 django 跳过, 不会覆盖自定义的查询集
+    """
+    select_related, prefetch_related = get_eager_loading(serializer, queryset.model, request)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
@@ -1,11 +1,97 @@
 # -*- coding: utf-8 -*-
+from django.core.cache import cache
 from django.db.models import F
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
 from dvadmin.system.models import FieldPermission, MenuField
+from dvadmin.utils.cache import get_cache_version
 from dvadmin.utils.json_response import DetailResponse
-from dvadmin.utils.models import get_custom_app_models
+from dvadmin.utils.models import get_model_registry
+from dvadmin.utils.permission import permission_index
+
+# 列权限字段缓存的版本号命名空间, MenuField 变化时递增
+MENU_FIELD_CACHE_VERSION = "menu_field"
+MENU_FIELD_CACHE_PREFIX = "dvadmin:menu_field:"
+# 角色列权限缓存的版本号命名空间, FieldPermission 变化时递增
+FIELD_PERMISSION_CACHE_VERSION = "field_permission"
+FIELD_PERMISSION_CACHE_PREFIX = "dvadmin:field_permission:"
+FIELD_PERMISSION_ACTIONS = ("query", "create", "update")
+# 不受列权限控制的字段, 与前端 columnPermission.ts 一致
+FIELD_PERMISSION_EXEMPT = ("id", "create_datetime", "update_datetime")
+
+
+def get_menu_fields(model_name):
+    """
+    获取模型配置的列权限字段, 按版本号缓存
+    :param model_name: 模型名
+    :return: [{field_name, title}]
+    """
+    key = f"{MENU_FIELD_CACHE_PREFIX}{get_cache_version(MENU_FIELD_CACHE_VERSION)}:{model_name}"
+    data = cache.get(key)
+    if data is None:
+        data = list(MenuField.objects.filter(model=model_name).values('field_name', 'title'))
+        cache.set(key, data, timeout=None)
+    return data
+
+
+def get_role_field_permissions(role_ids, model_name):
+    """
+    获取角色集合对模型的列权限, 按(角色集合, 模型)缓存
+    同一列有多个角色授权时, 任一角色允许即允许; 与前端一致, 配置了列权限但没有授权记录的列禁止
+    :param role_ids: 角色id集合
+    :param model_name: 模型名
+    :return: {"rows": 授权记录, "forbidden": {"query"|"create"|"update": 禁止的字段名列表}}
+    """
+    role_key = ",".join(str(role_id) for role_id in sorted(role_ids))
+    version = get_cache_version(MENU_FIELD_CACHE_VERSION, FIELD_PERMISSION_CACHE_VERSION)
+    key = f"{FIELD_PERMISSION_CACHE_PREFIX}{version}:{model_name}:{role_key}"
+    data = cache.get(key)
+    if data is None:
+        rows = list(FieldPermission.objects.filter(field__model=model_name, role__in=role_ids).values(
+            'is_create', 'is_query', 'is_update', field_name=F('field__field_name')))
+        allowed = {
+            item['field_name']: dict.fromkeys(FIELD_PERMISSION_ACTIONS, False)
+            for item in get_menu_fields(model_name) if item['field_name'] not in FIELD_PERMISSION_EXEMPT
+        }
+        for row in rows:
+            item = allowed.get(row['field_name'])
+            if item is None:
+                continue
+            for name in FIELD_PERMISSION_ACTIONS:
+                item[name] = item[name] or bool(row[f'is_{name}'])
+        data = {
+            "rows": rows,
+            "forbidden": {
+                name: sorted(field_name for field_name, item in allowed.items() if not item[name])
+                for name in FIELD_PERMISSION_ACTIONS
+            },
+        }
+        cache.set(key, data, timeout=None)
+    return data
+
+
+def get_forbidden_fields(request, model):
+    """
+    获取当前用户对模型禁止的字段, 结果在同一请求内复用
+    :param request:
+    :param model: 模型类
+    :return: {"query"|"create"|"update": frozenset(字段名)}, 超级管理员或未配置列权限的模型返回 None
+    """
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated or user.is_superuser:
+        return None
+    cached = getattr(request, "_forbidden_fields", None)
+    if cached is None:
+        cached = request._forbidden_fields = {}
+    if model not in cached:
+        forbidden = None
+        model_meta = get_model_registry().get_by_model(model)
+        if model_meta is not None and get_menu_fields(model_meta['model']):
+            data = get_role_field_permissions(permission_index.get_role_ids(user), model_meta['model'])
+            forbidden = {name: frozenset(fields) for name, fields in data["forbidden"].items()}
+        cached[model] = forbidden
+    return cached[model]
 
 
 class FieldPermissionMixin:
@@ -14,25 +100,14 @@ class FieldPermissionMixin:
         """
         获取字段权限
         """
-        finded = False
-        for model in get_custom_app_models():
-            if model['object'] is self.serializer_class.Meta.model:
-                finded = True
-                break
-            if finded:
-                break
-        if finded is False:
+        model = get_model_registry().get_by_model(self.serializer_class.Meta.model)
+        if model is None:
             return []
         user = request.user
         if user.is_superuser==1:
-            data = MenuField.objects.filter( model=model['model']).values('field_name')
-            for item in data:
-                item['is_create'] = True
-                item['is_query'] = True
-                item['is_update'] = True
+            data = [{'field_name': item['field_name'], 'is_create': True, 'is_query': True, 'is_update': True}
+                    for item in get_menu_fields(model['model'])]
         else:
-            roles = request.user.role.values_list('id', flat=True)
-            data= FieldPermission.objects.filter(
-                 field__model=model['model'],role__in=roles
-            ).values( 'is_create', 'is_query', 'is_update',field_name=F('field__field_name'))
+            roles = permission_index.get_role_ids(request.user)
+            data = get_role_field_permissions(roles, model['model'])['rows']
         return DetailResponse(data=data)
\ No newline at end of file
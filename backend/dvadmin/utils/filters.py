@@ -6,24 +6,37 @@
 @Created on: 2021/6/6 006 12:39
 @Remark: 自定义过滤器
 """
+import hashlib
+import logging
 import operator
 import re
 from collections import OrderedDict
 from functools import reduce
 
 import six
+from django.core.cache import cache
 from django.db import models
 from django.db.models import Q, F
 from django.db.models.constants import LOOKUP_SEP
+from django.urls import URLResolver
 from django_filters import utils, FilterSet
 from django_filters.constants import ALL_FIELDS
 from django_filters.filters import CharFilter, DateTimeFromToRangeFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from django_filters.utils import get_model_field
 from rest_framework.filters import BaseFilterBackend
+from timezone_field import TimeZoneField
 from django_filters.conf import settings
 from dvadmin.system.models import Dept, ApiWhiteList, RoleMenuButtonPermission
+from dvadmin.utils.cache import get_cache_version, get_schema_name
 from dvadmin.utils.models import CoreModel
+from dvadmin.utils.permission import PERMISSION_CACHE_VERSION
+
+logger = logging.getLogger(__name__)
+
+# 部门缓存的版本号命名空间
+DEPT_CACHE_VERSION = "dept"
+
 
 class CoreModelFilterBankend(BaseFilterBackend):
     """
@@ -58,21 +71,76 @@ class CoreModelFilterBankend(BaseFilterBackend):
 
 def get_dept(dept_id: int, dept_all_list=None, dept_list=None):
     """
-    递归获取部门的所有下级部门
+    获取部门的所有下级部门(包含自身)
     :param dept_id: 需要获取的部门id
-    :param dept_all_list: 所有部门列表
-    :param dept_list: 递归部门list
+    :param dept_all_list: 已弃用,保留兼容
+    :param dept_list: 已弃用,保留兼容
     :return:
     """
-    if not dept_all_list:
-        dept_all_list = Dept.objects.all().values("id", "parent")
-    if dept_list is None:
-        dept_list = [dept_id]
-    for ele in dept_all_list:
-        if ele.get("parent") == dept_id:
-            dept_list.append(ele.get("id"))
-            get_dept(ele.get("id"), dept_all_list, dept_list)
-    return list(set(dept_list))
+    return Dept.get_sub_dept_ids(dept_id)
+
+
+def get_dept_name_paths():
+    """
+    全部部门的完整名称路径, 如 {3: "总公司/研发部/前端组"}, 按部门版本号缓存
+    :return: dict
+    """
+    schema_name = get_schema_name()
+    cache_key = f"dvadmin:dept_name_paths:{schema_name}:{get_cache_version(DEPT_CACHE_VERSION)}"
+    name_paths = cache.get(cache_key)
+    if name_paths is not None:
+        return name_paths
+    depts = {dept_id: (name, parent_id) for dept_id, name, parent_id in Dept.objects.values_list("id", "name", "parent_id")}
+    name_paths = {}
+    for dept_id in depts:
+        names = []
+        node = dept_id
+        visited = set()
+        # visited 防止上级部门数据成环时死循环
+        while node in depts and node not in visited:
+            visited.add(node)
+            name, node = depts[node]
+            if name:
+                names.append(name)
+        name_paths[dept_id] = "/".join(reversed(names))
+    cache.set(cache_key, name_paths, timeout=60 * 60 * 24)
+    return name_paths
+
+
+class DataScope:
+    """
+    数据权限范围解析结果,可序列化后存入共享缓存
+    mode: all(全部数据) / none(无数据) / self(仅本人数据) / dept(指定部门数据)
+    dept_ids: mode为dept时可查看的部门id
+    """
+    ALL = "all"
+    NONE = "none"
+    SELF = "self"
+    DEPT = "dept"
+
+    def __init__(self, mode, dept_ids=()):
+        self.mode = mode
+        self.dept_ids = frozenset(dept_ids)
+
+    def apply(self, queryset, user):
+        """
+        按数据权限范围过滤queryset
+        :param queryset:
+        :param user: 当前用户
+        :return:
+        """
+        if self.mode == self.ALL:
+            return queryset
+        if self.mode == self.NONE:
+            return queryset.none()
+        # 判断过滤的数据是否有创建人所在部门 "dept_belong_id" 字段
+        if not getattr(queryset.model, "dept_belong_id", None):
+            return queryset
+        if self.mode == self.SELF:
+            return queryset.filter(creator=user, dept_belong_id=getattr(user, "dept_id", None))
+        if queryset.model._meta.model_name == 'dept':
+            return queryset.filter(id__in=list(self.dept_ids))
+        return queryset.filter(dept_belong_id__in=list(self.dept_ids))
 
 
 class DataLevelPermissionsFilter(BaseFilterBackend):
@@ -86,16 +154,65 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
 
     4. 只为仅本人数据权限时只返回过滤本人数据，并且部门为自己本部门(考虑到用户会变部门，只能看当前用户所在的部门数据)
     5. 自定数据权限 获取部门，根据部门过滤
+
+    解析出的数据权限范围按 (用户, 用户部门, 接口, 请求方法) 缓存在共享缓存中,
+    角色、权限、接口白名单、部门变化时通过版本号失效
     """
+    cache_timeout = 60 * 60
+    # 进程内缓存的数据权限接口白名单: (版本号, 合并正则)
+    # {schema: (版本号, 正则)}
+    _white_list_matchers = {}
 
     def filter_queryset(self, request, queryset, view):
+        return self.get_data_scope(request).apply(queryset, request.user)
+
+    def get_data_scope(self, request):
         """
-        接口白名单是否认证数据权限
+        获取当前请求的数据权限范围
+        :param request:
+        :return: DataScope
         """
         api = request.path  # 当前请求接口
         method = request.method  # 当前请求方法
         methodList = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
         method = methodList.index(method)
+        version = get_cache_version(PERMISSION_CACHE_VERSION, DEPT_CACHE_VERSION)
+        """
+        接口白名单是否认证数据权限
+        """
+        matcher = self.get_white_list_matcher(version)
+        if matcher is not None and matcher.match(f"{api}:{method}"):
+            return DataScope(DataScope.ALL)
+        """
+        判断是否为超级管理员:
+        如果不是超级管理员,则进入下一步权限判断
+        """
+        if request.user.is_superuser != 0:
+            return DataScope(DataScope.ALL)
+        re_api = api
+        _pk = request.parser_context["kwargs"].get('pk')
+        if _pk:  # 判断是否是单例查询
+            re_api = re.sub(_pk, '{id}', api)
+        user = request.user
+        api_hash = hashlib.md5(re_api.encode("utf-8")).hexdigest()
+        cache_key = f"dvadmin:data_scope:{get_schema_name()}:{version}:{user.id}:{getattr(user, 'dept_id', None)}:{api_hash}:{method}"
+        data_scope = cache.get(cache_key)
+        if data_scope is None:
+            data_scope = self._resolve_role_data_scope(request, re_api, method)
+            cache.set(cache_key, data_scope, self.cache_timeout)
+        return data_scope
+
+    @classmethod
+    def get_white_list_matcher(cls, version):
+        """
+        获取不认证数据权限的接口白名单合并正则
+        :param version: 缓存版本号
+        :return: 编译后的正则, 无白名单时为None
+        """
+        schema_name = get_schema_name()
+        matcher_version, matcher = cls._white_list_matchers.get(schema_name, (None, None))
+        if matcher_version == version:
+            return matcher
         # ***接口白名单***
         api_white_list = ApiWhiteList.objects.filter(enable_datasource=False).values(
             permission__api=F("url"), permission__method=F("method")
@@ -107,36 +224,26 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
             for item in api_white_list
             if item.get("permission__api")
         ]
+        patterns = []
         for item in api_white_list:
-            new_api = f"{api}:{method}"
-            matchObj = re.match(item, new_api, re.M | re.I)
-            if matchObj is None:
+            try:
+                re.compile(item)
+            except re.error:
                 continue
-            else:
-                return queryset
-        """
-        判断是否为超级管理员:
-        如果不是超级管理员,则进入下一步权限判断
-        """
-        if request.user.is_superuser == 0:
-            return self._extracted_from_filter_queryset_33(request, queryset, api, method)
-        else:
-            return queryset
+            patterns.append(f"(?:{item})")
+        matcher = re.compile("|".join(patterns), re.M | re.I) if patterns else None
+        cls._white_list_matchers[schema_name] = (version, matcher)
+        return matcher
 
-    # TODO Rename this here and in `filter_queryset`
-    def _extracted_from_filter_queryset_33(self, request, queryset, api, method):
+    def _resolve_role_data_scope(self, request, re_api, method):
         # 0. 获取用户的部门id，没有部门则返回空
         user_dept_id = getattr(request.user, "dept_id", None)
         if not user_dept_id:
-            return queryset.none()
-
-        # 1. 判断过滤的数据是否有创建人所在部门 "dept_belong_id" 字段
-        if not getattr(queryset.model, "dept_belong_id", None):
-            return queryset
+            return DataScope(DataScope.NONE)
 
         # 2. 如果用户没有关联角色则返回本部门数据
         if not hasattr(request.user, "role"):
-            return queryset.filter(dept_belong_id=user_dept_id)
+            return DataScope(DataScope.DEPT, [user_dept_id])
 
         # 3. 根据所有角色 获取所有权限范围
         # (0, "仅本人数据权限"),
@@ -144,12 +251,8 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
         # (2, "本部门数据权限"),
         # (3, "全部数据权限"),
         # (4, "自定数据权限")
-        re_api = api
-        _pk = request.parser_context["kwargs"].get('pk')
-        if _pk: # 判断是否是单例查询
-            re_api = re.sub(_pk,'{id}', api)
         role_id_list = request.user.role.values_list('id', flat=True)
-        role_permission_list=RoleMenuButtonPermission.objects.filter(
+        role_permission_list = RoleMenuButtonPermission.objects.filter(
             role__in=role_id_list,
             role__status=1,
             menu_button__api=re_api,
@@ -158,17 +261,15 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
         )
         dataScope_list = []  # 权限范围列表
         for ele in role_permission_list:
-                # 判断用户是否为超级管理员角色/如果拥有[全部数据权限]则返回所有数据
+            # 判断用户是否为超级管理员角色/如果拥有[全部数据权限]则返回所有数据
             if ele.get("data_range") == 3:
-                return queryset
+                return DataScope(DataScope.ALL)
             dataScope_list.append(ele.get("data_range"))
         dataScope_list = list(set(dataScope_list))
 
         # 4. 只为仅本人数据权限时只返回过滤本人数据，并且部门为自己本部门(考虑到用户会变部门，只能看当前用户所在的部门数据)
         if 0 in dataScope_list:
-            return queryset.filter(
-                creator=request.user, dept_belong_id=user_dept_id
-            )
+            return DataScope(DataScope.SELF)
 
         # 5. 自定数据权限 获取部门，根据部门过滤
         dept_list = []
@@ -187,14 +288,29 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
                     role__in=role_id_list,
                     role__status=1,
                     data_range=4).values_list(
-                    'dept__id',flat=True
+                    'dept__id', flat=True
                 )
                 dept_list.extend(
                     dept_ids
                 )
-        if queryset.model._meta.model_name == 'dept':
-            return queryset.filter(id__in=list(set(dept_list)))
-        return queryset.filter(dept_belong_id__in=list(set(dept_list)))
+        return DataScope(DataScope.DEPT, [dept_id for dept_id in dept_list if dept_id is not None])
+
+
+# 生成的 AutoFilterSet 类: {(视图集, 模型, filter_fields): AutoFilterSet}
+_filterset_classes = {}
+# 查询参数到 orm 查询条件的映射: {(AutoFilterSet, filter_fields): {参数名: orm 查询条件}}
+_filter_lookups = {}
+
+
+def _freeze(value):
+    """
+    filter_fields 转为可哈希的缓存键
+    """
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
 
 
 class CustomDjangoFilterBackend(DjangoFilterBackend):
@@ -219,15 +335,6 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
             return LOOKUP_SEP.join([field_name, lookup])
         return field_name
 
-    def find_filter_lookups(self, orm_lookups, search_term_key):
-        for lookup in orm_lookups:
-            # if lookup.find(search_term_key) >= 0:
-            new_lookup = LOOKUP_SEP.join(lookup.split(LOOKUP_SEP)[:-1]) if len(lookup.split(LOOKUP_SEP)) > 1 else lookup
-            # 修复条件搜索错误 bug
-            if new_lookup == search_term_key:
-                return lookup
-        return None
-
     def get_filterset_class(self, view, queryset=None):
         """
         Return the `FilterSet` class used to filter the queryset.
@@ -270,127 +377,137 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
             return filterset_class
 
         if filterset_fields and queryset is not None:
-            MetaBase = getattr(self.filterset_base, "Meta", object)
-
-            class AutoFilterSet(self.filterset_base):
-                @classmethod
-                def get_all_model_fields(cls, model):
-                    opts = model._meta
-
-                    return [
-                        f.name
-                        for f in sorted(opts.fields + opts.many_to_many)
-                        if (f.name == "id")
-                        or not isinstance(f, models.AutoField)
-                        and not (getattr(f.remote_field, "parent_link", False))
-                    ]
-
-                @classmethod
-                def get_fields(cls):
-                    """
-                    Resolve the 'fields' argument that should be used for generating filters on the
-                    filterset. This is 'Meta.fields' sans the fields in 'Meta.exclude'.
-                    """
-                    model = cls._meta.model
-                    fields = cls._meta.fields
-                    exclude = cls._meta.exclude
-
-                    assert not (fields is None and exclude is None), (
-                        "Setting 'Meta.model' without either 'Meta.fields' or 'Meta.exclude' "
-                        "has been deprecated since 0.15.0 and is now disallowed. Add an explicit "
-                        "'Meta.fields' or 'Meta.exclude' to the %s class." % cls.__name__
-                    )
+            key = (view if isinstance(view, type) else type(view), queryset.model, _freeze(filterset_fields))
+            filterset_class = _filterset_classes.get(key)
+            if filterset_class is None:
+                filterset_class = self.build_filterset_class(queryset.model, filterset_fields)
+                _filterset_classes[key] = filterset_class
+            return filterset_class
+
+        return None
+
+    def build_filterset_class(self, filterset_model, filterset_fields):
+        """
+        生成模型的 AutoFilterSet, 按(视图集, 模型, filter_fields)缓存, 不需要每次请求重新生成
+        """
+        MetaBase = getattr(self.filterset_base, "Meta", object)
+
+        class AutoFilterSet(self.filterset_base):
+            @classmethod
+            def get_all_model_fields(cls, model):
+                opts = model._meta
+
+                return [
+                    f.name
+                    for f in sorted(opts.fields + opts.many_to_many)
+                    if (f.name == "id")
+                    or not isinstance(f, models.AutoField)
+                    and not (getattr(f.remote_field, "parent_link", False))
+                ]
+
+            @classmethod
+            def get_fields(cls):
+                """
+                Resolve the 'fields' argument that should be used for generating filters on the
+                filterset. This is 'Meta.fields' sans the fields in 'Meta.exclude'.
+                """
+                model = cls._meta.model
+                fields = cls._meta.fields
+                exclude = cls._meta.exclude
+
+                assert not (fields is None and exclude is None), (
+                    "Setting 'Meta.model' without either 'Meta.fields' or 'Meta.exclude' "
+                    "has been deprecated since 0.15.0 and is now disallowed. Add an explicit "
+                    "'Meta.fields' or 'Meta.exclude' to the %s class." % cls.__name__
+                )
 
-                    # Setting exclude with no fields implies all other fields.
-                    if exclude is not None and fields is None:
-                        fields = ALL_FIELDS
-
-                    # Resolve ALL_FIELDS into all fields for the filterset's model.
-                    if fields == ALL_FIELDS:
-                        fields = cls.get_all_model_fields(model)
-
-                    # Remove excluded fields
-                    exclude = exclude or []
-                    if not isinstance(fields, dict):
-                        fields = [(f, [settings.DEFAULT_LOOKUP_EXPR]) for f in fields if f not in exclude]
-                    else:
-                        fields = [(f, lookups) for f, lookups in fields.items() if f not in exclude]
-
-                    return OrderedDict(fields)
-
-                @classmethod
-                def get_filters(cls):
-                    """
-                    Get all filters for the filterset. This is the combination of declared and
-                    generated filters.
-                    """
-
-                    # No model specified - skip filter generation
-                    if not cls._meta.model:
-                        return cls.declared_filters.copy()
-
-                    # Determine the filters that should be included on the filterset.
-                    filters = OrderedDict()
-                    fields = cls.get_fields()
-                    undefined = []
-
-                    for field_name, lookups in fields.items():
-                        field = get_model_field(cls._meta.model, field_name)
-                        from django.db import models
-                        from timezone_field import TimeZoneField
-
-                        # 不进行 过滤的model 类
-                        if isinstance(field, (models.JSONField, TimeZoneField)):
+                # Setting exclude with no fields implies all other fields.
+                if exclude is not None and fields is None:
+                    fields = ALL_FIELDS
+
+                # Resolve ALL_FIELDS into all fields for the filterset's model.
+                if fields == ALL_FIELDS:
+                    fields = cls.get_all_model_fields(model)
+
+                # Remove excluded fields
+                exclude = exclude or []
+                if not isinstance(fields, dict):
+                    fields = [(f, [settings.DEFAULT_LOOKUP_EXPR]) for f in fields if f not in exclude]
+                else:
+                    fields = [(f, lookups) for f, lookups in fields.items() if f not in exclude]
+
+                return OrderedDict(fields)
+
+            @classmethod
+            def get_filters(cls):
+                """
+                Get all filters for the filterset. This is the combination of declared and
+                generated filters.
+                """
+
+                # No model specified - skip filter generation
+                if not cls._meta.model:
+                    return cls.declared_filters.copy()
+
+                # Determine the filters that should be included on the filterset.
+                filters = OrderedDict()
+                fields = cls.get_fields()
+                undefined = []
+
+                for field_name, lookups in fields.items():
+                    field = get_model_field(cls._meta.model, field_name)
+
+                    # 不进行 过滤的model 类
+                    if isinstance(field, (models.JSONField, TimeZoneField)):
+                        continue
+                    # warn if the field doesn't exist.
+                    if field is None:
+                        undefined.append(field_name)
+                    # 更新默认字符串搜索为模糊搜索
+                    if (
+                        isinstance(field, (models.CharField))
+                        and filterset_fields == "__all__"
+                        and lookups == ["exact"]
+                    ):
+                        lookups = ["icontains"]
+                    for lookup_expr in lookups:
+                        filter_name = cls.get_filter_name(field_name, lookup_expr)
+
+                        # If the filter is explicitly declared on the class, skip generation
+                        if filter_name in cls.declared_filters:
+                            filters[filter_name] = cls.declared_filters[filter_name]
                             continue
-                        # warn if the field doesn't exist.
-                        if field is None:
-                            undefined.append(field_name)
-                        # 更新默认字符串搜索为模糊搜索
-                        if (
-                            isinstance(field, (models.CharField))
-                            and filterset_fields == "__all__"
-                            and lookups == ["exact"]
-                        ):
-                            lookups = ["icontains"]
-                        for lookup_expr in lookups:
-                            filter_name = cls.get_filter_name(field_name, lookup_expr)
-
-                            # If the filter is explicitly declared on the class, skip generation
-                            if filter_name in cls.declared_filters:
-                                filters[filter_name] = cls.declared_filters[filter_name]
-                                continue
-
-                            if field is not None:
-                                filters[filter_name] = cls.filter_for_field(field, field_name, lookup_expr)
-
-                    # Allow Meta.fields to contain declared filters *only* when a list/tuple
-                    if isinstance(cls._meta.fields, (list, tuple)):
-                        undefined = [f for f in undefined if f not in cls.declared_filters]
-
-                    if undefined:
-                        raise TypeError(
-                            "'Meta.fields' must not contain non-model field names: %s" % ", ".join(undefined)
-                        )
-
-                    # Add in declared filters. This is necessary since we don't enforce adding
-                    # declared filters to the 'Meta.fields' option
-                    filters.update(cls.declared_filters)
-                    return filters
-
-                class Meta(MetaBase):
-                    model = queryset.model
-                    fields = filterset_fields
-
-            return AutoFilterSet
 
-        return None
+                        if field is not None:
+                            filters[filter_name] = cls.filter_for_field(field, field_name, lookup_expr)
 
-    def filter_queryset(self, request, queryset, view):
-        filterset = self.get_filterset(request, queryset, view)
-        if filterset is None:
-            return queryset
-        if filterset.__class__.__name__ == "AutoFilterSet":
-            queryset = filterset.queryset
+                # Allow Meta.fields to contain declared filters *only* when a list/tuple
+                if isinstance(cls._meta.fields, (list, tuple)):
+                    undefined = [f for f in undefined if f not in cls.declared_filters]
+
+                if undefined:
+                    raise TypeError(
+                        "'Meta.fields' must not contain non-model field names: %s" % ", ".join(undefined)
+                    )
+
+                # Add in declared filters. This is necessary since we don't enforce adding
+                # declared filters to the 'Meta.fields' option
+                filters.update(cls.declared_filters)
+                return filters
+
+            class Meta(MetaBase):
+                model = filterset_model
+                fields = filterset_fields
+
+        return AutoFilterSet
+
+    def get_filter_lookups(self, filterset):
+        """
+        查询参数名到 orm 查询条件的映射, 按 AutoFilterSet 类缓存
+        """
+        key = (filterset.__class__, _freeze(self.filter_fields))
+        lookup_map = _filter_lookups.get(key)
+        if lookup_map is None:
             filter_fields = filterset.filters if self.filter_fields == "__all__" else self.filter_fields
             orm_lookup_dict = dict(
                 zip(
@@ -401,11 +518,27 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
             orm_lookups = [
                 self.construct_search(lookup, lookup_expr) for lookup, lookup_expr in orm_lookup_dict.items()
             ]
-            # print(orm_lookups)
+            lookup_map = {}
+            for lookup in orm_lookups:
+                # 去掉查询方式后的参数名, 同名时取第一个
+                lookup_map.setdefault(
+                    LOOKUP_SEP.join(lookup.split(LOOKUP_SEP)[:-1]) if len(lookup.split(LOOKUP_SEP)) > 1 else lookup,
+                    lookup
+                )
+            _filter_lookups[key] = lookup_map
+        return lookup_map
+
+    def filter_queryset(self, request, queryset, view):
+        filterset = self.get_filterset(request, queryset, view)
+        if filterset is None:
+            return queryset
+        if filterset.__class__.__name__ == "AutoFilterSet":
+            queryset = filterset.queryset
+            lookup_map = self.get_filter_lookups(filterset)
             conditions = []
             queries = []
             for search_term_key in filterset.data.keys():
-                orm_lookup = self.find_filter_lookups(orm_lookups, search_term_key)
+                orm_lookup = lookup_map.get(search_term_key)
                 if not orm_lookup or filterset.data.get(search_term_key) == '':
                     continue
                 filterset_data_len = len(filterset.data.getlist(search_term_key))
@@ -426,3 +559,36 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
         if not filterset.is_valid() and self.raise_exception:
             raise utils.translate_validation(filterset.errors)
         return filterset.qs
+
+
+def get_urlpatterns_viewsets(urlpatterns):
+    """
+    路由中注册的全部视图集类(包含插件路由)
+    :param urlpatterns: 路由列表
+    """
+    viewsets = []
+    for pattern in urlpatterns:
+        if isinstance(pattern, URLResolver):
+            viewsets += get_urlpatterns_viewsets(pattern.url_patterns)
+            continue
+        viewset = getattr(pattern.callback, "cls", None)
+        if isinstance(viewset, type) and viewset not in viewsets:
+            viewsets.append(viewset)
+    return viewsets
+
+
+def warm_filterset_cache(viewsets):
+    """
+    启动时预先生成视图集的 AutoFilterSet
+    :param viewsets: 视图集类列表
+    """
+    for viewset in viewsets:
+        if CustomDjangoFilterBackend not in getattr(viewset, "filter_backends", []):
+            continue
+        queryset = getattr(viewset, "queryset", None)
+        if queryset is None:
+            continue
+        try:
+            CustomDjangoFilterBackend().get_filterset_class(viewset, queryset)
+        except Exception as e:
+            logger.warning(f"{viewset.__name__} 过滤器预生成失败: {e}")
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 创建人、修改人名称解析
+(1)IdentityResolver 按请求创建, 列表序列化前收集整页的用户id, 一次查询出名称
+(2)名称在进程内缓存 IDENTITY_NAME_CACHE_TIMEOUT 秒, 用户修改名称或删除时清除本进程缓存, 其他进程由过期时间兜底
+(3)modifier 为字符文本, 用户id统一按字符串处理
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+# 进程内名称缓存 {(schema, 用户id): (名称, 过期时间)}
+_name_cache = {}
+_name_cache_lock = threading.Lock()
+
+
+def _get_schema_name():
+    return getattr(getattr(connection, "tenant", None), "schema_name", None) or ""
+
+
+def normalize_user_id(user_id):
+    """
+    统一为字符串用户id, 非数字返回 None
+    """
+    user_id = str(user_id or "").strip()
+    return user_id if user_id.isdigit() else None
+
+
+def clear_identity_cache(*user_ids):
+    """
+    清除本进程缓存的用户名称, 不传参数时全部清除
+    """
+    with _name_cache_lock:
+        if not user_ids:
+            _name_cache.clear()
+            return
+        keys = {normalize_user_id(user_id) for user_id in user_ids}
+        for key in [key for key in _name_cache if key[1] in keys]:
+            _name_cache.pop(key, None)
+
+
+class IdentityResolver:
+    """
+    用户id到名称的解析, 同一请求内共用
+    """
+
+    def __init__(self):
+        self.schema_name = _get_schema_name()
+        self.names = {}
+
+    def prime(self, user_ids):
+        """
+        批量解析用户名称, 已解析的跳过, 进程缓存未命中的一次查询
+        """
+        from dvadmin.system.models import Users
+
+        pending = {normalize_user_id(user_id) for user_id in user_ids} - set(self.names)
+        pending.discard(None)
+        if not pending:
+            return
+        now = time.monotonic()
+        with _name_cache_lock:
+            for user_id in list(pending):
+                cached = _name_cache.get((self.schema_name, user_id))
+                if cached is not None and cached[1] > now:
+                    self.names[user_id] = cached[0]
+                    pending.discard(user_id)
+        if not pending:
+            return
+        found = {str(pk): name for pk, name in Users.objects.filter(id__in=pending).values_list("id", "name")}
+        expires = now + getattr(settings, "IDENTITY_NAME_CACHE_TIMEOUT", 30)
+        with _name_cache_lock:
+            for user_id in pending:
+                name = found.get(user_id)
+                self.names[user_id] = name
+                _name_cache[(self.schema_name, user_id)] = (name, expires)
+
+    def get_name(self, user_id):
+        user_id = normalize_user_id(user_id)
+        if user_id is None:
+            return None
+        if user_id not in self.names:
+            self.prime([user_id])
+        return self.names.get(user_id)
+
+
+def get_identity_resolver(holder):
+    """
+    获取绑定在 holder(请求, 无请求时为根序列化器)上的解析器
+    """
+    resolver = getattr(holder, "_identity_resolver", None)
+    if resolver is None:
+        resolver = IdentityResolver()
+        setattr(holder, "_identity_resolver", resolver)
+    return resolver
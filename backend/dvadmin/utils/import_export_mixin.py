@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
+import logging
+import re
+import tempfile
+import time
+from itertools import islice
 from urllib.parse import quote
 
-from django.db import transaction
-from django.http import HttpResponse
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models.signals import pre_save, post_save
+from django.http import HttpResponse, FileResponse
 from openpyxl import Workbook
 from openpyxl.worksheet.datavalidation import DataValidation
 from openpyxl.utils import get_column_letter, quote_sheetname
@@ -10,9 +17,13 @@ from openpyxl.worksheet.table import Table, TableStyleInfo
 from rest_framework.decorators import action
 from rest_framework.request import Request
 
-from dvadmin.utils.import_export import import_to_data
-from dvadmin.utils.json_response import DetailResponse
+from dvadmin.utils.import_export import iter_import_data
+from dvadmin.utils.jobs import is_async_request, submit_job, report_job_progress
+from dvadmin.utils.json_response import DetailResponse, ErrorResponse
 from dvadmin.utils.request_util import get_verbose_name
+from dvadmin.utils.serializers import CustomModelSerializer
+
+logger = logging.getLogger(__name__)
 
 
 class ImportSerializerMixin:
@@ -26,6 +37,10 @@ class ImportSerializerMixin:
     import_serializer_class = None
     # 表格表头最大宽度，默认50个字符
     export_column_width = 50
+    # 导入时每批处理的行数, 每批一个事务
+    import_chunk_size = 500
+    # 导入时是否批量写入: None 自动判断; True 表示模型的保存逻辑与保存信号由 after_bulk_import 处理; False 逐行保存
+    import_bulk = None
 
     def is_number(self,num):
         try:
@@ -58,7 +73,6 @@ class ImportSerializerMixin:
         return round(length, 1) if length <= self.export_column_width else self.export_column_width
 
     @action(methods=['get','post'],detail=False)
-    @transaction.atomic  # Django 事务,防止出错
     def import_data(self, request: Request, *args, **kwargs):
         """
         导入模板
@@ -135,6 +149,8 @@ class ImportSerializerMixin:
             wb.save(response)
             return response
         else:
+            if is_async_request(self, request):
+                return submit_job(self, request, name=f"导入{get_verbose_name(self.get_queryset())}")
             # 从excel中组织对应的数据结构，然后使用序列化器保存
             queryset = self.filter_queryset(self.get_queryset())
             # 获取多对多字段
@@ -144,15 +160,175 @@ class ImportSerializerMixin:
                 if hasattr(ele, "many_to_many") and ele.many_to_many == True
             ]
             import_field_dict = {'id':'更新主键(勿改)',**self.import_field_dict}
-            data = import_to_data(request.data.get("url"), import_field_dict, m2m_fields)
-            for ele in data:
-                filter_dic = {'id':ele.get('id')}
-                instance = filter_dic and queryset.filter(**filter_dic).first()
-                # print(156,ele)
-                serializer = self.import_serializer_class(instance, data=ele, request=request)
-                serializer.is_valid(raise_exception=True)
-                serializer.save()
-            return DetailResponse(msg=f"导入成功！")
+            rows = iter_import_data(request.data.get("url"), import_field_dict, m2m_fields)
+            result = self.bulk_import(request, queryset, rows, m2m_fields)
+            msg = f"导入成功{result['created'] + result['updated']}条, 失败{len(result['errors'])}条"
+            if result["errors"]:
+                error = result["errors"][0]
+                return ErrorResponse(data=result, msg=f"{msg}, 第{error['row']}行: {error['msg']}")
+            return DetailResponse(data=result, msg=f"导入成功！{msg}")
+
+    def can_bulk_import(self, model, m2m_fields):
+        """
+        是否可以批量写入: 序列化器未自定义保存逻辑, 不导入多对多字段, 且模型未自定义保存逻辑、没有保存信号
+        (import_bulk = True 时由 after_bulk_import 处理模型保存逻辑与信号)
+        否则逐行调用 serializer.save(), 保证与单条保存行为一致
+        """
+        serializer_class = self.import_serializer_class
+        for name in ("save", "create", "update"):
+            if getattr(serializer_class, name) is not getattr(CustomModelSerializer, name):
+                return False
+        if set(m2m_fields) & set(self.import_field_dict.keys()):
+            return False
+        if self.import_bulk is not None:
+            return bool(self.import_bulk)
+        if model.save is not models.Model.save:
+            return False
+        return not (pre_save.has_listeners(model) or post_save.has_listeners(model))
+
+    def after_bulk_import(self, model, creates, updates):
+        """
+        批量写入后调用(与写入在同一事务中), 用于补充模型 save() 或保存信号中的逻辑
+        :param model:
+        :param creates: 新增的实例
+        :param updates: 更新的实例
+        """
+        pass
+
+    @staticmethod
+    def get_import_pk(model, value):
+        """
+        excel 中的更新主键转换为模型主键类型(excel 中的数字可能为 1.0 或 "1"), 无效时抛出 ValidationError
+        """
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        elif isinstance(value, str) and re.fullmatch(r"\s*\d+\.0*\s*", value):
+            value = value.strip().split(".")[0]
+        return model._meta.pk.to_python(value)
+
+    def _get_validated_instance(self, serializer, request):
+        """
+        按 CustomModelSerializer.create/update 的逻辑, 由校验后的数据构建模型实例, 不保存
+        """
+        validated_data = dict(serializer.validated_data)
+        user = getattr(request, "user", None)
+        fields = serializer.fields.fields
+        if user and str(user) != "AnonymousUser":
+            if serializer.modifier_field_id in fields:
+                validated_data[serializer.modifier_field_id] = user.id
+            if serializer.instance is None:
+                if serializer.creator_field_id in fields:
+                    validated_data[serializer.creator_field_id] = user
+                if (
+                    serializer.dept_belong_id_field_name in fields
+                    and validated_data.get(serializer.dept_belong_id_field_name, None) is None
+                ):
+                    validated_data[serializer.dept_belong_id_field_name] = getattr(user, "dept_id", None)
+        if serializer.instance is None:
+            return serializer.Meta.model(**validated_data), None
+        instance = serializer.instance
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        return instance, set(validated_data.keys())
+
+    def _import_chunk(self, request, queryset, chunk, bulk, result):
+        """
+        导入一批数据: 一次查询取出需要更新的记录, 逐行校验后批量写入
+        """
+        model = queryset.model
+        pks = {}
+        for row_number, ele, error in chunk:
+            if not error and ele.get("id") not in (None, ""):
+                try:
+                    pks[row_number] = self.get_import_pk(model, ele["id"])
+                except ValidationError:
+                    pks[row_number] = None
+        instances = queryset.in_bulk([pk for pk in pks.values() if pk is not None]) if pks else {}
+        valid_rows = []
+        for row_number, ele, error in chunk:
+            if not error and row_number in pks and pks[row_number] is None:
+                error = f"更新主键无效: {ele['id']}"
+            if error:
+                result["errors"].append({"row": row_number, "msg": error})
+                continue
+            instance = instances.get(pks[row_number]) if row_number in pks else None
+            serializer = self.import_serializer_class(instance, data=ele, request=request)
+            if not serializer.is_valid():
+                result["errors"].append({"row": row_number, "msg": str(serializer.errors)})
+                continue
+            valid_rows.append((row_number, serializer))
+        if not valid_rows:
+            return
+        if bulk:
+            try:
+                with transaction.atomic():
+                    self._bulk_save(model, valid_rows, request, result)
+                return
+            except Exception as e:
+                # 批量写入失败(如文件内数据重复), 回退为逐行保存以定位出错的行
+                logger.warning(f"批量导入失败, 改为逐行保存: {e}")
+        with transaction.atomic():
+            for row_number, serializer in valid_rows:
+                is_update = serializer.instance is not None
+                try:
+                    with transaction.atomic():
+                        serializer.save()
+                except Exception as e:
+                    result["errors"].append({"row": row_number, "msg": str(e)})
+                    continue
+                result["updated" if is_update else "created"] += 1
+
+    def _bulk_save(self, model, valid_rows, request, result):
+        creates, updates, update_fields = [], [], set()
+        for row_number, serializer in valid_rows:
+            obj, fields = self._get_validated_instance(serializer, request)
+            if fields is None:
+                creates.append(obj)
+            else:
+                updates.append(obj)
+                update_fields |= fields
+        if updates:
+            # bulk_update 不会自动更新 auto_now 字段
+            for field in model._meta.concrete_fields:
+                if getattr(field, "auto_now", False):
+                    update_fields.add(field.name)
+                    for obj in updates:
+                        field.pre_save(obj, False)
+            model.objects.bulk_update(updates, list(update_fields), batch_size=self.import_chunk_size)
+        if creates:
+            model.objects.bulk_create(creates, batch_size=self.import_chunk_size)
+        self.after_bulk_import(model, creates, updates)
+        result["created"] += len(creates)
+        result["updated"] += len(updates)
+
+    def bulk_import(self, request, queryset, rows, m2m_fields):
+        """
+        分批导入数据, 每批一个事务, 返回导入结果及逐行错误
+        :param request:
+        :param queryset:
+        :param rows: iter_import_data 生成的数据
+        :param m2m_fields: 多对多字段
+        :return:
+        """
+        bulk = self.can_bulk_import(queryset.model, m2m_fields)
+        result = {"total": 0, "created": 0, "updated": 0, "errors": []}
+        start_time = time.monotonic()
+        while True:
+            chunk = list(islice(rows, self.import_chunk_size))
+            if not chunk:
+                break
+            result["total"] += len(chunk)
+            self._import_chunk(request, queryset, chunk, bulk, result)
+            report_job_progress(request, result["total"])
+        result["seconds"] = round(time.monotonic() - start_time, 3)
+        result["rows_per_second"] = round(result["total"] / result["seconds"], 1) if result["seconds"] else result[
+            "total"]
+        logger.info(
+            f"导入{get_verbose_name(queryset)}: 共{result['total']}行, 新增{result['created']}, "
+            f"更新{result['updated']}, 失败{len(result['errors'])}, 耗时{result['seconds']}s, "
+            f"{result['rows_per_second']}行/s"
+        )
+        return result
 
     @action(methods=['get'],detail=False)
     def update_template(self,request):
@@ -257,6 +433,12 @@ class ExportSerializerMixin:
     export_serializer_class = None
     # 表格表头最大宽度，默认50个字符
     export_column_width = 50
+    # 流式导出: 分批读取、序列化并写入临时文件, 内存占用与数据量无关, 适用于大数据量导出
+    export_streaming = False
+    # 流式导出每批条数
+    export_chunk_size = 2000
+    # 流式导出时 select_related 的字段
+    export_select_related = ()
 
     def is_number(self,num):
         try:
@@ -300,6 +482,12 @@ class ExportSerializerMixin:
         queryset = self.filter_queryset(self.get_queryset())
         assert self.export_field_label, "'%s' 请配置对应的导出模板字段。" % self.__class__.__name__
         assert self.export_serializer_class, "'%s' 请配置对应的导出序列化器。" % self.__class__.__name__
+        if is_async_request(self, request):
+            return submit_job(self, request, name=f"导出{get_verbose_name(queryset)}")
+        if getattr(request, "async_job", None):
+            report_job_progress(request, 0, queryset.count())
+        if self.export_streaming:
+            return self.export_data_streaming(request, queryset)
         data = self.export_serializer_class(queryset, many=True, request=request).data
         # 导出excel 表
         response = HttpResponse(content_type="application/msexcel")
@@ -316,16 +504,17 @@ class ExportSerializerMixin:
         for index, results in enumerate(data):
             results_list = []
             for h_index, h_item in enumerate(hidden_header):
-                for key,val in results.items():
-                    if key == h_item:
-                        if val is None or val=="":
-                            results_list.append("")
-                        else:
-                            results_list.append(val)
-                        # 计算最大列宽度
-                        result_column_width = self.get_string_len(val)
-                        if h_index !=0 and result_column_width > df_len_max[h_index]:
-                            df_len_max[h_index] = result_column_width
+                if h_item not in results:
+                    continue
+                val = results[h_item]
+                if val is None or val=="":
+                    results_list.append("")
+                else:
+                    results_list.append(val)
+                # 计算最大列宽度
+                result_column_width = self.get_string_len(val)
+                if h_index !=0 and result_column_width > df_len_max[h_index]:
+                    df_len_max[h_index] = result_column_width
             ws.append([index + 1, *results_list])
             column += 1
         # 　更新列宽
@@ -343,3 +532,70 @@ class ExportSerializerMixin:
         ws.add_table(tab)
         wb.save(response)
         return response
+
+    def iter_export_data(self, request, queryset):
+        """
+        分批读取并序列化导出数据, 每次只保留一批数据在内存中
+        :param request:
+        :param queryset:
+        :return: 每批序列化后的数据
+        """
+        if self.export_select_related:
+            queryset = queryset.select_related(*self.export_select_related)
+        iterator = queryset.iterator(chunk_size=self.export_chunk_size)
+        while True:
+            chunk = list(islice(iterator, self.export_chunk_size))
+            if not chunk:
+                return
+            yield self.export_serializer_class(chunk, many=True, request=request).data
+
+    def export_data_streaming(self, request, queryset):
+        """
+        流式导出: openpyxl write-only 模式写入临时文件, 再以文件流返回
+        write-only 模式下列宽需在写入数据前设置, 按表头和第一批数据计算
+        :param request:
+        :param queryset:
+        :return:
+        """
+        header_data = ["序号", *self.export_field_label.values()]
+        keys = list(self.export_field_label.keys())
+        df_len_max = [self.get_string_len(ele) for ele in header_data]
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        chunks = self.iter_export_data(request, queryset)
+        first_chunk = next(chunks, [])
+        for results in first_chunk:
+            for index, key in enumerate(keys):
+                val = results.get(key)
+                if isinstance(val, str):
+                    df_len_max[index + 1] = max(df_len_max[index + 1], self.get_string_len(val))
+        for index, width in enumerate(df_len_max):
+            ws.column_dimensions[get_column_letter(index + 1)].width = width
+        ws.append(header_data)
+        row_count = 0
+        for chunk in ([first_chunk] if first_chunk else []), chunks:
+            for data in chunk:
+                report_job_progress(request, row_count)
+                for results in data:
+                    row_count += 1
+                    row = [row_count]
+                    for key in keys:
+                        val = results.get(key)
+                        row.append("" if val is None else val)
+                    ws.append(row)
+        tab = Table(displayName="Table", ref=f"A1:{get_column_letter(len(header_data))}{row_count + 1}")
+        tab.tableStyleInfo = TableStyleInfo(
+            name="TableStyleLight11",
+            showFirstColumn=True,
+            showLastColumn=True,
+            showRowStripes=True,
+            showColumnStripes=True,
+        )
+        ws.add_table(tab)
+        file = tempfile.TemporaryFile(suffix=".xlsx")
+        wb.save(file)
+        file.seek(0)
+        response = FileResponse(file, content_type="application/msexcel")
+        response["Access-Control-Expose-Headers"] = f"Content-Disposition"
+        response["content-disposition"] = f'attachment;filename={quote(str(f"导出{get_verbose_name(queryset)}.xlsx"))}'
+        return response
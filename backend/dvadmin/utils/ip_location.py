@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: ip 归属地查询
+(1)按 settings.IP_LOCATION_PROVIDERS 顺序依次查询, 前一个查不到时使用下一个
+(2)查询结果按 ip 缓存在进程内 LRU 中
+(3)登录日志先写入, 归属地在后台线程查询后再补充更新, 不阻塞登录请求
+"""
+import bisect
+import csv
+import ipaddress
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils.module_loading import import_string
+
+from application import dispatch
+
+logger = logging.getLogger(__name__)
+
+IP_LOCATION_FIELDS = (
+    "continent", "country", "province", "city", "district", "isp", "area_code", "country_english",
+    "country_code", "longitude", "latitude",
+)
+
+
+def empty_location():
+    return {field: "" for field in IP_LOCATION_FIELDS}
+
+
+class BaseIpLocationProvider:
+    """
+    ip 归属地查询方式
+    """
+
+    def lookup(self, ip):
+        """
+        :param ip: ipaddress.ip_address 对象
+        :return: 归属地字典, 查不到返回 None
+        """
+        raise NotImplementedError
+
+
+class RemoteIpLocationProvider(BaseIpLocationProvider):
+    """
+    调用 api 查询
+    """
+
+    def __init__(self, url="https://ip.django-vue-admin.com/ip/analysis", timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def lookup(self, ip):
+        try:
+            res = requests.get(url=self.url, params={"ip": str(ip)}, timeout=self.timeout)
+            if res.status_code == 200:
+                res_data = res.json()
+                if res_data.get("code") == 0:
+                    return res_data.get("data")
+        except Exception as e:
+            logger.warning(f"ip 归属地查询失败: {ip}, {e}")
+        return None
+
+
+class OfflineIpLocationProvider(BaseIpLocationProvider):
+    """
+    本地离线库查询
+    离线库为 csv 文件, 首行为表头, 必须包含 start_ip、end_ip 列, 其余列名与 IP_LOCATION_FIELDS 对应, 例如:
+    start_ip,end_ip,country,province,city,isp
+    1.0.1.0,1.0.3.255,中国,福建省,福州市,电信
+    加载后按起始 ip 排序, 通过二分查找定位所属区间
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(settings.BASE_DIR, "conf", "ip_location.csv")
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._ranges = {}
+
+    def _load(self):
+        ranges = {4: [], 6: []}
+        if not os.path.exists(self.path):
+            logger.info(f"ip 离线库不存在, 已跳过: {self.path}")
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    start = ipaddress.ip_address(row.pop("start_ip").strip())
+                    end = ipaddress.ip_address(row.pop("end_ip").strip())
+                except (AttributeError, ValueError):
+                    continue
+                if start.version != end.version:
+                    continue
+                location = {key: (value or "").strip() for key, value in row.items() if key in IP_LOCATION_FIELDS}
+                ranges[start.version].append((int(start), int(end), location))
+        result = {}
+        for version, items in ranges.items():
+            items.sort(key=lambda item: item[0])
+            result[version] = (
+                [item[0] for item in items],
+                [item[1] for item in items],
+                [item[2] for item in items],
+            )
+        return result
+
+    def lookup(self, ip):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._ranges = self._load()
+                    self._loaded = True
+        if ip.version not in self._ranges:
+            return None
+        starts, ends, locations = self._ranges[ip.version]
+        value = int(ip)
+        index = bisect.bisect_right(starts, value) - 1
+        if index >= 0 and value <= ends[index]:
+            return locations[index]
+        return None
+
+
+class IpLocator:
+    """
+    按顺序使用各查询方式, 并缓存查询结果
+    """
+
+    def __init__(self, providers, cache_size=10000):
+        self.providers = providers
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def get_cached(self, ip):
+        with self._lock:
+            location = self._cache.get(ip)
+            if location is not None:
+                self._cache.move_to_end(ip)
+            return location
+
+    def _set_cached(self, ip, location):
+        with self._lock:
+            self._cache[ip] = location
+            self._cache.move_to_end(ip)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def lookup(self, ip):
+        """
+        查询 ip 归属地
+        :param ip: ip地址
+        :return: 归属地字典, 查不到返回 None
+        """
+        location = self.get_cached(ip)
+        if location is not None:
+            return location
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.is_private or address.is_loopback:
+            # 内网地址无需查询
+            location = empty_location()
+        else:
+            for provider in self.providers:
+                location = provider.lookup(address)
+                if location:
+                    location = {**empty_location(), **location}
+                    break
+            else:
+                # 查询失败不缓存, 下次重新查询
+                return None
+        self._set_cached(ip, location)
+        return location
+
+
+_ip_locator = None
+
+
+def get_ip_locator():
+    global _ip_locator
+    if _ip_locator is None:
+        providers = []
+        for config in getattr(settings, "IP_LOCATION_PROVIDERS", None) or []:
+            providers.append(import_string(config["BACKEND"])(**config.get("OPTIONS", {})))
+        _ip_locator = IpLocator(providers, getattr(settings, "IP_LOCATION_CACHE_SIZE", 10000))
+    return _ip_locator
+
+
+_executor = None
+_executor_pid = None
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ip-location")
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _update_login_location(log_id, ip, schema_name=None):
+    from dvadmin.system.models import LoginLog
+
+    location = get_ip_locator().lookup(ip)
+    if not location:
+        return
+    close_old_connections()
+    try:
+        if schema_name:
+            from django_tenants.utils import schema_context
+
+            with schema_context(schema_name):
+                LoginLog.objects.filter(id=log_id).update(**location)
+        else:
+            LoginLog.objects.filter(id=log_id).update(**location)
+    except Exception as e:
+        logger.exception(f"登录日志归属地更新失败: {e}")
+    finally:
+        close_old_connections()
+
+
+def update_login_location(log_id, ip):
+    """
+    事务提交后在后台线程查询 ip 归属地并更新登录日志
+    """
+    schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else None
+    transaction.on_commit(lambda: _get_executor().submit(_update_login_location, log_id, ip, schema_name))
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 后台任务(导入、导出)
+(1)视图集设置 async_job_enabled = True 后, 请求参数带 async=1 时, 导入/导出提交为后台任务并返回任务id
+(2)任务状态保存在 django cache 中, 进度通过 websocket 推送给提交任务的用户(user_<id> 分组)
+   使用 celery 执行时 worker 与 web 进程需共用缓存(如 redis), 进程内缓存时启动报错
+(3)后台任务以提交时的用户、地址和参数重新调用对应视图, 权限校验、数据权限与同步请求一致
+(4)导出完成的文件保存为 FileList 记录, 通过 async_job/<任务id>/download/ 下载, 任务状态与文件只有提交任务的用户可以访问
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.db import close_old_connections, connection
+from django.test import RequestFactory
+from django.utils.module_loading import import_string
+from rest_framework.test import force_authenticate
+
+from application import dispatch
+from dvadmin.utils.json_response import DetailResponse
+
+logger = logging.getLogger(__name__)
+
+JOB_CACHE_PREFIX = "dvadmin:job:"
+JOB_CACHE_TIMEOUT = 60 * 60 * 24
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCESS = "success"
+JOB_FAILURE = "failure"
+
+
+class Job:
+    """
+    后台任务状态
+    """
+    fields = ("id", "name", "status", "user_id", "schema_name", "viewset", "action", "method", "path",
+              "query_string", "data", "processed", "total", "result", "file_id", "file_url", "error",
+              "create_time", "finish_time")
+    # 进度推送最小间隔(秒)
+    push_interval = 1
+
+    def __init__(self, **kwargs):
+        for field in self.fields:
+            setattr(self, field, kwargs.get(field))
+        self._last_push = 0
+
+    @classmethod
+    def get(cls, job_id):
+        data = cache.get(f"{JOB_CACHE_PREFIX}{job_id}")
+        if data is None:
+            return None
+        return cls(**data)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+    def save(self):
+        cache.set(f"{JOB_CACHE_PREFIX}{self.id}", self.to_dict(), timeout=JOB_CACHE_TIMEOUT)
+
+    def get_state(self):
+        """
+        返回给前端的任务状态
+        """
+        return {
+            "job_id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "processed": self.processed,
+            "total": self.total,
+            "result": self.result,
+            "file_id": self.file_id,
+            "file_url": self.file_url,
+            "error": self.error,
+        }
+
+    def push(self):
+        from application.websocketConfig import websocket_push
+
+        try:
+            websocket_push(self.user_id, {"sender": "system", "contentType": "JOB", "content": self.get_state()})
+        except Exception as e:
+            logger.warning(f"任务进度推送失败: {e}")
+
+    def update(self, push=True, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        self.save()
+        if push:
+            self.push()
+
+    def progress(self, processed, total=None):
+        """
+        更新任务进度, 按 push_interval 节流
+        """
+        self.processed = processed
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if now - self._last_push >= self.push_interval:
+            self._last_push = now
+            self.update()
+
+
+class ThreadJobExecutor:
+    """
+    进程内线程池执行
+    """
+    requires_shared_cache = False
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._pid = None
+
+    def submit(self, job_id):
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="async-job")
+            self._pid = os.getpid()
+        self._executor.submit(run_job, job_id)
+
+
+class CeleryJobExecutor:
+    """
+    dvadmin-celery 插件执行, 需使用 redis 等共享缓存保存任务状态
+    """
+    requires_shared_cache = True
+
+    def submit(self, job_id):
+        from dvadmin.system.tasks import run_async_job
+
+        run_async_job.delay(job_id)
+
+
+_job_executor = None
+
+# 仅当前进程可见的缓存
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def is_shared_cache():
+    """
+    默认缓存是否可被其他进程(celery worker)读取
+    """
+    return settings.CACHES.get("default", {}).get("BACKEND") not in LOCAL_CACHE_BACKENDS
+
+
+def get_job_executor():
+    global _job_executor
+    if _job_executor is None:
+        backend = getattr(settings, "ASYNC_JOB_EXECUTOR", None)
+        if not backend:
+            if "dvadmin_celery" in settings.INSTALLED_APPS and is_shared_cache():
+                backend = "dvadmin.utils.jobs.CeleryJobExecutor"
+            else:
+                backend = "dvadmin.utils.jobs.ThreadJobExecutor"
+        executor_class = import_string(backend)
+        if getattr(executor_class, "requires_shared_cache", False) and not is_shared_cache():
+            raise ImproperlyConfigured(
+                f"后台任务执行器 {backend} 需要 redis 等共享缓存保存任务状态, 请修改 CACHES 配置"
+            )
+        options = getattr(settings, "ASYNC_JOB_EXECUTOR_OPTIONS", None) or {}
+        _job_executor = executor_class(**options)
+    return _job_executor
+
+
+def is_async_request(view, request):
+    if not getattr(view, "async_job_enabled", False) or getattr(request, "async_job", None):
+        return False
+    return str(request.query_params.get("async", "")).lower() in ("1", "true")
+
+
+def submit_job(view, request, name=None):
+    """
+    提交后台任务
+    :param view: 视图集实例
+    :param request:
+    :param name: 任务名称
+    :return: 包含任务id的响应
+    """
+    query = request.query_params.copy()
+    query.pop("async", None)
+    job = Job(
+        id=uuid.uuid4().hex,
+        name=name or view.action,
+        status=JOB_PENDING,
+        user_id=request.user.id,
+        schema_name=connection.tenant.schema_name if dispatch.is_tenants_mode() else None,
+        viewset=f"{view.__class__.__module__}.{view.__class__.__qualname__}",
+        action=view.action,
+        method=request.method,
+        path=request.path,
+        query_string=query.urlencode(),
+        data=request.data.dict() if hasattr(request.data, "dict") else request.data,
+        processed=0,
+        create_time=time.time(),
+    )
+    job.save()
+    get_job_executor().submit(job.id)
+    return DetailResponse(data=job.get_state(), msg="任务已提交")
+
+
+def _save_export_file(job, response, user):
+    """
+    导出结果保存为 FileList 记录
+    """
+    from dvadmin.system.models import FileList
+
+    filename = f"{job.name}.xlsx"
+    disposition = response.get("content-disposition", "")
+    if "filename=" in disposition:
+        filename = unquote(disposition.split("filename=")[-1].strip('"'))
+    content_type = response.get("content-type", "")
+    with tempfile.TemporaryFile() as tmp:
+        if response.streaming:
+            for chunk in response.streaming_content:
+                tmp.write(chunk)
+        else:
+            tmp.write(response.content)
+        response.close()
+        tmp.seek(0)
+        file = FileList(
+            name=filename,
+            url=File(tmp, name=filename),
+            mime_type=content_type.split(";")[0],
+            creator_id=user.id,
+            dept_belong_id=getattr(user, "dept_id", None),
+        )
+        file.save()
+    return file
+
+
+def _execute(job):
+    from dvadmin.system.models import Users
+
+    user = Users.objects.get(id=job.user_id)
+    factory = RequestFactory()
+    path = f"{job.path}?{job.query_string}" if job.query_string else job.path
+    if job.method == "GET":
+        django_request = factory.get(path)
+    else:
+        django_request = factory.generic(
+            job.method, path, data=json.dumps(job.data or {}), content_type="application/json"
+        )
+    force_authenticate(django_request, user=user)
+    django_request.async_job = job
+    view = import_string(job.viewset).as_view({job.method.lower(): job.action})
+    response = view(django_request)
+    if hasattr(response, "render") and callable(response.render) and not response.is_rendered:
+        response.render()
+    data = getattr(response, "data", None)
+    if isinstance(data, dict) and data.get("code") not in (None, 2000):
+        job.update(status=JOB_FAILURE, result=data.get("data"), error=data.get("msg"), finish_time=time.time())
+        return
+    result = {"status": JOB_SUCCESS, "finish_time": time.time()}
+    if isinstance(data, dict):
+        result["result"] = data.get("data")
+    elif response.status_code == 200:
+        file = _save_export_file(job, response, user)
+        result["file_id"] = file.id
+        result["file_url"] = file.file_url
+    else:
+        result.update(status=JOB_FAILURE, error=f"status code {response.status_code}")
+    job.update(**result)
+
+
+def run_job(job_id):
+    """
+    执行后台任务
+    :param job_id: 任务id
+    :return:
+    """
+    job = Job.get(job_id)
+    if job is None:
+        logger.warning(f"后台任务不存在或已过期: {job_id}")
+        return
+    close_old_connections()
+    try:
+        job.update(status=JOB_RUNNING)
+        if job.schema_name:
+            from django_tenants.utils import schema_context
+
+            with schema_context(job.schema_name):
+                _execute(job)
+        else:
+            _execute(job)
+    except Exception as e:
+        logger.exception(f"后台任务执行失败: {job_id}")
+        job.update(status=JOB_FAILURE, error=str(e), finish_time=time.time())
+    finally:
+        close_old_connections()
+
+
+def report_job_progress(request, processed, total=None):
+    """
+    在导入/导出过程中上报进度, 非后台任务时忽略
+    """
+    job = getattr(request, "async_job", None)
+    if job is not None:
+        job.progress(processed, total)
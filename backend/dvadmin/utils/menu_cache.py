@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 前端路由、按钮权限缓存
+(1)按角色集合缓存在共享缓存(settings.CACHES)中, 同一角色集合的用户共用
+(2)版本号由菜单版本号(菜单、菜单授权变化时递增)与接口权限版本号组成, 任一变化时缓存失效
+(3)响应带 ETag, 请求头 If-None-Match 与之相同时直接返回 304, 不查询数据库
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db import connection
+from django.utils.cache import patch_cache_control
+from rest_framework import status
+from rest_framework.response import Response
+
+from dvadmin.utils.cache import get_cache_version
+from dvadmin.utils.permission import PERMISSION_CACHE_VERSION, permission_index
+
+# 菜单缓存的版本号命名空间
+MENU_CACHE_VERSION = "menu"
+MENU_CACHE_PREFIX = "dvadmin:menu:"
+MENU_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_role_key(user):
+    """
+    用户所属角色集合的缓存标识, 超级管理员为 superuser
+    """
+    if user.is_superuser:
+        return "superuser"
+    return ",".join(str(role_id) for role_id in sorted(permission_index.get_role_ids(user)))
+
+
+def role_cached_response(request, name, build, response_class, **response_kwargs):
+    """
+    按角色集合缓存的条件响应
+    :param request:
+    :param name: 缓存名称
+    :param build: 生成数据的函数, 无参数, 返回值需可序列化
+    :param response_class: 响应类, 如 DetailResponse
+    :param response_kwargs: 响应类的其他参数, 值为函数时以数据为参数调用
+    :return: 响应或 304
+    """
+    user = request.user
+    role_key = get_role_key(user)
+    version = get_cache_version(MENU_CACHE_VERSION, PERMISSION_CACHE_VERSION)
+    schema_name = getattr(getattr(connection, "tenant", None), "schema_name", None) or ""
+    key = f"{schema_name}:{name}:{version}:{role_key}"
+    etag = '"%s"' % hashlib.md5(key.encode()).hexdigest()
+    if_none_match = request.headers.get("If-None-Match", "")
+    # 经过 gzip 等中间件后 ETag 可能变为弱校验 W/"..."
+    if etag in [item.strip().removeprefix("W/") for item in if_none_match.split(",")]:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        cache_key = f"{MENU_CACHE_PREFIX}{key}"
+        data = cache.get(cache_key)
+        if data is None:
+            data = build()
+            cache.set(cache_key, data, timeout=MENU_CACHE_TIMEOUT)
+        kwargs = {k: v(data) if callable(v) else v for k, v in response_kwargs.items()}
+        response = response_class(data=data, **kwargs)
+    response["ETag"] = etag
+    # 允许浏览器缓存, 但每次使用前需携带 ETag 重新验证
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 消息中心消息分发
+(1)按目标类型一次查询出全部目标用户
+(2)目标用户记录分批 bulk_create 写入
+(3)目标用户的未读数量由计数器维护, 分批读取
+(4)在同一个事件循环中分批并发推送 websocket 消息
+(5)每个用户的未读数量保存在 MessageCenterUserState.unread_count, 消息新增、已读、删除时增减维护,
+   为空时(尚未统计)从消息记录重新统计
+(6)系统通知开启广播存储(settings.MESSAGE_BROADCAST_STORAGE)时只保存一条消息, 不写入目标用户记录,
+   已读状态为每个用户的已读水位 + 水位之上已读消息的 MessageCenterTargetUser(is_read=True) 记录
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q, Case, When, Value, Exists, OuterRef, BooleanField, Prefetch
+
+from dvadmin.system.models import Users, MessageCenter, MessageCenterTargetUser, MessageCenterUserState, Dept
+
+logger = logging.getLogger(__name__)
+
+# 广播消息的 websocket 分组, 所有在线用户都会加入
+BROADCAST_GROUP = "broadcast"
+
+
+def is_broadcast_storage(target_type):
+    """
+    是否使用广播存储
+    """
+    return target_type in [3] and getattr(settings, "MESSAGE_BROADCAST_STORAGE", True)
+
+
+def get_broadcast_messages(date_joined):
+    """
+    用户可见的广播消息: 用户加入后发布的广播消息
+    """
+    queryset = MessageCenter.objects.filter(broadcast=True)
+    if date_joined:
+        queryset = queryset.filter(create_datetime__gte=date_joined)
+    return queryset
+
+
+def get_user_message_state(user_id):
+    """
+    获取用户加入时间和已读广播消息水位
+    """
+    data = Users.objects.filter(id=user_id).values('date_joined', 'message_state__last_read_broadcast_id').first()
+    if data is None:
+        return None, 0
+    return data['date_joined'], data['message_state__last_read_broadcast_id'] or 0
+
+
+def get_user_messages(user):
+    """
+    用户收到的全部消息: 直接发送的消息 + 可见的广播消息
+    """
+    return MessageCenter.objects.filter(
+        Q(id__in=MessageCenterTargetUser.objects.filter(users_id=user.id).values('messagecenter_id'))
+        | Q(broadcast=True, create_datetime__gte=user.date_joined)
+    )
+
+
+def annotate_is_read(queryset, user_id):
+    """
+    在查询中标注消息对用户是否已读(is_read), 避免逐条查询
+    """
+    watermark = get_user_message_state(user_id)[1]
+    return queryset.annotate(is_read=Case(
+        When(Q(broadcast=True, id__lte=watermark), then=Value(True)),
+        When(Exists(MessageCenterTargetUser.objects.filter(
+            users_id=user_id, messagecenter_id=OuterRef('pk'), is_read=True
+        )), then=Value(True)),
+        default=Value(False),
+        output_field=BooleanField(),
+    ))
+
+
+def get_target_prefetches():
+    """
+    消息目标角色、部门、用户的预加载
+    """
+    return [
+        'target_role',
+        Prefetch('target_dept', queryset=Dept.objects.select_related('parent')),
+        # UserSerializer 输出角色、岗位、用户组、权限的主键列表
+        Prefetch('target_user', queryset=Users.objects.select_related('dept').prefetch_related(
+            'role', 'post', 'groups', 'user_permissions')),
+    ]
+
+
+def get_read_broadcast_ids(user_id, watermark):
+    """
+    水位之上已读的广播消息id
+    """
+    return MessageCenterTargetUser.objects.filter(
+        users_id=user_id, is_read=True, messagecenter__broadcast=True, messagecenter_id__gt=watermark
+    ).values('messagecenter_id')
+
+
+def count_unread(user_id):
+    """
+    从消息记录统计用户的未读消息数量: 直接发送的未读消息 + 水位之上未读的广播消息
+    """
+    count = MessageCenterTargetUser.objects.filter(users_id=user_id, is_read=False).count()
+    date_joined, watermark = get_user_message_state(user_id)
+    count += get_broadcast_messages(date_joined).filter(id__gt=watermark).exclude(
+        id__in=get_read_broadcast_ids(user_id, watermark)
+    ).count()
+    return count
+
+
+def refresh_unread_count(user_id):
+    """
+    重新统计并保存用户的未读消息数量
+    锁定状态记录后统计, 并发的增减会等待统计完成后再执行
+    """
+    MessageCenterUserState.objects.get_or_create(users_id=user_id)
+    with transaction.atomic():
+        state = MessageCenterUserState.objects.select_for_update().get(users_id=user_id)
+        state.unread_count = count_unread(user_id)
+        state.save(update_fields=["unread_count"])
+    return state.unread_count
+
+
+def get_unread_count(user_id):
+    """
+    获取用户的未读消息数量
+    """
+    count = MessageCenterUserState.objects.filter(users_id=user_id).values_list('unread_count', flat=True).first()
+    if count is None:
+        count = refresh_unread_count(user_id)
+    return count
+
+
+def change_unread_count(delta, user_ids=None):
+    """
+    增减未读消息数量, 尚未统计的用户保持为空
+    :param delta: 增减数量
+    :param user_ids: 用户id, 可以是子查询, 为 None 时为全部用户
+    """
+    queryset = MessageCenterUserState.objects.exclude(unread_count=None)
+    if user_ids is not None:
+        queryset = queryset.filter(users_id__in=user_ids)
+    return queryset.update(unread_count=F('unread_count') + delta)
+
+
+def is_message_read(user_id, message, watermark=None):
+    """
+    消息对用户是否已读
+    """
+    if message.broadcast:
+        if watermark is None:
+            watermark = get_user_message_state(user_id)[1]
+        if message.id <= watermark:
+            return True
+    return MessageCenterTargetUser.objects.filter(
+        users_id=user_id, messagecenter_id=message.id, is_read=True
+    ).exists()
+
+
+def _advance_watermark(user_id, date_joined, watermark):
+    """
+    将已读水位推进到第一条未读广播消息之前, 并清理水位以下的已读记录
+    """
+    broadcasts = get_broadcast_messages(date_joined).filter(id__gt=watermark)
+    first_unread_id = broadcasts.exclude(id__in=get_read_broadcast_ids(user_id, watermark)).order_by(
+        'id').values_list('id', flat=True).first()
+    if first_unread_id is None:
+        new_watermark = broadcasts.aggregate(max_id=Max('id'))['max_id'] or watermark
+    else:
+        new_watermark = first_unread_id - 1
+    if new_watermark > watermark:
+        MessageCenterUserState.objects.update_or_create(users_id=user_id,
+                                                        defaults={"last_read_broadcast_id": new_watermark})
+        MessageCenterTargetUser.objects.filter(
+            users_id=user_id, messagecenter__broadcast=True, messagecenter_id__lte=new_watermark
+        ).delete()
+
+
+@transaction.atomic
+def mark_message_read(user_id, message):
+    """
+    标记消息已读并减少未读数量, 广播消息已读后尝试推进水位并清理水位以下的已读记录
+    :return: 本次是否由未读变为已读
+    """
+    if not message.broadcast:
+        updated = MessageCenterTargetUser.objects.filter(
+            users_id=user_id, messagecenter_id=message.id, is_read=False
+        ).update(is_read=True)
+        if updated:
+            change_unread_count(-updated, [user_id])
+        return bool(updated)
+    date_joined, watermark = get_user_message_state(user_id)
+    if message.id <= watermark:
+        return False
+    _, created = MessageCenterTargetUser.objects.get_or_create(users_id=user_id, messagecenter_id=message.id,
+                                                               defaults={"is_read": True})
+    if created and (date_joined is None or message.create_datetime >= date_joined):
+        change_unread_count(-1, [user_id])
+    _advance_watermark(user_id, date_joined, watermark)
+    return created
+
+
+def mark_messages_read(user_id, message_ids=None):
+    """
+    批量标记已读, 按本次由未读变为已读的数量减少未读数量
+    :param user_id:
+    :param message_ids: 消息id, 为 None 时全部标记已读
+    :return: 最新的未读数量
+    """
+    with transaction.atomic():
+        # 直接发送的消息一条 UPDATE 标记已读
+        queryset = MessageCenterTargetUser.objects.filter(users_id=user_id, is_read=False)
+        if message_ids is not None:
+            queryset = queryset.filter(messagecenter_id__in=message_ids)
+        read_count = queryset.update(is_read=True)
+        # 广播消息
+        date_joined, watermark = get_user_message_state(user_id)
+        broadcasts = get_broadcast_messages(date_joined).filter(id__gt=watermark)
+        unread_broadcasts = broadcasts.exclude(id__in=get_read_broadcast_ids(user_id, watermark))
+        if message_ids is None:
+            # 水位跳到最新一条, 水位之上未读的广播消息全部变为已读
+            read_count += unread_broadcasts.count()
+            new_watermark = broadcasts.aggregate(max_id=Max('id'))['max_id']
+            if new_watermark:
+                MessageCenterUserState.objects.update_or_create(users_id=user_id,
+                                                                defaults={"last_read_broadcast_id": new_watermark})
+                MessageCenterTargetUser.objects.filter(
+                    users_id=user_id, messagecenter__broadcast=True, messagecenter_id__lte=new_watermark
+                ).delete()
+        else:
+            unread_ids = list(unread_broadcasts.filter(id__in=message_ids).values_list('id', flat=True))
+            MessageCenterTargetUser.objects.bulk_create([
+                MessageCenterTargetUser(users_id=user_id, messagecenter_id=message_id, is_read=True)
+                for message_id in unread_ids
+            ])
+            read_count += len(unread_ids)
+            _advance_watermark(user_id, date_joined, watermark)
+        if read_count:
+            change_unread_count(-read_count, [user_id])
+    return get_unread_count(user_id)
+
+
+def get_target_user_ids(target_type, target_user=None, target_role=None, target_dept=None):
+    """
+    获取消息的目标用户id
+    :param target_type: 目标类型 0:按用户 1:按角色 2:按部门 3:系统通知
+    :return:
+    """
+    if target_type in [1]:  # 按角色
+        queryset = Users.objects.filter(role__id__in=target_role or [])
+    elif target_type in [2]:  # 按部门
+        queryset = Users.objects.filter(dept__id__in=target_dept or [])
+    elif target_type in [3]:  # 系统通知
+        queryset = Users.objects.all()
+    else:
+        return list(dict.fromkeys(int(user) for user in target_user or []))
+    return list(queryset.order_by().values_list('id', flat=True).distinct())
+
+
+class MessageFanout:
+    """
+    消息分发
+    """
+
+    def __init__(self, chunk_size=1000, send_batch_size=500):
+        self.chunk_size = chunk_size
+        self.send_batch_size = send_batch_size
+
+    def create_target_users(self, message_center, user_ids, request=None):
+        """
+        分批写入目标用户记录, 审计字段与 CustomModelSerializer.create 一致
+        """
+        audit = {}
+        user = getattr(request, "user", None)
+        if getattr(user, "is_authenticated", False) is True:
+            audit = {"creator_id": user.id, "modifier": user.id, "dept_belong_id": getattr(user, "dept_id", None)}
+        for index in range(0, len(user_ids), self.chunk_size):
+            MessageCenterTargetUser.objects.bulk_create([
+                MessageCenterTargetUser(messagecenter_id=message_center.id, users_id=user_id, **audit)
+                for user_id in user_ids[index:index + self.chunk_size]
+            ])
+
+    def get_unread_counts(self, user_ids):
+        """
+        分批读取目标用户的未读数量, 尚未统计的用户(未连接过 websocket, 不在线)不返回
+        """
+        unread_counts = {}
+        for index in range(0, len(user_ids), self.chunk_size):
+            unread_counts.update(MessageCenterUserState.objects.filter(
+                users_id__in=user_ids[index:index + self.chunk_size]
+            ).exclude(unread_count=None).values_list('users_id', 'unread_count'))
+        return unread_counts
+
+    def send(self, events):
+        """
+        在同一个事件循环中分批并发推送
+        :param events: [(分组名, 消息)]
+        """
+        if not events:
+            return
+        channel_layer = get_channel_layer()
+
+        async def _send_all():
+            for index in range(0, len(events), self.send_batch_size):
+                results = await asyncio.gather(*[
+                    channel_layer.group_send(group, {"type": "push.message", "json": message})
+                    for group, message in events[index:index + self.send_batch_size]
+                ], return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        logger.warning(f"消息推送失败: {result}")
+
+        async_to_sync(_send_all)()
+
+    def fan_out(self, message_center, user_ids, message, request=None):
+        """
+        分发消息
+        :param message_center: MessageCenter 实例
+        :param user_ids: 目标用户id
+        :param message: 推送的消息内容, 会附加 unread 未读数量
+        :param request:
+        :return: 各阶段耗时
+        """
+        timings = {"users": len(user_ids)}
+        start = time.monotonic()
+        with transaction.atomic():
+            self.create_target_users(message_center, user_ids, request)
+            for index in range(0, len(user_ids), self.chunk_size):
+                change_unread_count(1, user_ids[index:index + self.chunk_size])
+        timings["insert"] = round(time.monotonic() - start, 3)
+
+        start = time.monotonic()
+        unread_counts = self.get_unread_counts(user_ids)
+        timings["unread"] = round(time.monotonic() - start, 3)
+
+        start = time.monotonic()
+        self.send([
+            ("user_" + str(user_id), {**message, 'unread': unread_count})
+            for user_id, unread_count in unread_counts.items()
+        ])
+        timings["send"] = round(time.monotonic() - start, 3)
+        logger.info(f"消息分发完成: {message_center.id}, {timings}")
+        return timings
+
+    def broadcast(self, message_center, message):
+        """
+        分发广播消息: 只推送一次到广播分组, 由各连接自行读取未读数量
+        """
+        start = time.monotonic()
+        change_unread_count(1)
+        timings = {"unread": round(time.monotonic() - start, 3)}
+
+        def _send():
+            start = time.monotonic()
+            async_to_sync(get_channel_layer().group_send)(
+                BROADCAST_GROUP, {"type": "push.broadcast", "json": message})
+            timings["send"] = round(time.monotonic() - start, 3)
+            logger.info(f"广播消息分发完成: {message_center.id}, {timings}")
+
+        # 事务提交后再推送, 保证各连接读取到的未读数量已包含该消息
+        transaction.on_commit(_send)
+        return timings
+
+
+message_fanout = MessageFanout()
@@ -9,7 +9,7 @@ from django.contrib.auth.models import AnonymousUser
 from django.http import HttpResponse, HttpResponseServerError
 from django.utils.deprecation import MiddlewareMixin
 
-from dvadmin.system.models import OperationLog
+from dvadmin.utils.operation_log import save_operation_log
 from dvadmin.utils.request_util import get_request_user, get_request_ip, get_request_data, get_request_path, get_os, \
     get_browser, get_verbose_name
 
@@ -23,7 +23,6 @@ class ApiLoggingMiddleware(MiddlewareMixin):
         super().__init__(get_response)
         self.enable = getattr(settings, 'API_LOG_ENABLE', None) or False
         self.methods = getattr(settings, 'API_LOG_METHODS', None) or set()
-        self.operation_log_id = None
 
     @classmethod
     def __handle_request(cls, request):
@@ -46,32 +45,30 @@ class ApiLoggingMiddleware(MiddlewareMixin):
         except Exception:
             return
         user = get_request_user(request)
-        info = {
-            'request_ip': getattr(request, 'request_ip', 'unknown'),
-            'creator': user if not isinstance(user, AnonymousUser) else None,
-            'dept_belong_id': getattr(request.user, 'dept_id', None),
-            'request_method': request.method,
-            'request_path': request.request_path,
-            'request_body': body,
-            'response_code': response.data.get('code'),
-            'request_os': get_os(request),
-            'request_browser': get_browser(request),
-            'request_msg': request.session.get('request_msg'),
-            'status': True if response.data.get('code') in [2000, ] else False,
-            'json_result': {"code": response.data.get('code'), "msg": response.data.get('msg')},
-        }
-        operation_log, creat = OperationLog.objects.update_or_create(defaults=info, id=self.operation_log_id)
-        if not operation_log.request_modular and settings.API_MODEL_MAP.get(request.request_path, None):
-            operation_log.request_modular = settings.API_MODEL_MAP[request.request_path]
-            operation_log.save()
+        # 中间件实例在并发请求间共享, 请求相关的状态只保存在 request 上
+        request_modular = getattr(request, 'request_modular', None) or settings.API_MODEL_MAP.get(
+            request.request_path, None)
+        save_operation_log(
+            request_modular=request_modular,
+            request_ip=getattr(request, 'request_ip', 'unknown'),
+            creator_id=user.id if user and not isinstance(user, AnonymousUser) else None,
+            dept_belong_id=getattr(request.user, 'dept_id', None),
+            request_method=request.method,
+            request_path=request.request_path,
+            request_body=body,
+            response_code=response.data.get('code'),
+            request_os=get_os(request),
+            request_browser=get_browser(request),
+            request_msg=request.session.get('request_msg'),
+            status=True if response.data.get('code') in [2000, ] else False,
+            json_result={"code": response.data.get('code'), "msg": response.data.get('msg')},
+        )
 
     def process_view(self, request, view_func, view_args, view_kwargs):
         if hasattr(view_func, 'cls') and hasattr(view_func.cls, 'queryset'):
             if self.enable:
                 if self.methods == 'ALL' or request.method in self.methods:
-                    log = OperationLog(request_modular=get_verbose_name(view_func.cls.queryset))
-                    log.save()
-                    self.operation_log_id = log.id
+                    request.request_modular = get_verbose_name(view_func.cls.queryset)
 
         return
 
@@ -7,9 +7,11 @@
 @Remark: 公共基础model类
 """
 from importlib import import_module
+from types import MappingProxyType
 
 from django.apps import apps
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.conf import settings
 
 from application import settings
@@ -88,29 +90,27 @@ class CoreModel(models.Model):
         verbose_name_plural = verbose_name
 
 
+def subquery_count(queryset, field, outer_ref="pk"):
+    """
+    关联数量的子查询, 用于 annotate, 避免逐条 count
+    :param queryset: 被统计的查询集
+    :param field: 被统计表中指向外层查询的字段
+    :param outer_ref: 外层查询中被指向的字段
+    :return: 数量表达式, 没有关联数据时为0
+    """
+    queryset = queryset.filter(**{field: models.OuterRef(outer_ref)}).order_by().values(field)
+    return Coalesce(models.Subquery(queryset.annotate(count=models.Count("*")).values("count")), 0)
+
+
 def get_all_models_objects(model_name=None):
     """
     获取所有 models 对象
     :return: {}
     """
-    settings.ALL_MODELS_OBJECTS = {}
     if not settings.ALL_MODELS_OBJECTS:
-        all_models = apps.get_models()
-        for item in list(all_models):
-            table = {
-                "tableName": item._meta.verbose_name,
-                "table": item.__name__,
-                "tableFields": []
-            }
-            for field in item._meta.fields:
-                fields = {
-                    "title": field.verbose_name,
-                    "field": field.name
-                }
-                table['tableFields'].append(fields)
-            settings.ALL_MODELS_OBJECTS.setdefault(item.__name__, {"table": table, "object": item})
+        settings.ALL_MODELS_OBJECTS = get_model_registry().all_models
     if model_name:
-        return settings.ALL_MODELS_OBJECTS[model_name] or {}
+        return settings.ALL_MODELS_OBJECTS.get(model_name) or {}
     return settings.ALL_MODELS_OBJECTS or {}
 
 
@@ -141,10 +141,16 @@ def get_model_from_app(app_name):
 
 def get_custom_app_models(app_name=None):
     """
-    获取所有项目下的app里的models
+    获取所有项目下的app里的models, 不指定 app 时使用启动时生成的模型注册表
     """
     if app_name:
         return get_model_from_app(app_name)
+    if _model_registry is not None:
+        return list(_model_registry.models)
+    return _scan_custom_app_models()
+
+
+def _scan_custom_app_models():
     all_apps = apps.get_app_configs()
     res = []
     for app in all_apps:
@@ -160,3 +166,63 @@ def get_custom_app_models(app_name=None):
         except Exception as e:
             pass
     return res
+
+
+class ModelRegistry:
+    """
+    模型注册表, 启动时(SystemConfig.ready)生成一次, 生成后不可修改
+    (1)models: 与 get_custom_app_models() 格式一致的项目 app 模型列表
+    (2)按模型名、模型类 O(1) 查找
+    (3)all_models: 与 get_all_models_objects() 格式一致的全部模型, 另含数据库表名 db_table
+    """
+
+    def __init__(self):
+        models_list = []
+        for item in _scan_custom_app_models():
+            models_list.append(MappingProxyType({
+                **item,
+                'fields': tuple(MappingProxyType(field) for field in item['fields']),
+            }))
+        self.models = tuple(models_list)
+        by_name = {}
+        by_class = {}
+        for item in self.models:
+            by_name.setdefault(item['model'], item)
+            by_class.setdefault(item['object'], item)
+        self.by_name = MappingProxyType(by_name)
+        self.by_class = MappingProxyType(by_class)
+        all_models = {}
+        for model in apps.get_models():
+            table = MappingProxyType({
+                "tableName": model._meta.verbose_name,
+                "table": model.__name__,
+                "tableFields": tuple(
+                    MappingProxyType({"title": field.verbose_name, "field": field.name}) for field in model._meta.fields
+                ),
+            })
+            all_models.setdefault(model.__name__, MappingProxyType({
+                "table": table, "object": model, "db_table": model._meta.db_table
+            }))
+        self.all_models = MappingProxyType(all_models)
+
+    def get_by_model(self, model):
+        """
+        按模型类获取, 非项目 app 的模型返回 None
+        """
+        return self.by_class.get(model)
+
+    def get_by_name(self, model_name):
+        return self.by_name.get(model_name)
+
+
+_model_registry = None
+
+
+def get_model_registry():
+    """
+    获取模型注册表, 尚未生成时立即生成
+    """
+    global _model_registry
+    if _model_registry is None:
+        _model_registry = ModelRegistry()
+    return _model_registry
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 操作日志异步批量写入
+请求结束时构建一条不可变的日志记录放入进程内有界队列, 后台线程按条数或时间阈值批量 bulk_create 落库
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from types import MappingProxyType
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from application import dispatch
+from dvadmin.utils.count_strategy import refresh_count_version
+
+logger = logging.getLogger(__name__)
+
+
+class OperationLogWriter:
+    """
+    操作日志写入器
+    (1)队列已满时最多等待 block_timeout 秒(背压), 仍无法放入则丢弃并计数
+    (2)后台线程累计 batch_size 条或距上次写入超过 flush_interval 秒时批量写入
+    (3)进程退出时写入队列中剩余日志
+    """
+    _stop = object()
+
+    def __init__(self, queue_size=10000, batch_size=200, flush_interval=1.0, block_timeout=0.05):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _ensure_started(self):
+        # gunicorn 等 fork 子进程后线程不会被继承, 按进程号重新启动; 线程意外退出时也重新启动
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+            else:
+                logger.warning("操作日志写入线程已退出, 重新启动")
+            self._thread = threading.Thread(target=self._run, name="operation-log-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    @staticmethod
+    def make_record(**fields):
+        """
+        构建日志记录, 记录创建后不可修改
+        """
+        schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else None
+        return MappingProxyType({"schema_name": schema_name, "fields": MappingProxyType(fields)})
+
+    def submit(self, record):
+        """
+        提交日志记录
+        :param record: make_record 构建的日志记录
+        :return: 是否成功放入队列
+        """
+        self._ensure_started()
+        try:
+            self._queue.put(record, timeout=self.block_timeout)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"操作日志队列已满, 已累计丢弃 {self.dropped} 条")
+            return False
+        self.submitted += 1
+        return True
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                record = None
+            if record is self._stop:
+                self._safe_write(batch)
+                return
+            if record is not None:
+                batch.append(record)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._safe_write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _safe_write(self, records):
+        """
+        写入一批日志, 任何异常只丢弃本批, 不终止后台线程
+        """
+        try:
+            self._write(records)
+        except Exception as e:
+            self.failed += len(records)
+            logger.exception(f"操作日志写入失败, 丢弃 {len(records)} 条: {e}")
+
+    def _write(self, records):
+        if not records:
+            return
+        from dvadmin.system.models import OperationLog
+
+        groups = {}
+        for record in records:
+            groups.setdefault(record["schema_name"], []).append(OperationLog(**record["fields"]))
+        close_old_connections()
+        for schema_name, objs in groups.items():
+            try:
+                if schema_name:
+                    from django_tenants.utils import schema_context
+
+                    with schema_context(schema_name):
+                        self._bulk_create(OperationLog, objs)
+                else:
+                    self._bulk_create(OperationLog, objs)
+                self.written += len(objs)
+            except Exception as e:
+                self.failed += len(objs)
+                logger.exception(f"操作日志写入失败, 丢弃 {len(objs)} 条: {e}")
+
+    def _bulk_create(self, model, objs):
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        # bulk_create 不触发保存信号, 使缓存的分页总数失效
+        refresh_count_version(model)
+
+    def flush(self, timeout=5):
+        """
+        停止后台线程并写入队列中剩余的日志
+        """
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(self._stop, timeout=timeout)
+        except queue.Full:
+            logger.warning("操作日志队列已满, 退出时未能全部写入")
+            return
+        self._thread.join(timeout)
+        self._pid = None
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+operation_log_writer = OperationLogWriter(
+    queue_size=getattr(settings, "API_LOG_QUEUE_SIZE", 10000),
+    batch_size=getattr(settings, "API_LOG_BATCH_SIZE", 200),
+    flush_interval=getattr(settings, "API_LOG_FLUSH_INTERVAL", 1.0),
+    block_timeout=getattr(settings, "API_LOG_BLOCK_TIMEOUT", 0.05),
+)
+atexit.register(operation_log_writer.flush)
+
+
+def save_operation_log(**fields):
+    """
+    保存操作日志, API_LOG_ASYNC 关闭时同步写入
+    """
+    if getattr(settings, "API_LOG_ASYNC", True):
+        return operation_log_writer.submit(OperationLogWriter.make_record(**fields))
+    from dvadmin.system.models import OperationLog
+
+    OperationLog.objects.create(**fields)
+    return True
@@ -7,25 +7,58 @@
 
 @Created on: 2020/4/16 23:35
 """
+import base64
+import datetime
+import json
 from collections import OrderedDict
 
 from django.core import paginator
+from django.core.exceptions import FieldDoesNotExist
 from django.core.paginator import Paginator as DjangoPaginator, InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+from dvadmin.utils.count_strategy import get_count
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    游标编码, 时间保留微秒(DjangoJSONEncoder 会截断为毫秒, 导致定位不准)
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
 
 class CustomPagination(PageNumberPagination):
+    """
+    分页
+    (1)默认按页码分页
+    (2)视图集设置 keyset_pagination = True 且请求参数带 cursor(第一页为空值)时, 使用游标分页:
+       按当前排序(默认 -create_datetime)加主键定位, 不使用 OFFSET, 响应额外返回 next_cursor、prev_cursor;
+       默认不统计总数(total 为 null), 视图集设置 keyset_total = True 时统计
+    (3)总数按视图集的 count_strategy 统计(见 dvadmin.utils.count_strategy), 响应中 total_exact 表示总数是否精确
+    """
     page_size = 10
     page_size_query_param = "limit"
     max_page_size = 999
     django_paginator_class = DjangoPaginator
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "无效的游标"
 
     def paginate_queryset(self, queryset, request, view=None):
         """
         Paginate a queryset if required, either returning a
         page object, or `None` if pagination is not configured for this view.
         """
+        self.keyset = getattr(view, "keyset_pagination", False) and self.cursor_query_param in request.query_params
+        if self.keyset:
+            return self.paginate_queryset_keyset(queryset, request, view)
         empty = True
 
         page_size = self.get_page_size(request)
@@ -33,6 +66,7 @@ class CustomPagination(PageNumberPagination):
             return None
 
         paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count, self.total_exact = get_count(queryset, getattr(view, "count_strategy", "exact"))
         page_number = request.query_params.get(self.page_query_param, 1)
         if page_number in self.last_page_strings:
             page_number = paginator.num_pages
@@ -57,7 +91,112 @@ class CustomPagination(PageNumberPagination):
 
         return list(self.page)
 
+    @staticmethod
+    def get_keyset_ordering(queryset):
+        """
+        游标分页的排序字段, 只支持模型本身的非空字段, 任一字段可为空时使用 -create_datetime; 最后总是加上主键保证唯一
+        (auto_now_add 的字段保存时总会赋值, 按非空处理)
+        :return: [(字段, 是否倒序)]
+        """
+        opts = queryset.model._meta
+        ordering = queryset.query.order_by or (queryset.query.get_meta().ordering if queryset.ordered else [])
+        fields = []
+        for item in ordering:
+            name = item.lstrip("-") if isinstance(item, str) else None
+            try:
+                field = opts.pk if name == "pk" else opts.get_field(name)
+            except FieldDoesNotExist:
+                field = None
+            if field is None or not field.concrete or field.many_to_many or (
+                    field.null and not getattr(field, "auto_now_add", False)):
+                # 空值无法参与游标比较(x < NULL), 且会跳过空值记录
+                fields = []
+                break
+            fields.append((field.attname, item.startswith("-")))
+        if not fields:
+            fields = [("create_datetime", True)] if any(
+                field.name == "create_datetime" for field in opts.concrete_fields) else []
+        descending = fields[-1][1] if fields else True
+        if opts.pk.attname not in [name for name, _ in fields]:
+            fields.append((opts.pk.attname, descending))
+        return fields
+
+    def encode_cursor(self, instance, ordering, reverse):
+        values = [getattr(instance, name) for name, _ in ordering]
+        data = json.dumps({"v": values, "r": reverse}, cls=CursorEncoder, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor, model, ordering):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            values = data["v"]
+            if len(values) != len(ordering):
+                raise ValueError
+            values = [model._meta.get_field(name).to_python(value) for (name, _), value in zip(ordering, values)]
+            return values, bool(data.get("r"))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def get_keyset_filter(ordering, values):
+        """
+        (a, b) 之后的记录: a > va or (a = va and b > vb), 倒序时为小于
+        """
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(ordering, values):
+            lookup = "lt" if descending else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset_keyset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size_value = self.get_page_size(request) or self.page_size
+        self.ordering = ordering = self.get_keyset_ordering(queryset)
+        cursor = request.query_params.get(self.cursor_query_param)
+        queryset_all = queryset
+        reverse = False
+        if cursor:
+            values, reverse = self.decode_cursor(cursor, queryset.model, ordering)
+            direction = [(name, descending != reverse) for name, descending in ordering]
+            queryset = queryset.filter(self.get_keyset_filter(direction, values))
+        else:
+            direction = ordering
+        queryset = queryset.order_by(*[f"-{name}" if descending else name for name, descending in direction])
+        self.total, self.total_exact = None, False
+        if getattr(view, "keyset_total", False):
+            self.total, self.total_exact = get_count(queryset_all, getattr(view, "count_strategy", "exact"))
+        results = list(queryset[:self.page_size_value + 1])
+        has_more = len(results) > self.page_size_value
+        results = results[:self.page_size_value]
+        if reverse:
+            results.reverse()
+            self.is_next, self.is_previous = True, has_more
+        else:
+            self.is_next, self.is_previous = has_more, bool(cursor)
+        self.next_cursor = self.encode_cursor(results[-1], ordering, False) if results and self.is_next else None
+        self.prev_cursor = self.encode_cursor(results[0], ordering, True) if results and self.is_previous else None
+        return results
+
+    def get_keyset_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('code', 2000),
+            ('msg', 'success' if data else "暂无数据"),
+            ('page', int(self.request.query_params.get(self.page_query_param) or 1)),
+            ('limit', self.page_size_value),
+            ('total', self.total),
+            ('total_exact', self.total_exact),
+            ('is_next', self.is_next),
+            ('is_previous', self.is_previous),
+            ('next_cursor', self.next_cursor),
+            ('prev_cursor', self.prev_cursor),
+            ('data', data or [])
+        ]))
+
     def get_paginated_response(self, data):
+        if getattr(self, "keyset", False):
+            return self.get_keyset_paginated_response(data)
         code = 2000
         msg = 'success'
         page = int(self.get_page_number(self.request, paginator)) or 1
@@ -77,6 +216,7 @@ class CustomPagination(PageNumberPagination):
             ('page', page),
             ('limit', limit),
             ('total', total),
+            ('total_exact', getattr(self, 'total_exact', True)),
             ('is_next', is_next),
             ('is_previous', is_previous),
             ('data', data)
@@ -6,13 +6,21 @@
 @Created on: 2021/6/6 006 10:30
 @Remark: 自定义权限
 """
+import logging
 import re
+import threading
 
 from django.contrib.auth.models import AnonymousUser
 from django.db.models import F
 from rest_framework.permissions import BasePermission
 
 from dvadmin.system.models import ApiWhiteList, RoleMenuButtonPermission
+from dvadmin.utils.cache import get_cache_version, bump_cache_version, get_schema_name
+
+logger = logging.getLogger(__name__)
+
+# 接口权限缓存的版本号命名空间
+PERMISSION_CACHE_VERSION = "permission"
 
 
 def ValidationApi(reqApi, validApi):
@@ -59,6 +67,130 @@ def ReUUID(api):
         return None
 
 
+class ApiPermissionIndex:
+    """
+    接口权限索引(进程内缓存)
+    (1)按角色集合把接口白名单与角色接口权限编译为一个合并正则, 权限校验只需一次匹配
+    (2)用户 -> 角色集合 同样缓存在进程内
+    (3)RoleMenuButtonPermission、MenuButton、ApiWhiteList 或用户角色变化时, 通过共享缓存版本号失效
+    (4)多租户模式下每个 schema 各自缓存, 版本号也按 schema 区分
+    """
+    version_name = PERMISSION_CACHE_VERSION
+    methodList = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH']
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # {schema: {"version": 版本号, "matchers": {角色集合: 正则}, "user_roles": {用户id: 角色集合}}}
+        self._states = {}
+
+    def _get_state(self):
+        schema_name = get_schema_name()
+        version = get_cache_version(self.version_name)
+        state = self._states.get(schema_name)
+        if state is None or state["version"] != version:
+            with self._lock:
+                state = self._states.get(schema_name)
+                if state is None or state["version"] != version:
+                    state = {"version": version, "matchers": {}, "user_roles": {}}
+                    self._states[schema_name] = state
+        return state
+
+    @staticmethod
+    def _build_patterns(queryset):
+        return [
+            str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
+                item.get('permission__method')) + '$' for item in queryset if item.get('permission__api')]
+
+    def _compile(self, role_ids):
+        # ***接口白名单***
+        api_white_list = ApiWhiteList.objects.values(permission__api=F('url'), permission__method=F('method'))
+        # 获取角色拥有的所有接口
+        user_api_list = RoleMenuButtonPermission.objects.filter(role__in=role_ids).values(
+            permission__api=F('menu_button__api'), permission__method=F('menu_button__method'))
+        patterns = []
+        for item in self._build_patterns(api_white_list) + self._build_patterns(user_api_list):
+            try:
+                re.compile(item)
+            except re.error:
+                logger.warning(f"接口权限规则无效,已忽略: {item}")
+                continue
+            patterns.append(f"(?:{item})")
+        if not patterns:
+            return None
+        return re.compile("|".join(patterns), re.M | re.I)
+
+    def get_role_ids(self, user):
+        """
+        获取用户的角色id集合
+        :param user: 用户
+        :return: frozenset
+        """
+        user_roles = self._get_state()["user_roles"]
+        role_ids = user_roles.get(user.id)
+        if role_ids is None:
+            role_ids = frozenset(user.role.values_list('id', flat=True))
+            if len(user_roles) >= self.max_size:
+                user_roles.clear()
+            user_roles[user.id] = role_ids
+        return role_ids
+
+    def get_matcher(self, role_ids):
+        """
+        获取角色集合对应的合并正则
+        :param role_ids: 角色id集合
+        :return: 编译后的正则, 无任何接口权限时为None
+        """
+        matchers = self._get_state()["matchers"]
+        key = frozenset(role_ids)
+        if key in matchers:
+            self.hits += 1
+            return matchers[key]
+        self.misses += 1
+        matcher = self._compile(key)
+        with self._lock:
+            if len(matchers) >= self.max_size:
+                matchers.clear()
+            matchers[key] = matcher
+        return matcher
+
+    def has_permission(self, user, api, method):
+        """
+        验证用户是否有接口权限
+        :param user: 当前用户
+        :param api: 当前请求的接口
+        :param method: 当前请求方法
+        :return: True或者False
+        """
+        method = self.methodList.index(method)
+        matcher = self.get_matcher(self.get_role_ids(user))
+        if matcher is None:
+            return False
+        return matcher.match(api + ":" + str(method)) is not None
+
+    def stats(self):
+        """
+        缓存命中统计
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": sum(len(state["matchers"]) for state in self._states.values()),
+            "versions": {schema_name: state["version"] for schema_name, state in self._states.items()},
+        }
+
+    def invalidate(self):
+        """
+        使所有进程的权限索引失效
+        """
+        bump_cache_version(self.version_name)
+
+
+permission_index = ApiPermissionIndex()
+
+
 class CustomPermission(BasePermission):
     """自定义权限"""
 
@@ -69,30 +201,6 @@ class CustomPermission(BasePermission):
         if request.user.is_superuser:
             return True
         else:
-            api = request.path  # 当前请求接口
-            method = request.method  # 当前请求方法
-            methodList = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH']
-            method = methodList.index(method)
-            # ***接口白名单***
-            api_white_list = ApiWhiteList.objects.values(permission__api=F('url'), permission__method=F('method'))
-            api_white_list = [
-                str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
-                    item.get('permission__method')) + '$' for item in api_white_list if item.get('permission__api')]
-            # ********#
             if not hasattr(request.user, "role"):
                 return False
-            role_id_list = request.user.role.values_list('id',flat=True)
-            userApiList = RoleMenuButtonPermission.objects.filter(role__in=role_id_list).values(permission__api=F('menu_button__api'), permission__method=F('menu_button__method'))  # 获取当前用户的角色拥有的所有接口
-            ApiList = [
-                str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
-                    item.get('permission__method')) + '$' for item in userApiList if item.get('permission__api')]
-            new_api_ist = api_white_list + ApiList
-            new_api = api + ":" + str(method)
-            for item in new_api_ist:
-                matchObj = re.match(item, new_api, re.M | re.I)
-                if matchObj is None:
-                    continue
-                else:
-                    return True
-            else:
-                return False
+            return permission_index.has_permission(request.user, request.path, request.method)
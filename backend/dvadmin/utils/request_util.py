@@ -3,7 +3,6 @@ Request工具类
 """
 import json
 
-import requests
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import AnonymousUser
@@ -12,6 +11,7 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from user_agents import parse
 
 from dvadmin.system.models import LoginLog
+from dvadmin.utils.ip_location import empty_location, get_ip_locator, update_login_location
 
 
 def get_request_user(request):
@@ -175,40 +175,24 @@ def get_ip_analysis(ip):
     :param ip: ip地址
     :return:
     """
-    data = {
-        "continent": "",
-        "country": "",
-        "province": "",
-        "city": "",
-        "district": "",
-        "isp": "",
-        "area_code": "",
-        "country_english": "",
-        "country_code": "",
-        "longitude": "",
-        "latitude": ""
-    }
+    data = empty_location()
     if ip != 'unknown' and ip:
         if getattr(settings, 'ENABLE_LOGIN_ANALYSIS_LOG', True):
-            try:
-                res = requests.get(url='https://ip.django-vue-admin.com/ip/analysis', params={"ip": ip}, timeout=5)
-                if res.status_code == 200:
-                    res_data = res.json()
-                    if res_data.get('code') == 0:
-                        data = res_data.get('data')
-                return data
-            except Exception as e:
-                print(e)
+            data.update(get_ip_locator().lookup(ip) or {})
     return data
 
 
 def save_login_log(request):
     """
     保存登录日志
+    (1)ip归属地已缓存时直接写入
+    (2)否则先写入登录日志, 归属地在后台查询后补充, 不阻塞登录请求
     :return:
     """
     ip = get_request_ip(request=request)
-    analysis_data = get_ip_analysis(ip)
+    enable_analysis = ip != 'unknown' and ip and getattr(settings, 'ENABLE_LOGIN_ANALYSIS_LOG', True)
+    location = get_ip_locator().get_cached(ip) if enable_analysis else None
+    analysis_data = {**empty_location(), **(location or {})}
     analysis_data['username'] = request.user.username
     analysis_data['ip'] = ip
     analysis_data['agent'] = str(parse(request.META['HTTP_USER_AGENT']))
@@ -216,4 +200,9 @@ def save_login_log(request):
     analysis_data['os'] = get_os(request)
     analysis_data['creator_id'] = request.user.id
     analysis_data['dept_belong_id'] = getattr(request.user, 'dept_id', '')
-    LoginLog.objects.create(**analysis_data)
+    login_log = LoginLog.objects.create(**analysis_data)
+    if enable_analysis and location is None:
+        if getattr(settings, 'IP_LOCATION_ASYNC', True):
+            update_login_location(login_log.id, ip)
+        else:
+            LoginLog.objects.filter(id=login_log.id).update(**get_ip_analysis(ip))
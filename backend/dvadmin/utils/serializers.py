@@ -9,42 +9,89 @@
 from rest_framework import serializers
 from rest_framework.fields import empty
 from rest_framework.request import Request
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import ModelSerializer, ListSerializer
+from django.db import models
 from django.utils.functional import cached_property
 from rest_framework.utils.serializer_helpers import BindingDict
 
-from dvadmin.system.models import Users
+from dvadmin.utils.field_permission import get_forbidden_fields
+from dvadmin.utils.identity import get_identity_resolver
 from django_restql.mixins import DynamicFieldsMixin
 
 
+class CustomListSerializer(ListSerializer):
+    """
+    列表序列化前一次解析整页数据的创建人、修改人名称
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        instances = list(iterable)
+        if isinstance(self.child, CustomModelSerializer):
+            self.child.prime_identities(instances)
+        return super().to_representation(instances)
+
+
 class CustomModelSerializer(DynamicFieldsMixin, ModelSerializer):
     """
     增强DRF的ModelSerializer,可自动更新模型的审计字段记录
     (1)self.request能获取到rest_framework.request.Request对象
+    (2)创建人、修改人名称按请求批量解析, 列表序列化时整页只查询一次, 见 dvadmin.utils.identity
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = getattr(cls, "Meta", None)
+        if meta is not None and not hasattr(meta, "list_serializer_class"):
+            meta.list_serializer_class = CustomListSerializer
+
+    # SerializerMethodField 等 source 为 "*" 的字段读取的模型字段, 列权限延迟加载字段时使用, 例如:
+    # method_field_sources = {"dept_name_all": ["dept"]}; 有未声明的此类字段时不延迟加载
+    method_field_sources = {}
+
     # 修改人的审计字段名称, 默认modifier, 继承使用时可自定义覆盖
     modifier_field_id = "modifier"
     modifier_name = serializers.SerializerMethodField(read_only=True)
     dept_belong_id = serializers.IntegerField(required=False, allow_null=True)
 
     def get_modifier_name(self, instance):
-        if not hasattr(instance, "modifier"):
-            return None
-        queryset = (
-            Users.objects.filter(id=instance.modifier)
-            .values_list("name", flat=True)
-            .first()
-        )
-        if queryset:
-            return queryset
-        return None
+        return self.get_identity_resolver().get_name(getattr(instance, self.modifier_field_id, None))
 
     # 创建人的审计字段名称, 默认creator, 继承使用时可自定义覆盖
     creator_field_id = "creator"
-    creator_name = serializers.SlugRelatedField(
-        slug_field="name", source="creator", read_only=True
-    )
+    creator_name = serializers.SerializerMethodField(read_only=True)
+
+    def get_creator_name(self, instance):
+        return self.get_identity_resolver().get_name(getattr(instance, f"{self.creator_field_id}_id", None))
+
+    def get_method_field_sources(self):
+        """
+        source 为 "*" 的字段读取的模型字段, 包含创建人、修改人名称
+        """
+        return {
+            "modifier_name": [self.modifier_field_id],
+            "creator_name": [self.creator_field_id],
+            **self.method_field_sources,
+        }
+
+    def get_identity_resolver(self):
+        """
+        当前请求的用户名称解析器, 无请求时绑定在根序列化器上
+        """
+        return get_identity_resolver(self.request if self.request is not None else self.root)
+
+    def prime_identities(self, instances):
+        """
+        批量解析一组数据的创建人、修改人名称
+        """
+        user_ids = []
+        fields = self.fields
+        if "modifier_name" in fields:
+            user_ids += [getattr(instance, self.modifier_field_id, None) for instance in instances]
+        if "creator_name" in fields:
+            user_ids += [getattr(instance, f"{self.creator_field_id}_id", None) for instance in instances]
+        if user_ids:
+            self.get_identity_resolver().prime(user_ids)
     # 数据所属部门字段
     dept_belong_id_field_name = "dept_belong_id"
     # 添加默认时间返回格式
@@ -59,6 +106,42 @@ class CustomModelSerializer(DynamicFieldsMixin, ModelSerializer):
         super().__init__(instance, data, **kwargs)
         self.request: Request = request or self.context.get("request", None)
 
+    def get_fields(self):
+        """
+        按当前用户的列权限去掉禁止查询的字段, 禁止新增/修改的字段设为只读
+        配置了列权限字段的模型, 没有授权记录的列默认禁止(见 get_role_field_permissions)
+        新增时禁止填写的必填字段记录在 forbidden_required_fields, 校验时返回错误
+        """
+        fields = super().get_fields()
+        self.forbidden_required_fields = []
+        request = getattr(self, "request", None)
+        model = getattr(getattr(self, "Meta", None), "model", None)
+        forbidden = get_forbidden_fields(request, model) if request is not None and model else None
+        if not forbidden:
+            return fields
+        writing = request.method in ("POST", "PUT", "PATCH")
+        write_forbidden = forbidden["create"] if self.instance is None else forbidden["update"]
+        for name in list(fields):
+            if writing and self.instance is None and name in write_forbidden and fields[name].required:
+                self.forbidden_required_fields.append(name)
+            if name in forbidden["query"]:
+                if writing and name not in write_forbidden and not fields[name].read_only:
+                    # 可写但不可查看
+                    fields[name].write_only = True
+                else:
+                    fields.pop(name)
+            elif writing and name in write_forbidden:
+                fields[name].read_only = True
+        return fields
+
+    def to_internal_value(self, data):
+        # 必填字段设为只读后无法保存, 直接返回错误; 首次访问 self.fields 时由 get_fields 记录
+        if self.fields and getattr(self, "forbidden_required_fields", None):
+            raise serializers.ValidationError(
+                {name: ["没有该必填字段的新增权限"] for name in self.forbidden_required_fields}
+            )
+        return super().to_internal_value(data)
+
     def save(self, **kwargs):
         return super().save(**kwargs)
 
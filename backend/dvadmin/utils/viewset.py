@@ -7,6 +7,8 @@
 @Remark: 自定义视图集
 """
 from django.db import transaction
+from django.db.models import QuerySet
+from django.utils.functional import SimpleLazyObject
 from django_filters import DateTimeFromToRangeFilter
 from django_filters.rest_framework import FilterSet
 from drf_yasg import openapi
@@ -14,12 +16,15 @@ from drf_yasg.utils import swagger_auto_schema
 from rest_framework.decorators import action
 from rest_framework.viewsets import ModelViewSet
 
+from dvadmin.utils.count_strategy import register_counted_model
+from dvadmin.utils.eager_loading import apply_eager_loading
 from dvadmin.utils.filters import DataLevelPermissionsFilter, CoreModelFilterBankend
 from dvadmin.utils.import_export_mixin import ExportSerializerMixin, ImportSerializerMixin
 from dvadmin.utils.json_response import SuccessResponse, ErrorResponse, DetailResponse
 from dvadmin.utils.permission import CustomPermission
-from dvadmin.utils.models import get_custom_app_models, CoreModel
-from dvadmin.system.models import FieldPermission, MenuField
+from dvadmin.utils.field_permission import get_menu_fields, get_forbidden_fields
+from dvadmin.utils.models import get_model_registry, CoreModel
+from dvadmin.system.models import FieldPermission
 from django_restql.mixins import QueryArgumentsMixin
 
 
@@ -32,6 +37,10 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
     (3)filter_fields = '__all__' 默认支持全部model中的字段查询(除json字段外)
     (4)import_field_dict={} 导入时的字段字典 {model值: model的label}
     (5)export_field_label = [] 导出时的字段
+    (6)async_job_enabled = True 时, 导入/导出请求参数带 async=1 则提交为后台任务
+    (7)keyset_pagination = True 时, 列表请求参数带 cursor 则使用游标分页, 适用于日志等大表
+    (8)count_strategy 分页总数统计方式: exact|estimate|cached|auto, 见 dvadmin.utils.count_strategy
+    (9)eager_loading = True 时, 列表/详情按序列化器字段自动 select_related/prefetch_related, 见 dvadmin.utils.eager_loading
     """
     values_queryset = None
     ordering_fields = '__all__'
@@ -43,12 +52,56 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
     permission_classes = [CustomPermission]
     import_field_dict = {}
     export_field_label = {}
+    async_job_enabled = False
+    keyset_pagination = False
+    keyset_total = False
+    count_strategy = "exact"
+    eager_loading = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        queryset = getattr(cls, "queryset", None)
+        if cls.count_strategy in ("cached", "auto") and queryset is not None:
+            register_counted_model(queryset.model)
 
     def filter_queryset(self, queryset):
         for backend in set(set(self.filter_backends) | set(self.extra_filter_class or [])):
             queryset = backend().filter_queryset(self.request, queryset, self)
+        if self.action in ("list", "retrieve"):
+            queryset = self.defer_forbidden_fields(queryset)
+            if self.eager_loading and isinstance(queryset, QuerySet) and queryset._fields is None:
+                queryset = apply_eager_loading(queryset, self.get_serializer(), self.request)
         return queryset
 
+    def defer_forbidden_fields(self, queryset):
+        """
+        列权限禁止查询的字段不会被序列化, 查询时不加载
+        """
+        if not isinstance(queryset, QuerySet) or queryset._fields is not None:
+            return queryset
+        forbidden = get_forbidden_fields(self.request, queryset.model)
+        if not forbidden or not forbidden["query"]:
+            return queryset
+        # 仍被其他序列化字段使用的模型字段需要加载
+        serializer = self.get_serializer()
+        serializer = getattr(serializer, "child", serializer)
+        method_sources = serializer.get_method_field_sources() if hasattr(serializer, "get_method_field_sources") else {}
+        sources = set()
+        for name, field in serializer.fields.items():
+            if field.source != "*":
+                sources.add(field.source.split(".")[0])
+            elif name in method_sources:
+                sources.update(method_sources[name])
+            else:
+                # 无法确定方法字段读取哪些模型字段, 延迟加载会导致逐条查询
+                return queryset
+        opts = queryset.model._meta
+        defer = [
+            field.name for field in opts.concrete_fields
+            if field.name in forbidden["query"] and field.name not in sources and not field.primary_key
+        ]
+        return queryset.defer(*defer) if defer else queryset
+
     def get_queryset(self):
         if getattr(self, 'values_queryset', None):
             return self.values_queryset
@@ -82,16 +135,11 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
             return serializer_class(*args, **kwargs)
 
     def get_menu_field(self, serializer_class):
-        """获取字段权限"""
-        finded = False
-        for model in get_custom_app_models():
-            if model['object'] is serializer_class.Meta.model:
-                finded = True
-                break
-        if finded is False:
+        """获取字段权限, 使用时才读取"""
+        model = get_model_registry().get_by_model(serializer_class.Meta.model)
+        if model is None:
             return []
-        return MenuField.objects.filter(model=model['model']
-        ).values('field_name', 'title')
+        return SimpleLazyObject(lambda: get_menu_fields(model['model']))
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data, request=request)